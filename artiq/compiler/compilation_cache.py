@@ -0,0 +1,406 @@
+"""
+The :class:`CompilationCache` class remembers the shared libraries built
+for stitched kernels, so that compiling a kernel that is identical to
+a previously compiled one skips code generation, optimization and linking.
+
+Kernels are identified by a content hash of the stitched typedtree, of the
+layout of every embedded host type, of the target and code generation options,
+and of every host value quoted into the kernel. Host objects enter the hash by
+their position in the traversal rather than by identity, so that e.g. a fresh
+closure passed to the same kernel still hits the cache. The identifiers that
+code generation assigns to host objects are recorded alongside the library and
+replayed into the embedding map of the new compilation on a hit.
+
+With parameter slots (see :class:`Stitcher`), the values of scalar attributes
+that are not kernel invariants are left out of the hash. They are stored in
+the data section of the library, and on a hit the new values are written
+at the offsets of the corresponding symbols.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import struct
+import tempfile
+from collections import OrderedDict
+
+import numpy
+from pythonparser import ast
+
+from artiq import __version__ as artiq_version
+from . import types, builtins, asttyped, elf
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+def _is_slot_type(typ):
+    return (builtins.is_bool(typ) or builtins.is_int32(typ) or
+            builtins.is_int64(typ) or builtins.is_float(typ))
+
+
+class _Fingerprint:
+    """
+    :ivar key: (string) hexadecimal SHA-256 digest identifying the kernel
+    :ivar objects: (list) host objects reachable from the quoted values,
+        in traversal order
+    :ivar object_count: (int) number of objects already present in the
+        embedding map after stitching
+    """
+
+    def __init__(self, embedding_map, parameter_slots=False):
+        self.embedding_map = embedding_map
+        self.parameter_slots = parameter_slots
+        self.objects = []
+        self.object_indices = {}
+        self.object_count = embedding_map.object_current_key
+        self.type_printer = types.TypePrinter()
+        self._hash = hashlib.sha256()
+
+    def emit(self, *items):
+        self._hash.update(repr(items).encode("utf-8"))
+
+    def finish(self):
+        self.key = self._hash.hexdigest()
+        del self._hash
+
+    def visit_node(self, node):
+        self.emit("node", type(node).__name__)
+        loc = getattr(node, "loc", None)
+        if loc is not None:
+            buffer = loc.source_buffer
+            if buffer.name == "<synthesized>":
+                # Positions depend on the repr() of the quoted values.
+                self.emit(buffer.name)
+            else:
+                self.emit(buffer.name, buffer.first_line, loc.begin_pos, loc.end_pos)
+        flags = getattr(node, "flags", None)
+        if flags is not None:
+            self.emit("flags", sorted(flags))
+
+        fields = node._fields + getattr(node, "_types", ())
+        for field_name in fields:
+            self.emit(field_name)
+            field = getattr(node, field_name, None)
+            if isinstance(node, asttyped.QuoteT) and field_name == "value":
+                self.visit_value(field, node.type)
+            else:
+                self.visit_field(field)
+
+    def visit_field(self, field):
+        if isinstance(field, ast.AST):
+            self.visit_node(field)
+        elif isinstance(field, list):
+            self.emit("list", len(field))
+            for elt in field:
+                self.visit_field(elt)
+        elif isinstance(field, types.Type):
+            self.emit("type", self.type_printer.name(field))
+        elif field is None or isinstance(field, (bool, int, float, str, bytes)):
+            self.emit(type(field).__name__, field)
+        else:
+            raise _Uncacheable("unexpected field {!r}".format(field))
+
+    def visit_types(self, type_map):
+        for host_type, (instance_type, constructor_type) in type_map.items():
+            self.emit("host_type", getattr(host_type, "__module__", None),
+                      getattr(host_type, "__qualname__", None))
+            for typ in (instance_type, constructor_type):
+                self.emit(typ.name, sorted(getattr(typ, "constant_attributes", ())))
+                for attr, attr_type in typ.attributes.items():
+                    self.emit(attr, self.type_printer.name(attr_type))
+
+    def _visit_object(self, value):
+        index = self.object_indices.get(id(value))
+        if index is not None:
+            self.emit("ref", index)
+            return False
+        self.object_indices[id(value)] = len(self.objects)
+        self.objects.append(value)
+        return True
+
+    def visit_value(self, value, typ):
+        # Mirrors LLVMIRGenerator._quote.
+        typ = typ.find()
+        if types.is_constructor(typ) or types.is_instance(typ) or types.is_module(typ):
+            if not self._visit_object(value):
+                return
+            if types.is_instance(typ):
+                self.visit_value(type(value), typ.constructor)
+            for attr in typ.attributes:
+                if attr == "__objectid__":
+                    continue
+                if self.parameter_slots and types.is_instance(typ) and \
+                        attr not in typ.constant_attributes and \
+                        _is_slot_type(typ.attributes[attr]):
+                    # The type is part of the layout of the host type.
+                    self.emit("slot", attr)
+                    continue
+                attrvalue = getattr(value, attr)
+                if types.is_constructor(typ) and \
+                        types.is_function(typ.attributes[attr]) and \
+                        not types.is_c_function(typ.attributes[attr]):
+                    attrvalue = self.embedding_map.specialize_function(
+                        typ.instance, attrvalue)
+                self.emit("attr", attr)
+                self.visit_value(attrvalue, typ.attributes[attr])
+        elif builtins.is_none(typ):
+            self.emit("none")
+        elif builtins.is_bool(typ) or builtins.is_int(typ):
+            self.emit("int", int(value))
+        elif builtins.is_float(typ):
+            self.emit("float", float(value))
+        elif builtins.is_str(typ) or builtins.is_bytes(typ) or builtins.is_bytearray(typ):
+            self.emit("str", value)
+        elif builtins.is_listish(typ):
+            if isinstance(value, numpy.ndarray) and value.dtype.kind in "biuf":
+                self.emit("array", value.dtype.str, value.shape, value.tobytes())
+            else:
+                elt_type = builtins.get_iterable_elt(typ)
+                self.emit("list", len(value))
+                for elt in value:
+                    self.visit_value(elt, elt_type)
+        elif types.is_tuple(typ):
+            self.emit("tuple", len(value))
+            for elt, elt_type in zip(value, typ.elts):
+                self.visit_value(elt, elt_type)
+        elif types.is_rpc(typ) or types.is_c_function(typ) or types.is_builtin_function(typ):
+            self.emit("external")
+        elif types.is_function(typ):
+            try:
+                name = self.embedding_map.retrieve_function(value)
+            except KeyError:
+                name = self.embedding_map.retrieve_function(value.host_function)
+            self.emit("function", name)
+        elif types.is_method(typ):
+            self.visit_value(value.__func__, types.get_method_function(typ))
+            self.visit_value(value.__self__, types.get_method_self(typ))
+        else:
+            raise _Uncacheable("cannot quote {!r}".format(value))
+
+
+class _Entry:
+    def __init__(self, library, stripped_library, object_count, object_refs,
+                 slots):
+        self.library = library
+        self.stripped_library = stripped_library
+        self.object_count = object_count
+        self.object_refs = object_refs
+        # (object index, attribute, struct format, offset in stripped library)
+        self.slots = slots
+
+
+class CompilationCache:
+    """
+    A cache of compiled kernels, held in memory in least recently used order
+    and optionally in a directory shared between processes.
+
+    :param size: maximum number of kernels kept in memory; 0 disables
+        the in-memory cache.
+    :param directory: directory storing compiled kernels across processes,
+        or ``None``.
+    """
+
+    def __init__(self, size=32, directory=None):
+        self.size = size
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "uncacheable": self.uncacheable,
+            "hit_ratio": self.hits/lookups if lookups else None,
+            "entries": len(self.entries)
+        }
+
+    def fingerprint(self, stitcher, target, **options):
+        """Identify the kernel stitched by ``stitcher`` (after
+        :meth:`Stitcher.finalize`) when compiled for ``target`` with the given
+        :class:`Module` options, other than ``parameter_slots`` which is
+        taken from the stitcher.
+
+        Returns ``None`` if the kernel cannot be cached."""
+        if any(name.startswith("ARTIQ_DUMP_") or name == "ARTIQ_IR_NO_LOC"
+               for name in os.environ):
+            # The dumps are written during compilation.
+            self.uncacheable += 1
+            return None
+
+        fingerprint = _Fingerprint(stitcher.embedding_map, stitcher.parameter_slots)
+        try:
+            fingerprint.emit(artiq_version, type(target).__name__, target.triple,
+                             target.data_layout, target.features,
+                             target.codegen_partitions,
+                             sorted(options.items()), stitcher.parameter_slots,
+                             fingerprint.object_count)
+            fingerprint.visit_node(stitcher.typedtree)
+            fingerprint.visit_types(stitcher.embedding_map.type_map)
+        except (_Uncacheable, AttributeError, KeyError, TypeError, ValueError) as e:
+            logger.debug("kernel %s is not cacheable: %s", stitcher.name, e)
+            self.uncacheable += 1
+            return None
+        fingerprint.finish()
+        return fingerprint
+
+    def get(self, fingerprint):
+        """Return the unstripped and stripped libraries of the kernel
+        identified by ``fingerprint``, or ``None``.
+
+        On a hit, the host objects used by the kernel are entered into the
+        embedding map of the compilation, and the current values of the
+        parameter slots are written into the stripped library. The unstripped
+        library, only used to symbolize backtraces, keeps the old values."""
+        entry = self.entries.get(fingerprint.key)
+        from_disk = entry is None
+        if from_disk:
+            entry = self._load(fingerprint.key)
+
+        stripped_library = None
+        if entry is not None:
+            stripped_library = self._fill_slots(fingerprint, entry)
+        if stripped_library is None or not self._restore_objects(fingerprint, entry):
+            self.misses += 1
+            return None
+        self.hits += 1
+        if from_disk:
+            self.disk_hits += 1
+        self._remember(fingerprint.key, entry)
+        return entry.library, stripped_library
+
+    def put(self, fingerprint, target, library, stripped_library, parameter_slots=None):
+        """Store the libraries of the kernel identified by ``fingerprint``,
+        after its code generation has populated the embedding map.
+
+        :param parameter_slots: the :attr:`Module.parameter_slots` of
+            the compiled module.
+        """
+        embedding_map = fingerprint.embedding_map
+        object_refs = []
+        for key in range(fingerprint.object_count + 1,
+                         embedding_map.object_current_key + 1):
+            obj = embedding_map.object_forward_map[key]
+            index = fingerprint.object_indices.get(id(obj))
+            if index is None:
+                logger.debug("object %r was not quoted, not caching kernel", obj)
+                self.uncacheable += 1
+                return
+            object_refs.append(index)
+
+        slots = []
+        if parameter_slots:
+            endian = "<" if target.little_endian else ">"
+            symbol_offsets = elf.symbol_offsets(stripped_library,
+                {"O.{}".format(objectid) for objectid, _, _, _ in parameter_slots})
+            for objectid, attr, fmt, offset in parameter_slots:
+                obj = embedding_map.retrieve_object(objectid)
+                index = fingerprint.object_indices.get(id(obj))
+                symbol_offset = symbol_offsets.get("O.{}".format(objectid))
+                if index is None or symbol_offset is None:
+                    logger.debug("cannot locate %s of %r, not caching kernel", attr, obj)
+                    self.uncacheable += 1
+                    return
+                slots.append((index, attr, endian + fmt, symbol_offset + offset))
+
+        entry = _Entry(library, stripped_library,
+                       fingerprint.object_count, object_refs, slots)
+        self._remember(fingerprint.key, entry)
+        self._store(fingerprint.key, entry)
+
+    def _fill_slots(self, fingerprint, entry):
+        if not entry.slots:
+            return entry.stripped_library
+        library = bytearray(entry.stripped_library)
+        try:
+            for index, attr, fmt, offset in entry.slots:
+                value = getattr(fingerprint.objects[index], attr)
+                struct.pack_into(fmt, library, offset, value)
+        except (IndexError, AttributeError, struct.error):
+            logger.debug("cannot fill parameter slots", exc_info=True)
+            return None
+        return bytes(library)
+
+    def _restore_objects(self, fingerprint, entry):
+        embedding_map = fingerprint.embedding_map
+        if embedding_map.object_current_key != entry.object_count:
+            return False
+        try:
+            objects = [fingerprint.objects[index] for index in entry.object_refs]
+        except IndexError:
+            return False
+        # Distinct new objects get the same sequential ids as during
+        # the compilation that produced the library.
+        object_ids = {id(obj) for obj in objects}
+        if len(object_ids) != len(objects) or \
+                any(obj_id in embedding_map.object_reverse_map for obj_id in object_ids):
+            return False
+        for obj in objects:
+            embedding_map.store_object(obj)
+        return True
+
+    def _remember(self, key, entry):
+        if self.size <= 0:
+            return
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key + ".kernel")
+
+    # The file holds a line of JSON metadata followed by both libraries.
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._filename(key), "rb") as f:
+                header = json.loads(f.readline().decode())
+                library = f.read(header["library_size"])
+                stripped_library = f.read()
+            if len(library) != header["library_size"]:
+                raise ValueError("truncated file")
+            return _Entry(library, stripped_library,
+                          header["object_count"], header["object_refs"],
+                          [tuple(slot) for slot in header["slots"]])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError):
+            logger.warning("failed to load cached kernel %s", key, exc_info=True)
+            return None
+
+    def _store(self, key, entry):
+        if self.directory is None:
+            return
+        header = {
+            "object_count": entry.object_count,
+            "object_refs": entry.object_refs,
+            "slots": entry.slots,
+            "library_size": len(entry.library)
+        }
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as f:
+                f.write(json.dumps(header).encode() + b"\n")
+                f.write(entry.library)
+                f.write(entry.stripped_library)
+            os.replace(f.name, self._filename(key))
+        except OSError:
+            logger.warning("failed to store cached kernel %s", key, exc_info=True)
+            try:
+                os.unlink(f.name)
+            except (OSError, NameError):
+                pass
@@ -0,0 +1,293 @@
+"""
+The :mod:`elf` module reads and rewrites the ELF shared libraries
+produced for kernels, without going through binutils.
+"""
+
+import bisect
+import struct
+
+
+SHT_SYMTAB    = 2
+SHT_STRTAB    = 3
+SHT_RELA      = 4
+SHT_NOBITS    = 8
+SHT_REL       = 9
+SHF_ALLOC     = 0x2
+STT_FILE      = 4
+SHN_LORESERVE = 0xff00
+
+
+class ELFError(Exception):
+    pass
+
+
+class _Section:
+    def __init__(self, index, name, header):
+        self.index = index
+        self.name = name
+        (self.sh_name, self.sh_type, self.sh_flags, self.sh_addr, self.sh_offset,
+         self.sh_size, self.sh_link, self.sh_info, self.sh_addralign,
+         self.sh_entsize) = header
+
+    def header(self):
+        return (self.sh_name, self.sh_type, self.sh_flags, self.sh_addr, self.sh_offset,
+                self.sh_size, self.sh_link, self.sh_info, self.sh_addralign,
+                self.sh_entsize)
+
+
+class ELFFile:
+    """
+    The section headers and symbols of an ELF file.
+
+    :ivar data: (bytes) contents of the file
+    :ivar sections: (list of :class:`_Section`)
+    """
+
+    def __init__(self, data):
+        if data[:4] != b"\x7fELF":
+            raise ELFError("not an ELF file")
+        try:
+            self.is_64bit = {1: False, 2: True}[data[4]]
+            self.endian = {1: "<", 2: ">"}[data[5]]
+        except KeyError:
+            raise ELFError("unsupported ELF class or data encoding")
+        if self.is_64bit:
+            self.ehdr_fmt = self.endian + "16sHHIQQQIHHHHHH"
+            self.shdr_fmt = self.endian + "IIQQQQIIQQ"
+            self.sym_fmt  = self.endian + "IBBHQQ"
+        else:
+            self.ehdr_fmt = self.endian + "16sHHIIIIIHHHHHH"
+            self.shdr_fmt = self.endian + "10I"
+            self.sym_fmt  = self.endian + "IIIBBH"
+
+        self.data = data
+        try:
+            self.ehdr = list(struct.unpack_from(self.ehdr_fmt, data, 0))
+            e_phoff, e_shoff = self.ehdr[5], self.ehdr[6]
+            e_phentsize, e_phnum, e_shentsize, e_shnum, e_shstrndx = self.ehdr[9:14]
+            if e_shoff == 0 or e_shnum == 0 or e_shstrndx >= e_shnum:
+                raise ELFError("no section headers")
+            headers = [struct.unpack_from(self.shdr_fmt, data, e_shoff + i * e_shentsize)
+                       for i in range(e_shnum)]
+            shstrtab_offset = headers[e_shstrndx][4]
+            self.sections = [_Section(index, self._string(shstrtab_offset, header[0]), header)
+                             for index, header in enumerate(headers)]
+
+            self.segments_end = 0
+            for i in range(e_phnum):
+                # p_offset and p_filesz
+                if self.is_64bit:
+                    _, _, p_offset, _, _, p_filesz, _, _ = \
+                        struct.unpack_from(self.endian + "IIQQQQQQ", data,
+                                           e_phoff + i * e_phentsize)
+                else:
+                    _, p_offset, _, _, p_filesz, _, _, _ = \
+                        struct.unpack_from(self.endian + "8I", data,
+                                           e_phoff + i * e_phentsize)
+                self.segments_end = max(self.segments_end, p_offset + p_filesz)
+        except (struct.error, ValueError, IndexError) as e:
+            raise ELFError("malformed ELF file: {}".format(e))
+
+    def _string(self, table_offset, offset):
+        start = table_offset + offset
+        return self.data[start:self.data.index(b"\0", start)].decode()
+
+    def section_data(self, section):
+        if section.sh_type == SHT_NOBITS:
+            return b""
+        return self.data[section.sh_offset:section.sh_offset + section.sh_size]
+
+    def symbols(self, section):
+        """Return the symbols of ``section`` as a list of
+        ``(name, value, size, info, other, shndx, name offset)``."""
+        strtab_offset = self.sections[section.sh_link].sh_offset
+        symbols = []
+        for offset in range(0, section.sh_size, struct.calcsize(self.sym_fmt)):
+            fields = struct.unpack_from(self.sym_fmt, self.data, section.sh_offset + offset)
+            if self.is_64bit:
+                st_name, st_info, st_other, st_shndx, st_value, st_size = fields
+            else:
+                st_name, st_value, st_size, st_info, st_other, st_shndx = fields
+            symbols.append((self._string(strtab_offset, st_name), st_value, st_size,
+                            st_info, st_other, st_shndx, st_name))
+        return symbols
+
+    def pack_symbol(self, st_name, st_value, st_size, st_info, st_other, st_shndx):
+        if self.is_64bit:
+            return struct.pack(self.sym_fmt, st_name, st_info, st_other, st_shndx,
+                               st_value, st_size)
+        else:
+            return struct.pack(self.sym_fmt, st_name, st_value, st_size, st_info,
+                               st_other, st_shndx)
+
+
+def symbol_offsets(library, names):
+    """Return the file offsets of the symbols of ``library`` whose
+    names are in ``names`` and that are defined in a section with contents."""
+    elf = ELFFile(library)
+    offsets = {}
+    for section in elf.sections:
+        if section.sh_type != SHT_SYMTAB:
+            continue
+        for name, value, _, _, _, shndx, _ in elf.symbols(section):
+            if name not in names or not 0 < shndx < len(elf.sections):
+                continue
+            target = elf.sections[shndx]
+            if target.sh_type != SHT_NOBITS:
+                offsets[name] = target.sh_offset + value - target.sh_addr
+    return offsets
+
+
+def _is_debug_section(section):
+    return not section.sh_flags & SHF_ALLOC and \
+        section.name.startswith((".debug", ".zdebug", ".gnu.debuglto_"))
+
+
+def _align(offset, alignment):
+    if alignment > 1 and offset % alignment:
+        offset += alignment - offset % alignment
+    return offset
+
+
+def _compact_strings(table, offsets):
+    """Remove the strings of ``table`` that none of ``offsets`` points into.
+    Strings can be referenced through one of their suffixes.
+
+    Returns the new table and a dictionary mapping each of ``offsets``
+    to its new value."""
+    starts = [0]
+    for index, byte in enumerate(table):
+        if byte == 0:
+            starts.append(index + 1)
+    if starts[-1] == len(table):
+        starts.pop()
+
+    kept = {0}
+    for offset in offsets:
+        kept.add(bisect.bisect_right(starts, offset) - 1)
+
+    output = bytearray()
+    new_starts = {}
+    for string in sorted(kept):
+        new_starts[string] = len(output)
+        end = table.index(b"\0", starts[string]) + 1
+        output += table[starts[string]:end]
+    mapping = {}
+    for offset in offsets:
+        string = bisect.bisect_right(starts, offset) - 1
+        mapping[offset] = new_starts[string] + offset - starts[string]
+    return bytes(output), mapping
+
+
+def strip_debug(library):
+    """Remove the debug sections from an ELF shared library, like
+    ``strip --strip-debug``. The loaded contents of the library are
+    left unchanged.
+
+    :raise ELFError: if the file cannot be stripped this way
+    """
+    elf = ELFFile(library)
+    sections = elf.sections
+
+    removed = set()
+    for section in sections:
+        if _is_debug_section(section):
+            removed.add(section.index)
+    for section in sections:
+        if section.sh_type in (SHT_REL, SHT_RELA) and section.sh_info in removed:
+            removed.add(section.index)
+        elif section.sh_type in (SHT_REL, SHT_RELA) and \
+                not section.sh_flags & SHF_ALLOC and \
+                sections[section.sh_link].sh_type == SHT_SYMTAB:
+            raise ELFError("relocations against the symbol table are not supported")
+    if not removed:
+        return library
+
+    kept = [section for section in sections if section.index not in removed]
+    new_index = {section.index: index for index, section in enumerate(kept)}
+
+    def remap(index):
+        if index == 0 or index >= SHN_LORESERVE:
+            return index
+        return new_index.get(index, 0)
+
+    symbols = dict()
+    for section in kept:
+        if section.sh_type == SHT_SYMTAB:
+            # Like binutils, also remove the source file names.
+            symbols[section.index] = [
+                symbol for symbol in elf.symbols(section)
+                if (symbol[5] not in removed or symbol[5] >= SHN_LORESERVE) and
+                   symbol[3] & 0xf != STT_FILE]
+
+    # Like binutils, remove the names that are no longer used from the
+    # string tables of the symbols and section names, keeping the order of
+    # the others.
+    references = {elf.ehdr[13]: {section.sh_name for section in kept}}
+    for index, table_symbols in symbols.items():
+        references.setdefault(sections[index].sh_link, set()).update(
+            symbol[6] for symbol in table_symbols)
+    for section in kept:
+        if section.sh_type != SHT_SYMTAB and section.sh_link in references:
+            # used in ways that are not accounted for
+            references.pop(section.sh_link, None)
+    string_tables = dict()
+    for index, offsets in references.items():
+        table = sections[index]
+        if table.sh_type == SHT_STRTAB and not table.sh_flags & SHF_ALLOC:
+            string_tables[index] = _compact_strings(elf.section_data(table), offsets)
+
+    def rename(table_index, offset):
+        if table_index in string_tables:
+            return string_tables[table_index][1][offset]
+        return offset
+
+    # Everything that is loaded stays at its offset. The other sections
+    # are laid out after it.
+    end = elf.segments_end
+    for section in kept:
+        if section.sh_flags & SHF_ALLOC and section.sh_type != SHT_NOBITS:
+            end = max(end, section.sh_offset + section.sh_size)
+    output = bytearray(library[:end])
+
+    headers = []
+    for section in kept:
+        contents = elf.section_data(section)
+        if section.sh_type == SHT_SYMTAB:
+            table_symbols = symbols[section.index]
+            contents = b"".join(elf.pack_symbol(rename(section.sh_link, st_name),
+                                                value, size, info, other,
+                                                remap(shndx))
+                                for _, value, size, info, other, shndx, st_name
+                                in table_symbols)
+            # sh_info is one greater than the index of the last local symbol.
+            section.sh_info = sum(1 for symbol in table_symbols
+                                  if symbol[3] >> 4 == 0)
+            section.sh_size = len(contents)
+        elif section.index in string_tables:
+            contents = string_tables[section.index][0]
+            section.sh_size = len(contents)
+        section.sh_name = rename(elf.ehdr[13], section.sh_name)
+
+        if section.index != 0 and not (section.sh_flags & SHF_ALLOC):
+            offset = _align(len(output), section.sh_addralign)
+            output += bytes(offset - len(output))
+            section.sh_offset = offset
+            output += contents
+
+        section.sh_link = remap(section.sh_link)
+        if section.sh_type in (SHT_REL, SHT_RELA):
+            section.sh_info = remap(section.sh_info)
+        headers.append(section.header())
+
+    e_shoff = _align(len(output), 8 if elf.is_64bit else 4)
+    output += bytes(e_shoff - len(output))
+    for header in headers:
+        output += struct.pack(elf.shdr_fmt, *header)
+
+    ehdr = elf.ehdr
+    ehdr[6]  = e_shoff
+    ehdr[12] = len(kept)
+    ehdr[13] = remap(ehdr[13])
+    struct.pack_into(elf.ehdr_fmt, output, 0, *ehdr)
+    return bytes(output)
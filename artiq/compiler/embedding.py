@@ -14,7 +14,7 @@ from pythonparser import lexer as source_lexer, parser as source_parser
 from Levenshtein import ratio as similarity, jaro_winkler
 
 from ..language import core as language_core
-from . import types, builtins, asttyped, prelude
+from . import types, builtins, asttyped, prelude, timing
 from .transforms import ASTTypedRewriter, Inferencer, IntMonomorphizer, TypedtreePrinter
 from .transforms.asttyped_rewriter import LocalExtractor
 
@@ -39,6 +39,16 @@ class SpecializedFunction:
         return hash((self.instance_type, self.host_function))
 
 
+class KernelArguments:
+    """
+    Holds the arguments of a kernel call stitched with parameter slots,
+    which are passed to the kernel as attributes of this object.
+    """
+
+    def __repr__(self):
+        return "KernelArguments()"
+
+
 class EmbeddingMap:
     def __init__(self):
         self.object_current_key = 0
@@ -355,10 +365,27 @@ class ASTSynthesizer:
                 return asttyped.QuoteT(value=value, type=instance_type,
                                        loc=loc)
 
-    def call(self, callee, args, kwargs, callback=None):
+    def _quote_argument(self, arguments, name, value):
+        if arguments is None or \
+                not isinstance(value, (bool, float, numpy.int32, numpy.int64)):
+            return self.quote(value)
+
+        setattr(arguments, name, value)
+        object_node = self.quote(arguments)
+        dot_loc     = self._add(".")
+        attr_loc    = self._add(name)
+        return asttyped.AttributeT(value=object_node, attr=name, ctx=None,
+                                   type=types.TVar(),
+                                   dot_loc=dot_loc, attr_loc=attr_loc,
+                                   loc=object_node.loc.join(attr_loc))
+
+    def call(self, callee, args, kwargs, callback=None, arguments=None):
         """
         Construct an AST fragment calling a function specified by
         an AST node `function_node`, with given arguments.
+
+        If `arguments` is a :class:`KernelArguments`, scalar arguments
+        are passed as its attributes instead of being quoted as constants.
         """
         if callback is not None:
             callback_node = self.quote(callback)
@@ -371,7 +398,7 @@ class ASTSynthesizer:
 
         begin_loc      = self._add("(")
         for index, arg in enumerate(args):
-            arg_nodes.append(self.quote(arg))
+            arg_nodes.append(self._quote_argument(arguments, "arg{}".format(index), arg))
             if index < len(args) - 1:
                          self._add(", ")
         if any(args) and any(kwargs):
@@ -380,7 +407,7 @@ class ASTSynthesizer:
             arg_loc    = self._add(kw)
             equals_loc = self._add("=")
             kwarg_locs.append((arg_loc, equals_loc))
-            kwarg_nodes.append(self.quote(kwargs[kw]))
+            kwarg_nodes.append(self._quote_argument(arguments, "kwarg_" + kw, kwargs[kw]))
             if index < len(kwargs) - 1:
                          self._add(", ")
         end_loc        = self._add(")")
@@ -644,28 +671,71 @@ class StitchingInferencer(Inferencer):
                                     loc=node.loc,
                                     self_loc=node.self_loc)
 
-class TypedtreeHasher(algorithm.Visitor):
-    def generic_visit(self, node):
-        def freeze(obj):
-            if isinstance(obj, ast.AST):
-                return self.visit(obj)
-            elif isinstance(obj, list):
-                return hash(tuple(freeze(elem) for elem in obj))
-            elif isinstance(obj, types.Type):
-                return hash(obj.find())
-            else:
-                # We don't care; only types change during inference.
-                pass
+class TypedtreeDependencies(algorithm.Visitor):
+    """
+    Collects what inferring the types of a typedtree further depends on:
+    the type variables that are still free in it, and whether the
+    attributes it accesses are defined on the host objects and classes.
+    """
+
+    def __init__(self):
+        self.free_vars = []
+        self.attributes = []
+
+    def _collect_free_var(self, accum, typ):
+        if types.is_var(typ):
+            self.free_vars.append(typ)
+
+    def _collect(self, typ):
+        typ.find().fold(None, self._collect_free_var)
 
+    def _collect_attribute(self, attributes, attr_name):
+        if attr_name in attributes:
+            self._collect(attributes[attr_name])
+            self.attributes.append((attributes, attr_name, True))
+        else:
+            self.attributes.append((attributes, attr_name, False))
+
+    def visit_AttributeT(self, node):
+        object_type = node.value.type.find()
+        if hasattr(object_type, "attributes"):
+            self._collect_attribute(object_type.attributes, node.attr)
+        if hasattr(object_type, "constructor"):
+            self._collect_attribute(object_type.constructor.attributes, node.attr)
+        self.generic_visit(node)
+
+    def _visit_field(self, value):
+        if isinstance(value, types.Type):
+            self._collect(value)
+        elif isinstance(value, list):
+            for elt in value:
+                self._visit_field(elt)
+        else:
+            self.visit(value)
+
+    def generic_visit(self, node):
         fields = node._fields
         if hasattr(node, '_types'):
             fields = fields + node._types
-        return hash(tuple(freeze(getattr(node, field_name)) for field_name in fields))
+        for field_name in fields:
+            self._visit_field(getattr(node, field_name))
+
+    def changed(self):
+        """Check whether the collected dependencies have changed since
+        they were collected. Unifying free type variables together is
+        not a change: it is redone with fresh variables every time
+        numeric coercions are inferred, and it does not let inference
+        progress until one of the variables is unified with a type."""
+        return any(not types.is_var(var.find()) for var in self.free_vars) or \
+            any((attr_name in attributes) != present
+                for attributes, attr_name, present in self.attributes)
 
 class Stitcher:
-    def __init__(self, core, dmgr, engine=None, print_as_rpc=True):
+    def __init__(self, core, dmgr, engine=None, print_as_rpc=True,
+                 parameter_slots=False):
         self.core = core
         self.dmgr = dmgr
+        self.parameter_slots = parameter_slots
         if engine is None:
             self.engine = diagnostic.Engine(all_errors_are_fatal=True)
         else:
@@ -692,7 +762,11 @@ class Stitcher:
         # We synthesize source code for the initial call so that
         # diagnostics would have something meaningful to display to the user.
         synthesizer = self._synthesizer(self._function_loc(function.artiq_embedded.function))
-        call_node = synthesizer.call(function, args, kwargs, callback)
+        if self.parameter_slots:
+            arguments = KernelArguments()
+        else:
+            arguments = None
+        call_node = synthesizer.call(function, args, kwargs, callback, arguments)
         synthesizer.finalize()
         self.typedtree.append(call_node)
 
@@ -700,20 +774,45 @@ class Stitcher:
         inferencer = StitchingInferencer(engine=self.engine,
                                          value_map=self.value_map,
                                          quote=self._quote)
-        typedtree_hasher = TypedtreeHasher()
-
-        # Iterate inference to fixed point.
-        old_typedtree_hash = None
-        old_attr_count = None
+        # Iterate inference to fixed point. Inferring the types of one
+        # function can let the inference of others progress, through
+        # the types they share or the attributes of host objects it adds,
+        # so each round only revisits the top-level nodes (functions
+        # quoted so far and the entry point call) that were just injected
+        # or whose dependencies have changed since they were last visited,
+        # including by their own last visit. Once none are left, all nodes
+        # are visited once more, in case some dependency is not tracked;
+        # the fixed point is reached when that changes nothing.
+        dependencies = {}
+        worklist = list(self.typedtree)
+        full_round = True
         while True:
-            inferencer.visit(self.typedtree)
-            typedtree_hash = typedtree_hasher.visit(self.typedtree)
             attr_count = self.embedding_map.attribute_count()
-
-            if old_typedtree_hash == typedtree_hash and old_attr_count == attr_count:
+            with timing.phase("StitchingInferencer"):
+                for node in worklist:
+                    inferencer.visit(node)
+
+            progressed = set()
+            with timing.phase("TypedtreeDependencies"):
+                for node in worklist:
+                    if id(node) not in dependencies or dependencies[id(node)].changed():
+                        progressed.add(id(node))
+                    collector = TypedtreeDependencies()
+                    collector.visit(node)
+                    dependencies[id(node)] = collector
+
+            worklist = [node for node in self.typedtree
+                        if id(node) in progressed or
+                            id(node) not in dependencies or
+                            dependencies[id(node)].changed()]
+
+            if worklist:
+                full_round = False
+            elif full_round and attr_count == self.embedding_map.attribute_count():
                 break
-            old_typedtree_hash = typedtree_hash
-            old_attr_count = attr_count
+            else:
+                worklist = list(self.typedtree)
+                full_round = True
 
         # After we've discovered every referenced attribute, check if any kernel_invariant
         # specifications refers to ones we didn't encounter.
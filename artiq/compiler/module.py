@@ -10,7 +10,7 @@ string and infers types for it using a trivial :module:`prelude`.
 
 import os
 from pythonparser import source, diagnostic, parse_buffer
-from . import prelude, types, transforms, analyses, validators
+from . import prelude, types, transforms, analyses, validators, timing
 
 class Source:
     def __init__(self, source_buffer, engine=None):
@@ -40,8 +40,11 @@ class Source:
             return cls(source.Buffer(f.read(), filename, 1), engine=engine)
 
 class Module:
-    def __init__(self, src, ref_period=1e-6, attribute_writeback=True, remarks=False):
+    def __init__(self, src, ref_period=1e-6, attribute_writeback=True, remarks=False,
+                 parameter_slots=False):
         self.attribute_writeback = attribute_writeback
+        self.use_parameter_slots = parameter_slots
+        self.parameter_slots = None
         self.engine = src.engine
         self.embedding_map = src.embedding_map
         self.name = src.name
@@ -66,31 +69,50 @@ class Module:
         interleaver = transforms.Interleaver(engine=self.engine)
         invariant_detection = analyses.InvariantDetection(engine=self.engine)
 
-        int_monomorphizer.visit(src.typedtree)
-        cast_monomorphizer.visit(src.typedtree)
-        inferencer.visit(src.typedtree)
-        monomorphism_validator.visit(src.typedtree)
-        escape_validator.visit(src.typedtree)
-        iodelay_estimator.visit_fixpoint(src.typedtree)
-        constness_validator.visit(src.typedtree)
-        devirtualization.visit(src.typedtree)
-        self.artiq_ir = artiq_ir_generator.visit(src.typedtree)
-        artiq_ir_generator.annotate_calls(devirtualization)
-        dead_code_eliminator.process(self.artiq_ir)
-        interleaver.process(self.artiq_ir)
-        local_access_validator.process(self.artiq_ir)
-        local_demoter.process(self.artiq_ir)
-        constant_hoister.process(self.artiq_ir)
+        with timing.phase("IntMonomorphizer"):
+            int_monomorphizer.visit(src.typedtree)
+        with timing.phase("CastMonomorphizer"):
+            cast_monomorphizer.visit(src.typedtree)
+        with timing.phase("Inferencer"):
+            inferencer.visit(src.typedtree)
+        with timing.phase("MonomorphismValidator"):
+            monomorphism_validator.visit(src.typedtree)
+        with timing.phase("EscapeValidator"):
+            escape_validator.visit(src.typedtree)
+        with timing.phase("IODelayEstimator"):
+            iodelay_estimator.visit_fixpoint(src.typedtree)
+        with timing.phase("ConstnessValidator"):
+            constness_validator.visit(src.typedtree)
+        with timing.phase("Devirtualization"):
+            devirtualization.visit(src.typedtree)
+        with timing.phase("ARTIQIRGenerator"):
+            self.artiq_ir = artiq_ir_generator.visit(src.typedtree)
+            artiq_ir_generator.annotate_calls(devirtualization)
+        with timing.phase("DeadCodeEliminator"):
+            dead_code_eliminator.process(self.artiq_ir)
+        with timing.phase("Interleaver"):
+            interleaver.process(self.artiq_ir)
+        with timing.phase("LocalAccessValidator"):
+            local_access_validator.process(self.artiq_ir)
+        with timing.phase("LocalDemoter"):
+            local_demoter.process(self.artiq_ir)
+        with timing.phase("ConstantHoister"):
+            constant_hoister.process(self.artiq_ir)
         if remarks:
-            invariant_detection.process(self.artiq_ir)
+            with timing.phase("InvariantDetection"):
+                invariant_detection.process(self.artiq_ir)
 
     def build_llvm_ir(self, target):
         """Compile the module to LLVM IR for the specified target."""
         llvm_ir_generator = transforms.LLVMIRGenerator(
             engine=self.engine, module_name=self.name, target=target,
-            embedding_map=self.embedding_map)
-        return llvm_ir_generator.process(self.artiq_ir,
-            attribute_writeback=self.attribute_writeback)
+            embedding_map=self.embedding_map,
+            parameter_slots=self.use_parameter_slots)
+        with timing.phase("LLVMIRGenerator"):
+            llmodule = llvm_ir_generator.process(self.artiq_ir,
+                attribute_writeback=self.attribute_writeback)
+        self.parameter_slots = llvm_ir_generator.parameter_slots
+        return llmodule
 
     def __repr__(self):
         printer = types.TypePrinter()
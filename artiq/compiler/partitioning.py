@@ -0,0 +1,159 @@
+"""
+The :mod:`partitioning` module splits an optimized LLVM module into
+partitions that are compiled to machine code independently, so that
+this can be done in parallel.
+
+Every partition is a copy of the whole module in which the functions
+that belong to other partitions are only declared, and the global
+variables that belong to other partitions are made ``available_externally``.
+Private definitions that are used across partitions are given external
+linkage and hidden visibility, so that the objects of the partitions
+link together.
+"""
+
+import re
+
+
+_reference_re = re.compile(r'@("(?:[^"\\]|\\.)*"|[-a-zA-Z$._0-9]+)')
+_function_re = re.compile(r'^define ([^\n]*)\{\n.*?^\}\n', re.M | re.S)
+_private_linkage_re = re.compile(r'^(?:private|internal) ')
+_personality_re = re.compile(r' personality [^@]*@(?:"(?:[^"\\]|\\.)*"|[-a-zA-Z$._0-9]+)')
+_attachment_re = re.compile(r' ![-a-zA-Z$._0-9]+ !\d+')
+
+# Definitions with other linkages (linkonce_odr, weak, appending...) may
+# appear in several objects, and are kept as they are in every partition.
+_partitioned_linkages = {"external", "internal", "private"}
+
+
+def _name_of_reference(reference):
+    if reference.startswith('"'):
+        return reference[1:-1]
+    return reference
+
+
+class _Definition:
+    def __init__(self, llvalue, is_function):
+        self.name = llvalue.name
+        self.is_function = is_function
+        self.is_private = llvalue.linkage.name != "external"
+        text = str(llvalue)
+        self.size = len(text)
+        self.references = {_name_of_reference(match.group(1))
+                           for match in _reference_re.finditer(text)}
+        self.references.discard(self.name)
+
+
+class Partitioning:
+    """
+    Assigns the functions defined in an LLVM module to at most ``count``
+    partitions of similar size. A function is kept in the partition of
+    its caller if it is private and called from only one function, and
+    global variables all belong to the first partition. The assignment
+    only depends on the contents of the module.
+
+    :param llmodule: parsed LLVM module (``llvmlite.binding.ModuleRef``)
+    :param count: maximum number of partitions
+    :ivar partitions: list of the sets of names of the definitions that
+        belong to each partition
+    :ivar exported: set of the names of the private definitions that are
+        referenced from another partition
+    """
+
+    def __init__(self, llmodule, count):
+        definitions = []
+        for llfunction in llmodule.functions:
+            if not llfunction.is_declaration and \
+                    llfunction.linkage.name in _partitioned_linkages:
+                definitions.append(_Definition(llfunction, is_function=True))
+        for llglobal in llmodule.global_variables:
+            if not llglobal.is_declaration and \
+                    llglobal.linkage.name in _partitioned_linkages:
+                definitions.append(_Definition(llglobal, is_function=False))
+
+        users = {definition.name: [] for definition in definitions}
+        for definition in definitions:
+            for name in sorted(definition.references):
+                if name in users:
+                    users[name].append(definition)
+
+        # Group the private functions with their only caller, so that
+        # calling them does not require a relocation between partitions.
+        leaders = {}
+        def find(name):
+            while leaders.get(name, name) != name:
+                name = leaders[name]
+            return name
+        for definition in definitions:
+            if definition.is_function and definition.is_private and \
+                    len(users[definition.name]) == 1 and \
+                    users[definition.name][0].is_function:
+                leader = find(definition.name)
+                user_leader = find(users[definition.name][0].name)
+                if leader != user_leader:
+                    leaders[leader] = user_leader
+
+        clusters = {}
+        for index, definition in enumerate(definitions):
+            if definition.is_function:
+                clusters.setdefault(find(definition.name), (index, []))[1].append(definition)
+
+        # Place the largest clusters first, each in the least loaded partition.
+        loads = [0] * max(1, min(count, len(clusters)))
+        self.partitions = [set() for _ in loads]
+        for _, cluster in sorted(clusters.values(),
+                                 key=lambda item: (-sum(d.size for d in item[1]), item[0])):
+            index = min(range(len(loads)), key=lambda index: (loads[index], index))
+            loads[index] += sum(definition.size for definition in cluster)
+            self.partitions[index].update(definition.name for definition in cluster)
+        for definition in definitions:
+            if not definition.is_function:
+                self.partitions[0].add(definition.name)
+
+        owner = {}
+        for index, partition in enumerate(self.partitions):
+            for name in partition:
+                owner[name] = index
+
+        self.exported = set()
+        for definition in definitions:
+            if definition.is_private and \
+                    any(owner[user.name] != owner[definition.name]
+                        for user in users[definition.name]):
+                self.exported.add(definition.name)
+
+        self._functions = {definition.name for definition in definitions
+                           if definition.is_function}
+        self._names = set(owner)
+
+    def __len__(self):
+        return len(self.partitions)
+
+    def extract(self, llvm_ir, index):
+        """Return the textual LLVM IR of the partitioned module, ``llvm_ir``,
+        with the functions that do not belong to partition ``index``
+        replaced by declarations."""
+        partition = self.partitions[index]
+        def declare(match):
+            header = match.group(1)
+            name = _name_of_reference(_reference_re.search(header).group(1))
+            if name not in self._functions or name in partition:
+                return match.group(0)
+            header = _private_linkage_re.sub("hidden " if name in self.exported else "",
+                                             header)
+            header = _personality_re.sub("", header)
+            header = _attachment_re.sub("", header)
+            return "declare {}\n".format(header.rstrip())
+        return _function_re.sub(declare, llvm_ir)
+
+    def localize(self, llmodule, index):
+        """Change the linkage of the definitions in ``llmodule``, parsed
+        from :meth:`extract`, so that only partition ``index`` is emitted."""
+        partition = self.partitions[index]
+        for llvalue in list(llmodule.functions) + list(llmodule.global_variables):
+            if llvalue.name not in self._names or llvalue.is_declaration:
+                continue
+            if llvalue.name not in partition:
+                llvalue.linkage = "available_externally"
+            elif llvalue.name in self.exported:
+                llvalue.linkage = "external"
+                llvalue.visibility = "hidden"
@@ -0,0 +1,133 @@
+"""
+The :class:`Symbolizer` class resolves addresses in kernel libraries and
+firmware images to source locations through long-lived ``addr2line``
+processes, caching the results.
+"""
+
+import os
+import subprocess
+import tempfile
+
+
+class Symbolizer:
+    """
+    Resolves addresses in one ELF file. The ``addr2line`` process is started
+    on first use and kept running until :meth:`close` is called.
+
+    :param binary: (string or bytes) file name or contents of the ELF file
+    :param triple: target triple used as the prefix of binutils tools,
+        or ``None`` for the host tools
+    :param demangle: ``False``, ``True``, or the demangling style
+        (e.g. ``"rust"``) of function names
+    """
+
+    def __init__(self, binary, triple, demangle=True):
+        self._triple = triple
+        self._demangle = demangle
+        self._binary = binary
+        self._temporary = None
+        self._addr2line = None
+        self._locations = {}
+        self._demangled = {}
+
+    def _tool(self, name):
+        if self._triple is None:
+            return name
+        return "{}-{}".format(self._triple, name)
+
+    def _start(self):
+        filename = self._binary
+        if isinstance(self._binary, bytes):
+            with tempfile.NamedTemporaryFile(delete=False) as f:
+                f.write(self._binary)
+            filename = self._temporary = f.name
+        cmdline = [
+            self._tool("addr2line"), "--exe=" + filename,
+            "--addresses", "--functions", "--inlines"
+        ]
+        if self._demangle is True:
+            cmdline.append("--demangle")
+        elif self._demangle:
+            cmdline.append("--demangle=" + self._demangle)
+        self._addr2line = subprocess.Popen(cmdline, stdin=subprocess.PIPE,
+                                           stdout=subprocess.PIPE,
+                                           universal_newlines=True)
+
+    def symbolize(self, addr):
+        """Return the ``(function, file, line, addr)`` locations of ``addr``,
+        starting with the innermost inlined function. ``line`` is a string,
+        as printed by ``addr2line``."""
+        if addr in self._locations:
+            return self._locations[addr]
+        if self._addr2line is None:
+            self._start()
+
+        # The zero address serves as an end marker.
+        self._addr2line.stdin.write("0x{:08x}\n0\n".format(addr))
+        self._addr2line.stdin.flush()
+        self._addr2line.stdout.readline() # 0x[addr]
+
+        result = []
+        while True:
+            function = self._addr2line.stdout.readline().rstrip()
+
+            # check for end marker
+            if function.startswith("0x") and int(function, 16) == 0:
+                self._addr2line.stdout.readline() # ??
+                self._addr2line.stdout.readline() # ??:0
+                break
+
+            file, line = self._addr2line.stdout.readline().rstrip().rsplit(":", 1)
+
+            result.append((function, file, line, addr))
+        self._locations[addr] = result
+        return result
+
+    def backtrace(self, addresses):
+        """Symbolize the return addresses of a kernel backtrace into
+        ``(filename, line, column, function, address)`` entries."""
+        backtrace = []
+        for address in addresses:
+            # We got a return address, i.e. the address of the instruction
+            # just after the call. Offset it back to get an address somewhere
+            # inside the call instruction (or its delay slot), since that's
+            # what the backtrace entry should point at.
+            for function, filename, line, _ in self.symbolize(address - 1):
+                if filename == "??" or filename == "<synthesized>":
+                    continue
+                # Discard e.g. " (discriminator 1)".
+                line = line.split(" ", 1)[0]
+                if line == "?":
+                    line = -1
+                else:
+                    line = int(line)
+                # can't get column out of addr2line D:
+                backtrace.append((filename, line, -1, function, address))
+        return backtrace
+
+    def demangle(self, names):
+        """Demangle C++ symbol names."""
+        missing = [name for name in names if name not in self._demangled]
+        if missing:
+            result = subprocess.run([self._tool("c++filt")] + missing,
+                                    stdout=subprocess.PIPE, check=True,
+                                    universal_newlines=True)
+            demangled = result.stdout.rstrip().split("\n")
+            self._demangled.update(zip(missing, demangled))
+        return [self._demangled[name] for name in names]
+
+    def close(self):
+        if self._addr2line is not None:
+            self._addr2line.stdin.close()
+            self._addr2line.wait()
+            self._addr2line.stdout.close()
+            self._addr2line = None
+        if self._temporary is not None:
+            os.unlink(self._temporary)
+            self._temporary = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
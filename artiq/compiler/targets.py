@@ -1,7 +1,12 @@
-import os, sys, tempfile, subprocess, io
-from artiq.compiler import types, ir
+import os, sys, tempfile, subprocess, io, logging, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from artiq.compiler import types, ir, elf, timing
+from artiq.compiler.symbolizer import Symbolizer
+from artiq.compiler.partitioning import Partitioning
 from llvmlite_artiq import ir as ll, binding as llvm
 
+logger = logging.getLogger(__name__)
+
 llvm.initialize()
 llvm.initialize_all_targets()
 llvm.initialize_all_asmprinters()
@@ -61,6 +66,31 @@ def _dump(target, kind, suffix, content):
         file.close()
         print("{} dumped as {}".format(kind, file.name), file=sys.stderr)
 
+_codegen_pool = None
+
+def _get_codegen_pool(workers):
+    global _codegen_pool
+    if _codegen_pool is None or _codegen_pool[0] != workers:
+        shutdown_codegen_pool()
+        # Do not fork the compiling process, which may have threads running
+        # and, in a master worker, holds the pipes to the master.
+        context = multiprocessing.get_context("spawn" if os.name == "nt" else "forkserver")
+        _codegen_pool = workers, ProcessPoolExecutor(workers, mp_context=context)
+    return _codegen_pool[1]
+
+def shutdown_codegen_pool():
+    """Terminate the processes that emit the machine code of partitioned
+    modules, if they were started."""
+    global _codegen_pool
+    if _codegen_pool is not None:
+        _codegen_pool[1].shutdown()
+        _codegen_pool = None
+
+def _assemble_partition(target_cls, llvm_ir, partitioning, index):
+    llmodule = llvm.parse_assembly(partitioning.extract(llvm_ir, index))
+    partitioning.localize(llmodule, index)
+    return target_cls().assemble(llmodule, "_{}".format(index))
+
 class Target:
     """
     A description of the target environment where the binaries
@@ -78,16 +108,26 @@ class Target:
     :var little_endian: (boolean)
         Whether the code will be executed on a little-endian machine. This cannot be always
         determined from data_layout due to JIT.
+    :var builtin_strip: (boolean)
+        Whether to strip libraries in-process with :func:`elf.strip_debug`
+        instead of running ``strip``, which is still used as a fallback.
+    :var codegen_partitions: (integer)
+        Number of partitions the optimized LLVM module is split into (see
+        :mod:`artiq.compiler.partitioning`), which are compiled to machine
+        code by as many worker processes. With 1, the machine code is
+        emitted for the whole module in the compiling process.
     """
     triple = "unknown"
     data_layout = ""
     features = []
     print_function = "printf"
     little_endian = False
+    builtin_strip = True
 
 
-    def __init__(self):
+    def __init__(self, codegen_partitions=1):
         self.llcontext = ll.Context()
+        self.codegen_partitions = codegen_partitions
 
     def target_machine(self):
         lltarget = llvm.Target.from_triple(self.triple)
@@ -145,8 +185,9 @@ class Target:
         llmod = module.build_llvm_ir(self)
 
         try:
-            llparsedmod = llvm.parse_assembly(str(llmod))
-            llparsedmod.verify()
+            with timing.phase("LLVM parse and verify"):
+                llparsedmod = llvm.parse_assembly(str(llmod))
+                llparsedmod.verify()
         except RuntimeError:
             _dump("", "LLVM IR (broken)", ".ll", lambda: str(llmod))
             raise
@@ -154,23 +195,25 @@ class Target:
         _dump(os.getenv("ARTIQ_DUMP_UNOPT_LLVM"), "LLVM IR (generated)", "_unopt.ll",
               lambda: str(llparsedmod))
 
-        self.optimize(llparsedmod)
+        with timing.phase("LLVM optimization"):
+            self.optimize(llparsedmod)
 
         _dump(os.getenv("ARTIQ_DUMP_LLVM"), "LLVM IR (optimized)", ".ll",
               lambda: str(llparsedmod))
 
         return llparsedmod
 
-    def assemble(self, llmodule):
+    def assemble(self, llmodule, dump_suffix=""):
         llmachine = self.target_machine()
 
-        _dump(os.getenv("ARTIQ_DUMP_ASM"), "Assembly", ".s",
+        _dump(os.getenv("ARTIQ_DUMP_ASM"), "Assembly", dump_suffix + ".s",
               lambda: llmachine.emit_assembly(llmodule))
 
-        _dump(os.getenv("ARTIQ_DUMP_OBJ"), "Object file", ".o",
+        _dump(os.getenv("ARTIQ_DUMP_OBJ"), "Object file", dump_suffix + ".o",
               lambda: llmachine.emit_object(llmodule))
 
-        return llmachine.emit_object(llmodule)
+        with timing.phase("LLVM machine code emission"):
+            return llmachine.emit_object(llmodule)
 
     def link(self, objects):
         """Link the relocatable objects into a shared library for this target."""
@@ -187,10 +230,43 @@ class Target:
 
             return library
 
+    def assemble_partitioned(self, llmodule):
+        """Split the optimized module into at most ``codegen_partitions``
+        partitions and emit their relocatable objects in parallel. The
+        objects are returned in the order of the partitions, which only
+        depends on the module."""
+        with timing.phase("LLVM module partitioning"):
+            partitioning = Partitioning(llmodule, self.codegen_partitions)
+        if len(partitioning) == 1:
+            return [self.assemble(llmodule)]
+
+        llvm_ir = str(llmodule)
+        pool = _get_codegen_pool(self.codegen_partitions)
+        with timing.phase("LLVM machine code emission"):
+            futures = [pool.submit(_assemble_partition, type(self), llvm_ir, partitioning, index)
+                       for index in range(len(partitioning))]
+            return [future.result() for future in futures]
+
     def compile_and_link(self, modules):
-        return self.link([self.assemble(self.compile(module)) for module in modules])
+        objects = []
+        for module in modules:
+            with timing.phase("compile"):
+                llmodule = self.compile(module)
+            with timing.phase("assemble"):
+                if self.codegen_partitions > 1:
+                    objects += self.assemble_partitioned(llmodule)
+                else:
+                    objects.append(self.assemble(llmodule))
+        with timing.phase("link"):
+            return self.link(objects)
 
     def strip(self, library):
+        if self.builtin_strip:
+            try:
+                return elf.strip_debug(library)
+            except elf.ELFError as error:
+                logger.debug("falling back to %s-strip: %s", self.triple, error)
+
         with RunTool([self.triple + "-strip", "--strip-debug", "{library}", "-o", "{output}"],
                      library=library, output=None) \
                 as results:
@@ -200,51 +276,22 @@ class Target:
         if addresses == []:
             return []
 
-        # We got a list of return addresses, i.e. addresses of instructions
-        # just after the call. Offset them back to get an address somewhere
-        # inside the call instruction (or its delay slot), since that's what
-        # the backtrace entry should point at.
-        offset_addresses = [hex(addr - 1) for addr in addresses]
-        with RunTool([self.triple + "-addr2line", "--addresses",  "--functions", "--inlines",
-                      "--demangle", "--exe={library}"] + offset_addresses,
-                     library=library) \
-                as results:
-            lines = iter(results["__stdout__"].read().rstrip().split("\n"))
-            backtrace = []
-            while True:
-                try:
-                    address_or_function = next(lines)
-                except StopIteration:
-                    break
-                if address_or_function[:2] == "0x":
-                    address  = int(address_or_function[2:], 16) + 1 # remove offset
-                    function = next(lines)
-                else:
-                    address  = backtrace[-1][4] # inlined
-                    function = address_or_function
-                location = next(lines)
-
-                filename, line = location.rsplit(":", 1)
-                if filename == "??" or filename == "<synthesized>":
-                    continue
-                if line == "?":
-                    line = -1
-                else:
-                    line = int(line)
-                # can't get column out of addr2line D:
-                backtrace.append((filename, line, -1, function, address))
-            return backtrace
+        with Symbolizer(library, self.triple) as symbolizer:
+            return symbolizer.backtrace(addresses)
 
     def demangle(self, names):
         with RunTool([self.triple + "-c++filt"] + names) as results:
             return results["__stdout__"].read().rstrip().split("\n")
 
 class NativeTarget(Target):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, codegen_partitions=1):
+        super().__init__(codegen_partitions)
         self.triple = llvm.get_default_triple()
         host_data_layout = str(llvm.targets.Target.from_default_triple().create_target_machine().target_data)
         assert host_data_layout[0] in "eE"
+        # The layout of quoted objects, and so the offsets of parameter slots,
+        # must match the machine code.
+        self.data_layout = host_data_layout
         self.little_endian = host_data_layout[0] == "e"
 
 class OR1KTarget(Target):
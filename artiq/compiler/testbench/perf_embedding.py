@@ -6,6 +6,7 @@ from ...master.worker_db import DeviceManager, DatasetManager
 from ..module import Module
 from ..embedding import Stitcher
 from ..targets import OR1KTarget
+from .. import timing
 from . import benchmark
 
 
@@ -62,11 +63,25 @@ def main():
     benchmark(lambda: target.assemble(llvm_ir),
               "LLVM machine code emission")
 
+    partitions = os.cpu_count()
+    partitioned_target = OR1KTarget(codegen_partitions=partitions)
+    benchmark(lambda: partitioned_target.assemble_partitioned(llvm_ir),
+              "LLVM machine code emission ({} partitions)".format(partitions))
+
     benchmark(lambda: target.link([elf_obj]),
               "Linking")
 
     benchmark(lambda: target.strip(elf_shlib),
               "Stripping debug information")
 
+    timer = timing.CompileTimer("Benchmark.run")
+    with timer.activate():
+        with timing.phase("stitching"):
+            stitcher = embed()
+        with timing.phase("ARTIQ passes"):
+            module = Module(stitcher)
+        target.compile_and_link([module])
+    print(timing.format_report(timer.report()))
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,165 @@
+import sys
+import numpy
+from pythonparser import diagnostic
+from ...language.core import *
+from ...language.types import *
+from ...language.units import *
+from ...coredevice.core import Core
+from ..embedding import Stitcher
+from .. import timing
+from . import benchmark
+
+
+# A device graph shaped like the DDS drivers: each board has a
+# configuration register (CPLD) on a SPI bus and several channels using
+# both, each channel with its own RF switch.
+
+class _SPIBus:
+    kernel_invariants = {"core", "div"}
+
+    def __init__(self, core):
+        self.core = core
+        self.div = 4
+        self.xfer_duration_mu = numpy.int64(100)
+
+    @kernel
+    def set_config_mu(self, flags, length, div, cs):
+        delay_mu(self.xfer_duration_mu)
+
+    @kernel
+    def write(self, data):
+        delay_mu(self.xfer_duration_mu)
+
+
+class _TTL:
+    kernel_invariants = {"core", "channel"}
+
+    def __init__(self, core, channel):
+        self.core = core
+        self.channel = channel
+
+    @kernel
+    def on(self):
+        delay_mu(int64(8))
+
+    @kernel
+    def off(self):
+        delay_mu(int64(8))
+
+
+class _CPLD:
+    kernel_invariants = {"core", "bus"}
+
+    def __init__(self, core, bus):
+        self.core = core
+        self.bus = bus
+        self.cfg_reg = 0
+        self.att_reg = numpy.int32(0)
+
+    @kernel
+    def cfg_write(self, cfg):
+        self.bus.set_config_mu(0, 24, self.bus.div, 1)
+        self.bus.write(cfg << 8)
+        self.cfg_reg = cfg
+
+    @kernel
+    def set_att_mu(self, channel, att):
+        a = self.att_reg & ~(0xff << (channel * 8))
+        a |= att << (channel * 8)
+        self.bus.set_config_mu(0, 32, self.bus.div, 2)
+        self.bus.write(a)
+        self.att_reg = a
+
+    @kernel
+    def init(self):
+        self.cfg_write(0)
+        delay(100*us)
+
+
+class _DDS:
+    kernel_invariants = {"core", "cpld", "bus", "sw", "chip_select", "ftw_per_hz"}
+
+    def __init__(self, core, cpld, sw, chip_select):
+        self.core = core
+        self.cpld = cpld
+        self.bus = cpld.bus
+        self.sw = sw
+        self.chip_select = chip_select
+        self.ftw_per_hz = 2**32/1e9
+        self.profile = [0, 0, 0, 0]
+
+    @kernel
+    def write32(self, addr, data):
+        self.bus.set_config_mu(0, 8, self.bus.div, self.chip_select)
+        self.bus.write(addr << 24)
+        self.bus.set_config_mu(0, 32, self.bus.div, self.chip_select)
+        self.bus.write(data)
+
+    @kernel
+    def frequency_to_ftw(self, frequency):
+        return int32(round(self.ftw_per_hz*frequency))
+
+    @kernel
+    def set_mu(self, ftw, pow_, asf):
+        self.write32(0x07, ftw)
+        self.write32(0x08, (asf << 16) | pow_)
+        self.profile[0] = ftw
+
+    @kernel
+    def set(self, frequency, phase=0.0, amplitude=1.0):
+        self.set_mu(self.frequency_to_ftw(frequency),
+                    int32(round(phase*0xffff)), int32(round(amplitude*0x3fff)))
+
+    @kernel
+    def set_att(self, att):
+        self.cpld.set_att_mu(self.chip_select - 4, int32(round(att*8)))
+
+    @kernel
+    def init(self):
+        self.write32(0x00, 0x2)
+        delay(1*ms)
+        self.sw.off()
+
+
+class _Dmgr:
+    def __init__(self, core):
+        self.core = core
+
+    def get(self, name):
+        return self.core
+
+
+def main():
+    boards = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+
+    core = Core(None, host=None, ref_period=1e-9)
+    dmgr = _Dmgr(core)
+    channels = []
+    for board in range(boards):
+        cpld = _CPLD(core, _SPIBus(core))
+        for channel in range(4):
+            channels.append(_DDS(core, cpld, _TTL(core, board*4 + channel), 4 + channel))
+
+    names = ["dds{}".format(i) for i in range(len(channels))]
+    body = []
+    for name in names:
+        body.append("{0}.cpld.init()\n{0}.init()\n{0}.set(100*1e6, phase=0.5)\n"
+                    "{0}.set_att(10.0)\n{0}.sw.on()".format(name))
+    entrypoint = kernel_from_string(names, "\n".join(body))
+
+    def embed():
+        engine = diagnostic.Engine(all_errors_are_fatal=True)
+        stitcher = Stitcher(core=core, dmgr=dmgr, engine=engine)
+        stitcher.stitch_call(entrypoint, channels, {})
+        stitcher.finalize()
+        return stitcher
+
+    timer = timing.CompileTimer("entrypoint")
+    with timer.activate():
+        embed()
+    print(timing.format_report(timer.report()))
+
+    benchmark(embed, "ARTIQ embedding of {} channels".format(len(channels)))
+
+if __name__ == "__main__":
+    main()
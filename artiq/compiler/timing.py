@@ -0,0 +1,114 @@
+"""
+The :mod:`timing` module measures the time taken by the phases of
+a kernel compilation.
+
+The compiler marks its phases with :func:`phase`, which does nothing
+unless a :class:`CompileTimer` is active in the current thread.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+_state = threading.local()
+
+
+class _NoPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+_no_phase = _NoPhase()
+
+
+def phase(name):
+    """Return a context manager that records its body as the phase
+    ``name`` of the active :class:`CompileTimer`, if any."""
+    timer = getattr(_state, "timer", None)
+    if timer is None:
+        return _no_phase
+    return timer.phase(name)
+
+
+class CompileTimer:
+    """
+    Records the start time and duration of nested compilation phases.
+
+    :param name: name of the compiled kernel
+    :ivar phases: list of ``(name, depth, start, duration)``, in the
+        order the phases were entered, with ``start`` relative to the
+        creation of the timer (in seconds)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = []
+        self._depth = 0
+        self._wall_start = time.time()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        index = len(self.phases)
+        start = time.perf_counter() - self._start
+        self.phases.append((name, self._depth, start, None))
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            duration = time.perf_counter() - self._start - start
+            self.phases[index] = (name, self._depth, start, duration)
+
+    @contextmanager
+    def activate(self):
+        """Make :func:`phase` record into this timer in the current thread."""
+        previous = getattr(_state, "timer", None)
+        _state.timer = self
+        try:
+            yield self
+        finally:
+            _state.timer = previous
+
+    def report(self):
+        """Return the phases as a JSON-serializable dictionary."""
+        return {
+            "kernel": self.name,
+            "start_time": self._wall_start,
+            "phases": [{"name": name, "depth": depth,
+                        "start": start, "duration": duration}
+                       for name, depth, start, duration in self.phases]
+        }
+
+
+def format_report(report):
+    """Render a report returned by :meth:`CompileTimer.report` as text,
+    one phase per line."""
+    lines = ["compilation of {}:".format(report["kernel"])]
+    for phase in report["phases"]:
+        duration = phase["duration"]
+        lines.append("{}{:<{}} {:>9}".format(
+            "  " * (phase["depth"] + 1), phase["name"], 40 - 2*phase["depth"],
+            "?" if duration is None else "{:.1f} ms".format(duration * 1e3)))
+    return "\n".join(lines)
+
+
+def chrome_trace(reports):
+    """Convert a list of reports returned by :meth:`CompileTimer.report`
+    to the Chrome trace event format, for ``chrome://tracing`` or Perfetto."""
+    events = []
+    for report in reports:
+        for phase in report["phases"]:
+            if phase["duration"] is None:
+                continue
+            events.append({
+                "name": phase["name"], "cat": report["kernel"], "ph": "X",
+                "ts": (report["start_time"] + phase["start"]) * 1e6,
+                "dur": phase["duration"] * 1e6,
+                "pid": os.getpid(), "tid": 0
+            })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -154,7 +154,15 @@ class ABILayoutInfo:
 
 
 class LLVMIRGenerator:
-    def __init__(self, engine, module_name, target, embedding_map):
+    """
+    :ivar parameter_slots: (list of (int, str, str, int) or None)
+        when generating code with parameter slots, the object id, attribute
+        name, :mod:`struct` format and offset within the object global
+        of every attribute whose value can be changed in the linked library
+    """
+
+    def __init__(self, engine, module_name, target, embedding_map,
+                 parameter_slots=False):
         self.engine = engine
         self.target = target
         self.embedding_map = embedding_map
@@ -169,6 +177,8 @@ class LLVMIRGenerator:
         self.llfunction = None
         self.llmap = {}
         self.llobject_map = {}
+        self.llused = []
+        self.parameter_slots = [] if parameter_slots else None
         self.phis = []
         self.debug_info_emitter = DebugInfoEmitter(self.llmodule)
         self.empty_metadata = self.llmodule.add_metadata([])
@@ -521,6 +531,15 @@ class LLVMIRGenerator:
         if attribute_writeback and self.embedding_map is not None:
             self.emit_attribute_writeback()
 
+        if self.llused:
+            # Keep the globals, and the values they are initialized with,
+            # as if they were referenced from outside of the module.
+            llusedty = ll.ArrayType(llptr, len(self.llused))
+            llused = ll.GlobalVariable(self.llmodule, llusedty, name="llvm.used")
+            llused.initializer = ll.Constant(llusedty,
+                [llglobal.bitcast(llptr) for llglobal in self.llused])
+            llused.linkage = "appending"
+
         return self.llmodule
 
     def emit_attribute_writeback(self):
@@ -1501,6 +1520,38 @@ class LLVMIRGenerator:
 
         return llcall
 
+    def _slot_format(self, typ):
+        if builtins.is_bool(typ):
+            return "?"
+        elif builtins.is_int32(typ):
+            return "i"
+        elif builtins.is_int64(typ):
+            return "q"
+        elif builtins.is_float(typ):
+            return "d"
+
+    def _add_parameter_slots(self, objectid, typ, llglobal):
+        slot_count = len(self.parameter_slots)
+        offset = 0
+        for attr in typ.attributes:
+            attrtyp = typ.attributes[attr]
+            size, alignment = self.abi_layout_info.get_size_align_for_type(attrtyp)
+
+            if offset % alignment != 0:
+                offset += alignment - (offset % alignment)
+
+            fmt = self._slot_format(attrtyp)
+            if fmt is not None and attr != "__objectid__" and \
+                    attr not in typ.constant_attributes:
+                self.parameter_slots.append((objectid, attr, fmt, offset))
+
+            offset += size
+
+        if len(self.parameter_slots) > slot_count:
+            # The symbol is looked up in the linked library to patch the values.
+            llglobal.linkage = "internal"
+            self.llused.append(llglobal)
+
     def _quote(self, value, typ, path):
         value_id = id(value)
         if value_id in self.llobject_map:
@@ -1543,6 +1594,8 @@ class LLVMIRGenerator:
             llglobal.global_constant = emit_as_constant
             llglobal.initializer = ll.Constant(llty.pointee, llfields)
             llglobal.linkage = "private"
+            if self.parameter_slots is not None and types.is_instance(typ):
+                self._add_parameter_slots(objectid, typ, llglobal)
             return llglobal
 
         fail_msg = "at " + ".".join(path())
@@ -0,0 +1,261 @@
+"""
+Continuous capture of the events recorded by the RTIO analyzer.
+
+The core device keeps the analyzer events in a ring buffer that is
+overwritten when it wraps, and emptied whenever it is read.
+:class:`AnalyzerCapture` reads it repeatedly and keeps the dumps in a
+:class:`CaptureStore`, so that the events of past experiments can be
+retrieved by RID, channel and RTIO time.
+"""
+
+import asyncio
+import logging
+import os
+import struct
+import time
+
+import numpy
+from sipyco import pyon
+
+from artiq.coredevice.comm_analyzer import (get_analyzer_dump, MessageType,
+                                            DecodedMessages)
+
+
+logger = logging.getLogger(__name__)
+
+
+_header = struct.Struct(">IQbbb")
+_message_size = 32
+_message_record = numpy.dtype((numpy.void, _message_size))
+
+
+def _stopped_message(rtio_counter):
+    return struct.pack(">QIQQI", 0, 0, rtio_counter, 0, MessageType.stopped.value)
+
+
+class CaptureStore:
+    """
+    Rotating on-disk storage of analyzer dumps.
+
+    Every dump is written unmodified into its own file in ``directory``,
+    which can be read with ``artiq_coreanalyzer -r``. The file ``index``
+    records for each of them:
+
+    * ``seq``: a sequence number, in the order of capture,
+    * ``rid``: the RID the dump was captured for, or ``None``,
+    * ``time``: the host time of the capture,
+    * ``start`` and ``end``: the first and last RTIO time of its events,
+    * ``channels``: the RTIO channels of its events,
+    * ``lost``: the number of events overwritten on the core device
+      before the capture,
+    * ``overflow``: whether events were dropped because of an overflow
+      of the analyzer FIFO,
+    * ``size``: the size of the file.
+
+    When the files take more than ``max_size`` bytes in total, the oldest
+    ones are deleted.
+    """
+    def __init__(self, directory, max_size=1 << 30):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = []
+        try:
+            with open(self._index_filename(), "r") as f:
+                for line in f:
+                    if line.strip():
+                        self.segments.append(pyon.decode(line))
+        except FileNotFoundError:
+            pass
+        segments = [segment for segment in self.segments
+                    if os.path.exists(self._filename(segment))]
+        if len(segments) != len(self.segments):
+            logger.warning("%d analyzer dumps are missing from %s",
+                           len(self.segments) - len(segments), directory)
+            self.segments = segments
+            self._write_index()
+        if self.segments:
+            self.next_seq = self.segments[-1]["seq"] + 1
+        else:
+            self.next_seq = 0
+
+    def _index_filename(self):
+        return os.path.join(self.directory, "index")
+
+    def _filename(self, segment):
+        return os.path.join(self.directory, "{:010d}.dump".format(segment["seq"]))
+
+    def _write_index(self):
+        filename = self._index_filename()
+        with open(filename + ".tmp", "w") as f:
+            for segment in self.segments:
+                f.write(pyon.encode(segment) + "\n")
+        os.replace(filename + ".tmp", filename)
+
+    def add(self, dump, rid=None, capture_time=None):
+        """Store an analyzer dump, as returned by
+        :func:`~artiq.coredevice.comm_analyzer.get_analyzer_dump`.
+
+        Returns the index entry of the dump, or ``None`` if it contains
+        no events and was not stored. Raises ``ValueError`` if the dump is
+        truncated."""
+        if len(dump) < _header.size:
+            raise ValueError("analyzer dump is truncated")
+        (sent_bytes, total_byte_count,
+         overflow_occured, _, _) = _header.unpack_from(dump)
+        if (len(dump) != _header.size + sent_bytes
+                or sent_bytes % _message_size):
+            raise ValueError("analyzer dump has incorrect length")
+        lost = (total_byte_count - sent_bytes)//_message_size
+        if lost:
+            logger.warning("analyzer ring buffer has wrapped, "
+                           "%d events have been lost", lost)
+        if overflow_occured:
+            logger.warning("analyzer FIFO overflow occured, "
+                           "some events have been lost")
+
+        messages = DecodedMessages.from_buffer(
+            dump, sent_bytes//_message_size, offset=_header.size)
+        messages = messages[messages.type != MessageType.stopped.value]
+        if not len(messages):
+            return None
+        times = messages.time()
+
+        segment = {
+            "seq": self.next_seq,
+            "rid": rid,
+            "time": time.time() if capture_time is None else capture_time,
+            "start": int(times.min()),
+            "end": int(times.max()),
+            "channels": numpy.unique(messages.channel).tolist(),
+            "lost": lost,
+            "overflow": bool(overflow_occured),
+            "size": len(dump)
+        }
+        with open(self._filename(segment), "wb") as f:
+            f.write(dump)
+        with open(self._index_filename(), "a") as f:
+            f.write(pyon.encode(segment) + "\n")
+        self.next_seq += 1
+        self.segments.append(segment)
+        self._rotate()
+        return segment
+
+    def _rotate(self):
+        size = sum(segment["size"] for segment in self.segments)
+        removed = 0
+        while size > self.max_size and len(self.segments) > 1:
+            segment = self.segments[removed]
+            os.unlink(self._filename(segment))
+            size -= segment["size"]
+            removed += 1
+        if removed:
+            del self.segments[:removed]
+            self._write_index()
+
+    def select(self, rid=None, start=None, end=None):
+        """Return the index entries of the stored dumps with events of the
+        given RID, and with events at RTIO times between ``start``
+        (inclusive) and ``end`` (exclusive)."""
+        return [segment for segment in self.segments
+                if (rid is None or segment["rid"] == rid)
+                and (start is None or segment["end"] >= start)
+                and (end is None or segment["start"] < end)]
+
+    def query(self, rid=None, channels=None, start=None, end=None):
+        """Return the stored events of the given RID, on the given RTIO
+        channels, and at RTIO times between ``start`` (inclusive) and
+        ``end`` (exclusive), as an analyzer dump that can be decoded with
+        :func:`~artiq.coredevice.comm_analyzer.decode_dump`.
+
+        Any of the criteria can be ``None`` to select all events."""
+        records = []
+        log_channel = dds_onehot_sel = 0
+        overflow_occured = False
+        rtio_counter = 0
+        for segment in self.select(rid, start, end):
+            with open(self._filename(segment), "rb") as f:
+                dump = f.read()
+            (sent_bytes, _, _, log_channel, dds_onehot_sel) = \
+                _header.unpack_from(dump)
+            count = sent_bytes//_message_size
+            messages = DecodedMessages.from_buffer(dump, count, offset=_header.size)
+            times = messages.time()
+            selected = messages.type != MessageType.stopped.value
+            if channels is not None:
+                selected &= numpy.isin(messages.channel, channels)
+            if start is not None:
+                selected &= times >= start
+            if end is not None:
+                selected &= times < end
+            records.append(numpy.frombuffer(
+                dump, _message_record, count, offset=_header.size)[selected])
+            overflow_occured |= segment["overflow"]
+            rtio_counter = max(rtio_counter, segment["end"])
+
+        events = b"".join(record.tobytes() for record in records)
+        events += _stopped_message(rtio_counter)
+        return _header.pack(len(events), len(events), overflow_occured,
+                            log_channel, dds_onehot_sel) + events
+
+
+class AnalyzerCapture:
+    """
+    Reads the RTIO analyzer of the core device every ``interval`` seconds
+    while :meth:`run` is running, and stores the dumps in ``store``.
+
+    Each read empties the buffer of the core device, so that the dumps do
+    not overlap, and the events recorded while a dump is transferred are
+    lost. The RTIO analyzer tool and the analyzer unit tests cannot be
+    used at the same time.
+    """
+    def __init__(self, host, store, interval=1.0, port=1382):
+        self.host = host
+        self.port = port
+        self.store = store
+        self.interval = interval
+        self.rid = None
+        self._lock = asyncio.Lock()
+
+    async def run(self):
+        while True:
+            try:
+                await self.capture()
+            except asyncio.CancelledError:
+                raise
+            except:
+                logger.warning("failed to capture the analyzer of the core device",
+                               exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def capture(self):
+        """Read the analyzer of the core device and store its events."""
+        async with self._lock:
+            loop = asyncio.get_event_loop()
+            capture_time = time.time()
+            dump = await loop.run_in_executor(
+                None, get_analyzer_dump, self.host, self.port)
+            self.store.add(dump, self.rid, capture_time)
+
+    async def mark(self, rid):
+        """Store the events recorded so far, and associate the following
+        ones with ``rid`` (or with no RID if ``rid`` is ``None``).
+
+        Experiments call this at the start of their ``run`` method, e.g.
+        with ``self.analyzer_capture.mark(self.scheduler.rid)``."""
+        await self.capture()
+        self.rid = rid
+
+    def get_segments(self, rid=None, start=None, end=None):
+        """Return the index entries of the stored dumps; see
+        :meth:`CaptureStore.select`."""
+        return self.store.select(rid, start, end)
+
+    def get_dump(self, rid=None, channels=None, start=None, end=None):
+        """Return the stored events as an analyzer dump; see
+        :meth:`CaptureStore.query`."""
+        return self.store.query(rid, channels, start, end)
+
+    def ping(self):
+        return True
@@ -6,6 +6,10 @@ from enum import Enum
 import struct
 import logging
 import socket
+import json
+
+import numpy
+import h5py
 
 
 logger = logging.getLogger(__name__)
@@ -37,15 +41,16 @@ class ExceptionType(Enum):
 def get_analyzer_dump(host, port=1382):
     sock = socket.create_connection((host, port))
     try:
-        r = bytes()
+        r = bytearray()
+        buf = memoryview(bytearray(65536))
         while True:
-            buf = sock.recv(8192)
-            if not buf:
+            length = sock.recv_into(buf)
+            if not length:
                 break
-            r += buf
+            r += buf[:length]
     finally:
         sock.close()
-    return r
+    return bytes(r)
 
 
 OutputMessage = namedtuple(
@@ -85,6 +90,118 @@ def decode_message(data):
         raise ValueError
 
 
+_message_dtype = numpy.dtype([
+    ("data", ">u8"),
+    ("address", ">u4"),
+    ("rtio_counter", ">u8"),
+    ("timestamp", ">u8"),
+    ("message_type_channel", ">u4")
+])
+
+
+class DecodedMessages:
+    """
+    The messages of an analyzer dump, stored as columns.
+
+    Indexing and iterating yield the same message namedtuples as
+    :func:`decode_message`, which are created on demand; slicing (or
+    indexing with an array) returns a :class:`DecodedMessages` of the
+    selected messages.
+
+    :ivar type: message types, as the values of :class:`MessageType`
+    :ivar channel: RTIO channels
+    :ivar timestamp: timestamps of output and input messages
+    :ivar rtio_counter: RTIO counter values
+    :ivar address: addresses of output messages (and exception types)
+    :ivar data: data of output and input messages
+    """
+
+    def __init__(self, type, channel, timestamp, rtio_counter, address, data):
+        self.type = type
+        self.channel = channel
+        self.timestamp = timestamp
+        self.rtio_counter = rtio_counter
+        self.address = address
+        self.data = data
+
+    @classmethod
+    def from_messages(cls, messages):
+        """Store a sequence of message namedtuples as columns."""
+        columns = [[], [], [], [], [], []]
+        for message in messages:
+            if isinstance(message, OutputMessage):
+                row = (MessageType.output.value, message.channel, message.timestamp,
+                       message.rtio_counter, message.address, message.data)
+            elif isinstance(message, InputMessage):
+                row = (MessageType.input.value, message.channel, message.timestamp,
+                       message.rtio_counter, 0, message.data)
+            elif isinstance(message, ExceptionMessage):
+                row = (MessageType.exception.value, message.channel, 0,
+                       message.rtio_counter, message.exception_type.value, 0)
+            else:
+                row = (MessageType.stopped.value, 0, 0, message.rtio_counter, 0, 0)
+            for column, value in zip(columns, row):
+                column.append(value)
+        return cls(*(numpy.array(column, dtype)
+                     for column, dtype in zip(columns, (numpy.uint8, numpy.uint32,
+                         numpy.uint64, numpy.uint64, numpy.uint32, numpy.uint64))))
+
+    @classmethod
+    def from_buffer(cls, data, count, offset=0):
+        """Decode ``count`` messages from ``data`` at ``offset``."""
+        raw = numpy.frombuffer(data, dtype=_message_dtype, count=count, offset=offset)
+        message_type_channel = raw["message_type_channel"].astype(numpy.uint32)
+        return cls((message_type_channel & 0b11).astype(numpy.uint8),
+                   message_type_channel >> 2,
+                   raw["timestamp"].astype(numpy.uint64),
+                   raw["rtio_counter"].astype(numpy.uint64),
+                   raw["address"].astype(numpy.uint32),
+                   raw["data"].astype(numpy.uint64))
+
+    def time(self):
+        """Return the timestamps of output and input messages and the
+        RTIO counter values of the other messages, like
+        :func:`get_message_time`."""
+        timed = self.type <= MessageType.input.value
+        return numpy.where(timed, self.timestamp, self.rtio_counter)
+
+    def __len__(self):
+        return len(self.type)
+
+    def _column_slice(self, key):
+        return DecodedMessages(self.type[key], self.channel[key],
+                               self.timestamp[key], self.rtio_counter[key],
+                               self.address[key], self.data[key])
+
+    def __getitem__(self, key):
+        if isinstance(key, (slice, numpy.ndarray)):
+            return self._column_slice(key)
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("message index out of range")
+        return next(iter(self._column_slice(slice(key, key + 1))))
+
+    def __iter__(self):
+        # Convert the columns to Python integers in chunks, so that
+        # the messages compare and compute like the decoded ones.
+        chunk = 65536
+        for start in range(0, len(self), chunk):
+            rows = zip(*(column[start:start + chunk].tolist() for column in
+                         (self.type, self.channel, self.timestamp,
+                          self.rtio_counter, self.address, self.data)))
+            for message_type, channel, timestamp, rtio_counter, address, data in rows:
+                if message_type == 0b00:
+                    yield OutputMessage(channel, timestamp, rtio_counter, address, data)
+                elif message_type == 0b01:
+                    yield InputMessage(channel, timestamp, rtio_counter, data)
+                elif message_type == 0b10:
+                    yield ExceptionMessage(channel, rtio_counter,
+                                           ExceptionType(address & 0xff))
+                else:
+                    yield StoppedMessage(rtio_counter)
+
+
 DecodedDump = namedtuple(
     "DecodedDump", "log_channel dds_onehot_sel messages")
 
@@ -106,11 +223,7 @@ def decode_dump(data):
         logger.info("analyzer ring buffer has wrapped %d times",
                     total_byte_count//sent_bytes)
 
-    position = 15
-    messages = []
-    for _ in range(sent_bytes//32):
-        messages.append(decode_message(data[position:position+32]))
-        position += 32
+    messages = DecodedMessages.from_buffer(data, sent_bytes//32, offset=15)
     return DecodedDump(log_channel, bool(dds_onehot_sel), messages)
 
 
@@ -125,20 +238,55 @@ def vcd_codes():
         yield code
 
 
+class _BufferedWriter:
+    """Joins many small writes into large ones. Writes are only passed on
+    to ``fileobj`` by :meth:`flush`, which the writer of the VCD calls
+    between timestamps once ``max_chunks`` of them have accumulated."""
+    def __init__(self, fileobj, max_chunks=65536):
+        self.fileobj = fileobj
+        self.max_chunks = max_chunks
+        self.chunks = []
+        self.write = self.chunks.append
+
+    def flush(self):
+        self.fileobj.write("".join(self.chunks))
+        self.chunks.clear()
+
+
+_double = struct.Struct(">d")
+_byte_bits = ["{:08b}".format(byte) for byte in range(256)]
+
+
+def _binary64(values):
+    """Format an array of 64-bit values as strings of binary digits,
+    like ``"{:064b}".format``. Floating point values are formatted as
+    in :meth:`VCDChannel.set_value_double`."""
+    if values.dtype.kind == "f":
+        values = values.astype(numpy.float64).view(numpy.uint64)
+    bits = numpy.unpackbits(
+        numpy.ascontiguousarray(values, ">u8").view(numpy.uint8)
+        .reshape(-1, 8), axis=1)
+    bits += ord("0")
+    return bits.view("S64").ravel().astype("U64").tolist()
+
+
 class VCDChannel:
     def __init__(self, out, code):
         self.out = out
         self.code = code
+        self._write = out.write
+        self._vector_suffix = " " + code + "\n"
+        self._scalar_suffix = code + "\n"
 
     def set_value(self, value):
         if len(value) > 1:
-            self.out.write("b" + value + " " + self.code + "\n")
+            self._write("b" + value + self._vector_suffix)
         else:
-            self.out.write(value + self.code + "\n")
+            self._write(value + self._scalar_suffix)
 
     def set_value_double(self, x):
-        integer_cast = struct.unpack(">Q", struct.pack(">d", x))[0]
-        self.set_value("{:064b}".format(integer_cast))
+        integer_cast = int.from_bytes(_double.pack(x), "big")
+        self.set_value(format(integer_cast, "064b"))
 
 
 class VCDManager:
@@ -415,14 +563,15 @@ class LogHandler:
             self.current_entry += _extract_log_chars(message.data)
             if len(self.current_entry) > 1 and self.current_entry[-1] == "\x1D":
                 channel_name, log_message = self.current_entry[:-1].split("\x1E", maxsplit=1)
-                vcd_value = ""
-                for c in log_message:
-                    vcd_value += "{:08b}".format(ord(c))
+                vcd_value = "".join(_byte_bits[ord(c)] for c in log_message)
                 self.vcd_channels[channel_name].set_value(vcd_value)
                 self.current_entry = ""
 
 
 def get_vcd_log_channels(log_channel, messages):
+    if isinstance(messages, DecodedMessages):
+        messages = messages[(messages.type == MessageType.output.value) &
+                            (messages.channel == log_channel)]
     vcd_log_channels = dict()
     log_entry = ""
     for message in messages:
@@ -501,33 +650,82 @@ def get_message_time(message):
 
 
 def decoded_dump_to_vcd(fileobj, devices, dump, uniform_interval=False):
-    vcd_manager = VCDManager(fileobj)
-    ref_period = get_ref_period(devices)
+    out = _BufferedWriter(fileobj)
+    try:
+        _decoded_dump_to_vcd(out, devices, dump, uniform_interval)
+    finally:
+        out.flush()
 
-    if ref_period is not None:
-        if not uniform_interval:
-            vcd_manager.set_timescale_ps(ref_period*1e12)
-    else:
+
+def _get_clocks(devices):
+    ref_period = get_ref_period(devices)
+    if ref_period is None:
         logger.warning("unable to determine core device ref_period")
-        ref_period = 1e-9  # guess
     dds_sysclk = get_dds_sysclk(devices)
     if dds_sysclk is None:
         logger.warning("unable to determine DDS sysclk")
         dds_sysclk = 3e9  # guess
+    return ref_period, dds_sysclk
 
-    if isinstance(dump.messages[-1], StoppedMessage):
-        messages = dump.messages[:-1]
+
+def _sort_messages(messages):
+    if not isinstance(messages, DecodedMessages):
+        messages = DecodedMessages.from_messages(messages)
+    if len(messages) and messages.type[-1] == MessageType.stopped.value:
+        messages = messages[:-1]
     else:
         logger.warning("StoppedMessage missing")
-        messages = dump.messages
-    messages = sorted(messages, key=get_message_time)
+    # A stable sort, like sorted().
+    return messages[numpy.argsort(messages.time(), kind="stable")]
+
 
+def _create_dump_handlers(manager, devices, ref_period, dds_sysclk,
+                          dump, messages):
     channel_handlers = create_channel_handlers(
-        vcd_manager, devices, ref_period,
+        manager, devices, ref_period,
         dds_sysclk, dump.dds_onehot_sel)
     vcd_log_channels = get_vcd_log_channels(dump.log_channel, messages)
     channel_handlers[dump.log_channel] = LogHandler(
-        vcd_manager, vcd_log_channels)
+        manager, vcd_log_channels)
+    return channel_handlers
+
+
+def _handled_messages(messages, channel_handlers):
+    """Select the messages processed by ``channel_handlers``, and return
+    their indices, the messages, their times relative to the first nonzero
+    time, and that first nonzero time."""
+    times = messages.time()
+    start_time = 0
+    nonzero_times = numpy.flatnonzero(times)
+    if len(nonzero_times):
+        start_time = int(times[nonzero_times[0]])
+
+    handled = numpy.flatnonzero(numpy.isin(messages.channel,
+                                           list(channel_handlers)))
+    t = times[handled].astype(numpy.int64) - start_time
+    return handled, messages[handled], t, start_time
+
+
+def _rtio_slack(messages, ref_period):
+    """Return the RTIO slack of the output messages, in seconds."""
+    output = messages.type == MessageType.output.value
+    return (messages.timestamp[output].astype(numpy.int64) -
+            messages.rtio_counter[output].astype(numpy.int64))*ref_period
+
+
+def _decoded_dump_to_vcd(out, devices, dump, uniform_interval):
+    vcd_manager = VCDManager(out)
+    ref_period, dds_sysclk = _get_clocks(devices)
+
+    if ref_period is not None:
+        if not uniform_interval:
+            vcd_manager.set_timescale_ps(ref_period*1e12)
+    else:
+        ref_period = 1e-9  # guess
+
+    messages = _sort_messages(dump.messages)
+    channel_handlers = _create_dump_handlers(
+        vcd_manager, devices, ref_period, dds_sysclk, dump, messages)
     if uniform_interval:
         # RTIO event timestamp in machine units
         timestamp = vcd_manager.get_channel("timestamp", 64)
@@ -537,25 +735,185 @@ def decoded_dump_to_vcd(fileobj, devices, dump, uniform_interval=False):
     slack = vcd_manager.get_channel("rtio_slack", 64)
 
     vcd_manager.set_time(0)
-    start_time = 0
-    for m in messages:
-        start_time = get_message_time(m)
-        if start_time:
-            break
-
-    t0 = 0
-    for i, message in enumerate(messages):
-        if message.channel in channel_handlers:
-            t = get_message_time(message) - start_time
-            if t >= 0:
-                if uniform_interval:
-                    interval.set_value_double((t - t0)*ref_period)
-                    vcd_manager.set_time(i)
-                    timestamp.set_value("{:064b}".format(t))
-                    t0 = t
-                else:
-                    vcd_manager.set_time(t)
-            channel_handlers[message.channel].process_message(message)
-            if isinstance(message, OutputMessage):
-                slack.set_value_double(
-                    (message.timestamp - message.rtio_counter)*ref_period)
+    handled, handled_messages, t, _ = _handled_messages(
+        messages, channel_handlers)
+    timed = t >= 0
+
+    # Format the values of the 64-bit channels all at once.
+    slack_lines = iter(["b" + value + slack._vector_suffix
+                        for value in _binary64(
+                            _rtio_slack(handled_messages, ref_period))])
+    if uniform_interval:
+        t_timed = t[timed]
+        timestamp_values = iter(_binary64(t_timed))
+        interval_values = iter(_binary64(
+            numpy.diff(t_timed, prepend=0)*ref_period))
+
+    chunks, max_chunks, write = out.chunks, out.max_chunks, out.write
+    for i, t, timed, message in zip(handled.tolist(), t.tolist(),
+                                    timed.tolist(), handled_messages):
+        if timed:
+            if uniform_interval:
+                interval.set_value(next(interval_values))
+                vcd_manager.set_time(i)
+                timestamp.set_value(next(timestamp_values))
+            elif t != vcd_manager.current_time:
+                if len(chunks) >= max_chunks:
+                    out.flush()
+                vcd_manager.set_time(t)
+        channel_handlers[message.channel].process_message(message)
+        if isinstance(message, OutputMessage):
+            write(next(slack_lines))
+
+
+class WaveformChannel:
+    """Records the values given by the channel handlers, which are the
+    strings of binary digits of :class:`VCDChannel` or floating point
+    numbers."""
+    def __init__(self, manager, name, width):
+        self.manager = manager
+        self.name = name
+        self.width = width
+        self.times = []
+        self.values = []
+
+    def set_value(self, value):
+        self.times.append(self.manager.current_time)
+        self.values.append(value)
+
+    def set_value_double(self, x):
+        self.set_value(float(x))
+
+    def get_values(self):
+        """Return the values as an array of floating point numbers or of
+        integers (-1 for undefined single bits), or as a list of strings
+        for log channels."""
+        if all(isinstance(value, float) for value in self.values):
+            return numpy.array(self.values, numpy.float64)
+        if self.name.startswith("log/"):
+            return [bytes(int(value[i:i+8], 2) for i in range(0, len(value), 8))
+                    .decode("ascii", errors="replace") for value in self.values]
+        if self.width == 1:
+            return numpy.array([-1 if value == "X" else int(value)
+                                for value in self.values], numpy.int8)
+        return numpy.array([int(value, 2) for value in self.values],
+                           numpy.uint64)
+
+
+class WaveformManager:
+    """Records the value changes of the channels in memory, with the
+    interface of :class:`VCDManager`."""
+    def __init__(self):
+        self.channels = []
+        self.current_time = None
+
+    def set_timescale_ps(self, timescale):
+        pass
+
+    def get_channel(self, name, width):
+        channel = WaveformChannel(self, name, width)
+        self.channels.append(channel)
+        return channel
+
+    @contextmanager
+    def scope(self, name):
+        yield
+
+    def set_time(self, time):
+        self.current_time = time
+
+
+Waveforms = namedtuple("Waveforms", "channels ref_period start_time")
+
+
+def decoded_dump_to_waveforms(devices, dump):
+    """Process a decoded dump with the channel handlers, and return the
+    value changes of the channels as :class:`WaveformChannel` objects.
+
+    The times of the changes are in RTIO machine units (``ref_period``
+    seconds), from the first event at ``start_time``."""
+    manager = WaveformManager()
+    ref_period, dds_sysclk = _get_clocks(devices)
+    if ref_period is None:
+        ref_period = 1e-9  # guess
+
+    messages = _sort_messages(dump.messages)
+    channel_handlers = _create_dump_handlers(
+        manager, devices, ref_period, dds_sysclk, dump, messages)
+    slack = manager.get_channel("rtio_slack", 64)
+
+    manager.set_time(0)
+    _, handled_messages, t, start_time = _handled_messages(
+        messages, channel_handlers)
+    slack_values = iter(_rtio_slack(handled_messages, ref_period).tolist())
+    for t, message in zip(t.tolist(), handled_messages):
+        if t >= 0:
+            manager.set_time(t)
+        channel_handlers[message.channel].process_message(message)
+        if isinstance(message, OutputMessage):
+            slack.set_value(next(slack_values))
+    return Waveforms(manager.channels, ref_period, start_time)
+
+
+def decoded_dump_to_hdf5(f, devices, dump):
+    """Write the value changes of the channels to the HDF5 file or group
+    ``f``.
+
+    Each channel is a group, named after the channel, containing the
+    datasets ``time`` and ``value`` (see :meth:`WaveformChannel.get_values`).
+    The times are in RTIO machine units from the first event, and are
+    sorted, so that the changes in a time range can be found with
+    ``numpy.searchsorted`` and read without loading the whole dataset.
+    The ``ref_period`` (in seconds) and ``start_time`` attributes of ``f``
+    give the unit and origin of the times."""
+    waveforms = decoded_dump_to_waveforms(devices, dump)
+    f.attrs["ref_period"] = waveforms.ref_period
+    f.attrs["start_time"] = waveforms.start_time
+    for channel in waveforms.channels:
+        group = f.require_group(channel.name)
+        group.attrs["width"] = channel.width
+        values = channel.get_values()
+        if isinstance(values, list):
+            values = numpy.array(values, dtype=h5py.string_dtype())
+        options = {"chunks": True, "compression": "gzip"} if len(values) else {}
+        group.create_dataset("time", data=numpy.array(channel.times, numpy.int64),
+                             **options)
+        group.create_dataset("value", data=values, **options)
+
+
+def decoded_dump_to_trace(fileobj, devices, dump):
+    """Write the value changes of the channels as JSON in the Trace Event
+    Format, which can be viewed in Perfetto and ``chrome://tracing``.
+
+    The numerical channels, including ``rtio_slack`` (in seconds), become
+    counter tracks, and the log channels become threads with an instant
+    event for each message."""
+    waveforms = decoded_dump_to_waveforms(devices, dump)
+    us = waveforms.ref_period*1e6
+    out = _BufferedWriter(fileobj)
+    try:
+        out.write('{"displayTimeUnit": "ns", "traceEvents": [\n'
+                  '{"ph": "M", "pid": 0, "name": "process_name", '
+                  '"args": {"name": "RTIO"}}')
+        for tid, channel in enumerate(waveforms.channels):
+            name = json.dumps(channel.name)
+            times = (numpy.array(channel.times, numpy.float64)*us).tolist()
+            values = channel.get_values()
+            if isinstance(values, list):
+                out.write(',\n{{"ph": "M", "pid": 0, "tid": {}, '
+                          '"name": "thread_name", "args": {{"name": {}}}}}'
+                          .format(tid, name))
+                for time, value in zip(times, values):
+                    out.write(',\n{{"ph": "i", "s": "t", "pid": 0, "tid": {}, '
+                              '"ts": {!r}, "name": {}}}'
+                              .format(tid, time, json.dumps(value)))
+            else:
+                prefix = ',\n{{"ph": "C", "pid": 0, "name": {}, "ts": '.format(name)
+                for time, value in zip(times, values.tolist()):
+                    out.write(prefix + repr(time) + ', "args": {"value": ' +
+                              repr(value) + "}}")
+            if len(out.chunks) >= out.max_chunks:
+                out.flush()
+        out.write("\n]}\n")
+    finally:
+        out.flush()
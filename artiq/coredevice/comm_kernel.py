@@ -1,13 +1,16 @@
 import struct
 import logging
 import traceback
+import threading
+import queue
+import time
 import numpy
-import socket
 from enum import Enum
 from fractions import Fraction
 from collections import namedtuple
 
 from artiq.coredevice import exceptions
+from artiq.coredevice.comm_socket import create_connection
 from artiq import __version__ as software_version
 
 
@@ -53,6 +56,66 @@ class RPCReturnValueError(ValueError):
 RPCKeyword = namedtuple('RPCKeyword', ['name', 'value'])
 
 
+class _AsyncRPCExecutor:
+    """Runs asynchronous RPCs in submission order on a background thread.
+
+    Once an RPC has raised an exception, the RPCs queued after it are
+    dropped, and the exception is raised by the next :meth:`wait`."""
+    def __init__(self, queue_size, record):
+        self._queue = queue.Queue(queue_size)
+        self._record = record
+        self._thread = None
+        self._exception = None
+        self.max_depth = 0
+
+    def submit(self, service, args, kwargs):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name="async RPC")
+            self._thread.start()
+        # Blocks while the queue is full.
+        self._queue.put((service, args, kwargs))
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                service, args, kwargs = item
+                if self._exception is not None:
+                    continue
+                t0 = time.monotonic()
+                try:
+                    service(*args, **kwargs)
+                except Exception as exn:
+                    logger.debug("async rpc service: %r %r %r ! %r",
+                                 service, args, kwargs, exn)
+                    self._exception = exn
+                finally:
+                    self._record(service, time.monotonic() - t0)
+            finally:
+                self._queue.task_done()
+
+    def wait(self):
+        """Wait until all submitted RPCs have run, and raise the exception
+        of the one that failed, if any."""
+        self._queue.join()
+        exn, self._exception = self._exception, None
+        if exn is not None:
+            raise exn
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
 class CommKernelDummy:
     def __init__(self):
         pass
@@ -69,23 +132,40 @@ class CommKernelDummy:
     def check_system_info(self):
         pass
 
+    def rpc_stats(self):
+        return {"queue_depth": 0, "max_queue_depth": 0, "services": {}}
+
 
 class CommKernel:
+    """Kernel protocol client.
+
+    Asynchronous RPCs are run by a background thread, so that the messages
+    following them are received while they execute. They run in the order
+    they were sent by the kernel, and before any subsequent synchronous
+    RPC or the end of the kernel.
+
+    :param async_rpc_queue_size: number of asynchronous RPCs that can be
+        waiting to run before receiving from the core device is paused.
+    """
     warned_of_mismatch = False
 
-    def __init__(self, host, port=1381):
+    def __init__(self, host, port=1381, async_rpc_queue_size=1024):
         self._read_type = None
         self.host = host
         self.port = port
+        self._rpc_stats_lock = threading.Lock()
+        self._rpc_service_stats = {}
+        self._async_rpcs = _AsyncRPCExecutor(async_rpc_queue_size,
+                                             self._record_rpc)
 
     def open(self):
         if hasattr(self, "socket"):
             return
-        self.socket = socket.create_connection((self.host, self.port))
+        self.socket = create_connection(self.host, self.port, b"ARTIQ coredev\n")
         logger.debug("connected to %s:%d", self.host, self.port)
-        self.socket.sendall(b"ARTIQ coredev\n")
 
     def close(self):
+        self._async_rpcs.close()
         if not hasattr(self, "socket"):
             return
         self.socket.close()
@@ -93,16 +173,13 @@ class CommKernel:
         logger.debug("disconnected")
 
     def read(self, length):
-        r = bytes()
-        while len(r) < length:
-            rn = self.socket.recv(min(8192, length - len(r)))
-            if not rn:
-                raise ConnectionResetError("Connection closed")
-            r += rn
-        return r
+        return self.socket.read(length)
 
     def write(self, data):
-        self.socket.sendall(data)
+        self.socket.write(data)
+
+    def flush(self):
+        self.socket.flush()
 
     #
     # Reader interface
@@ -210,6 +287,7 @@ class CommKernel:
 
     def reset_session(self):
         self.write(struct.pack(">ll", 0x5a5a5a5a, 0))
+        self.flush()
 
     def check_system_info(self):
         self._write_empty(Request.SystemInfo)
@@ -244,13 +322,24 @@ class CommKernel:
 
     def run(self):
         self._write_empty(Request.RunKernel)
+        self.flush()
         logger.debug("running kernel")
 
     _rpc_sentinel = object()
 
+    # Wire format and host type of the scalars that are decoded in bulk
+    # when they are the elements of a list or an array.
+    _rpc_bulk_types = {
+        "b": (numpy.dtype("u1"), numpy.bool_),
+        "i": (numpy.dtype(">i4"), numpy.int32),
+        "I": (numpy.dtype(">i8"), numpy.int64),
+        "f": (numpy.dtype(">f8"), numpy.float64),
+    }
+
     # See session.c:{send,receive}_rpc_value and llvm_ir_generator.py:_rpc_tag.
-    def _receive_rpc_value(self, embedding_map):
-        tag = chr(self._read_int8())
+    def _receive_rpc_value(self, embedding_map, tag=None):
+        if tag is None:
+            tag = chr(self._read_int8())
         if tag == "\x00":
             return self._rpc_sentinel
         elif tag == "t":
@@ -278,10 +367,10 @@ class CommKernel:
             return self._read_bytes()
         elif tag == "l":
             length = self._read_int32()
-            return [self._receive_rpc_value(embedding_map) for _ in range(length)]
+            return self._receive_rpc_list(embedding_map, length, as_array=False)
         elif tag == "a":
             length = self._read_int32()
-            return numpy.array([self._receive_rpc_value(embedding_map) for _ in range(length)])
+            return self._receive_rpc_list(embedding_map, length, as_array=True)
         elif tag == "r":
             start = self._receive_rpc_value(embedding_map)
             stop  = self._receive_rpc_value(embedding_map)
@@ -296,6 +385,34 @@ class CommKernel:
         else:
             raise IOError("Unknown RPC value tag: {}".format(repr(tag)))
 
+    def _receive_rpc_list(self, embedding_map, length, as_array):
+        if length == 0:
+            return numpy.array([]) if as_array else []
+
+        # Every element carries its own tag. Elements of a list all have
+        # the same type, so if the first one is a fixed-size scalar, the rest
+        # of the list is read as one block and decoded with numpy.
+        elt_tag = chr(self._read_int8())
+        if elt_tag not in self._rpc_bulk_types:
+            values = [self._receive_rpc_value(embedding_map, elt_tag)]
+            values += [self._receive_rpc_value(embedding_map) for _ in range(length - 1)]
+            return numpy.array(values) if as_array else values
+
+        wire_type, host_type = self._rpc_bulk_types[elt_tag]
+        record = numpy.dtype([("tag", "u1"), ("value", wire_type)])
+        data = bytes([ord(elt_tag)]) + self._read_chunk(length * record.itemsize - 1)
+        records = numpy.frombuffer(data, record)
+        if not (records["tag"] == ord(elt_tag)).all():
+            raise IOError("Inconsistent RPC list element tags")
+        values = records["value"].astype(host_type)
+        if as_array:
+            return values
+        elif elt_tag in "bf":
+            # bool and float elements are plain Python objects
+            return values.tolist()
+        else:
+            return list(values)
+
     def _receive_rpc_args(self, embedding_map):
         args, kwargs = [], {}
         while True:
@@ -307,20 +424,51 @@ class CommKernel:
             else:
                 args.append(value)
 
-    def _skip_rpc_value(self, tags):
-        tag = chr(tags.pop(0))
+    def _skip_rpc_value(self, tags, pos):
+        tag = chr(tags[pos])
+        pos += 1
         if tag == "t":
-            length = tags.pop(0)
+            length = tags[pos]
+            pos += 1
             for _ in range(length):
-                self._skip_rpc_value(tags)
+                pos = self._skip_rpc_value(tags, pos)
         elif tag == "l":
-            self._skip_rpc_value(tags)
+            pos = self._skip_rpc_value(tags, pos)
         elif tag == "r":
-            self._skip_rpc_value(tags)
+            pos = self._skip_rpc_value(tags, pos)
+        return pos
+
+    def _pack_rpc_list(self, elt_tag, value):
+        """Serialize a list of scalars in one block, or return ``None`` if
+        it cannot be done this way (the element by element path then
+        reports type mismatches)."""
+        if elt_tag == "b":
+            types, wire_type, limit = (bool, ), "u1", None
+        elif elt_tag == "i":
+            types, wire_type, limit = (int, numpy.int32), ">i4", 2**31
+        elif elt_tag == "I":
+            types, wire_type, limit = (int, numpy.int32, numpy.int64), ">i8", 2**63
+        elif elt_tag == "f":
+            types, wire_type, limit = (float, ), ">f8", None
+        else:
+            return None
+
+        if not all(issubclass(ty, types) for ty in set(map(type, value))):
+            return None
+        if limit is not None:
+            try:
+                array = numpy.array(value, dtype=numpy.int64)
+            except OverflowError:
+                return None
+            if len(array) and (array.min() <= -limit or array.max() >= limit - 1):
+                return None
         else:
-            pass
+            array = numpy.array(value)
+        return array.astype(wire_type).tobytes()
 
-    def _send_rpc_value(self, tags, value, root, function):
+    def _send_rpc_value(self, tags, pos, value, root, function):
+        """Serialize ``value`` as described by the type tags starting at
+        ``tags[pos]``, and return the position just past those tags."""
         def check(cond, expected):
             if not cond:
                 raise RPCReturnValueError(
@@ -329,13 +477,16 @@ class CommKernel:
                         value=repr(value), type=expected(),
                         function=function, root=root))
 
-        tag = chr(tags.pop(0))
+        tag = chr(tags[pos])
+        pos += 1
         if tag == "t":
-            length = tags.pop(0)
+            length = tags[pos]
+            pos += 1
             check(isinstance(value, tuple) and length == len(value),
                   lambda: "tuple of {}".format(length))
             for elt in value:
-                self._send_rpc_value(tags, elt, root, function)
+                pos = self._send_rpc_value(tags, pos, elt, root, function)
+            return pos
         elif tag == "n":
             check(value is None,
                   lambda: "None")
@@ -380,22 +531,43 @@ class CommKernel:
             check(isinstance(value, list),
                   lambda: "list")
             self._write_int32(len(value))
-            for elt in value:
-                tags_copy = bytearray(tags)
-                self._send_rpc_value(tags_copy, elt, root, function)
-            self._skip_rpc_value(tags)
+            end = self._skip_rpc_value(tags, pos)
+            chunk = self._pack_rpc_list(chr(tags[pos]), value) if end == pos + 1 else None
+            if chunk is not None:
+                self._write_chunk(chunk)
+            else:
+                for elt in value:
+                    self._send_rpc_value(tags, pos, elt, root, function)
+            return end
         elif tag == "r":
             check(isinstance(value, range),
                   lambda: "range")
-            tags_copy = bytearray(tags)
-            self._send_rpc_value(tags_copy, value.start, root, function)
-            tags_copy = bytearray(tags)
-            self._send_rpc_value(tags_copy, value.stop, root, function)
-            tags_copy = bytearray(tags)
-            self._send_rpc_value(tags_copy, value.step, root, function)
-            tags = tags_copy
+            self._send_rpc_value(tags, pos, value.start, root, function)
+            self._send_rpc_value(tags, pos, value.stop, root, function)
+            return self._send_rpc_value(tags, pos, value.step, root, function)
         else:
             raise IOError("Unknown RPC value tag: {}".format(repr(tag)))
+        return pos
+
+    def _record_rpc(self, service, duration):
+        name = getattr(service, "__qualname__", None) or repr(service)
+        with self._rpc_stats_lock:
+            stats = self._rpc_service_stats.setdefault(name, {"calls": 0, "time": 0.0})
+            stats["calls"] += 1
+            stats["time"] += duration
+
+    def rpc_stats(self):
+        """Return the current and maximum number of queued asynchronous
+        RPCs, and the number of calls and total execution time (in seconds)
+        of each RPC service, keyed by its qualified name."""
+        with self._rpc_stats_lock:
+            services = {name: dict(stats)
+                        for name, stats in self._rpc_service_stats.items()}
+        return {
+            "queue_depth": self._async_rpcs.depth(),
+            "max_queue_depth": self._async_rpcs.max_depth,
+            "services": services
+        }
 
     def _truncate_message(self, msg, limit=4096):
         if len(msg) > limit:
@@ -410,23 +582,30 @@ class CommKernel:
         return_tags  = self._read_bytes()
 
         if service_id == 0:
-            service  = lambda obj, attr, value: setattr(obj, attr, value)
+            service  = setattr
         else:
             service  = embedding_map.retrieve_object(service_id)
         logger.debug("rpc service: [%d]%r%s %r %r -> %s", service_id, service,
                      (" (async)" if is_async else ""), args, kwargs, return_tags)
 
         if is_async:
-            service(*args, **kwargs)
+            self._async_rpcs.submit(service, args, kwargs)
             return
 
+        # Synchronous RPCs observe the effects of the preceding ones.
+        self._async_rpcs.wait()
         try:
-            result = service(*args, **kwargs)
+            t0 = time.monotonic()
+            try:
+                result = service(*args, **kwargs)
+            finally:
+                self._record_rpc(service, time.monotonic() - t0)
             logger.debug("rpc service: %d %r %r = %r", service_id, args, kwargs, result)
 
             self._write_header(Request.RPCReply)
             self._write_bytes(return_tags)
-            self._send_rpc_value(bytearray(return_tags), result, result, service)
+            self._send_rpc_value(return_tags, 0, result, result, service)
+            self.flush()
         except RPCReturnValueError as exn:
             raise
         except Exception as exn:
@@ -471,6 +650,7 @@ class CommKernel:
                 self._write_int32(line)
                 self._write_int32(-1) # column not known
                 self._write_string(function)
+            self.flush()
 
     def _serve_exception(self, embedding_map, symbolizer, demangler):
         name      = self._read_string()
@@ -498,11 +678,26 @@ class CommKernel:
         raise python_exn
 
     def serve(self, embedding_map, symbolizer, demangler):
+        try:
+            self._serve(embedding_map, symbolizer, demangler)
+        except:
+            # Whatever the outcome of the kernel, the asynchronous RPCs it
+            # has made have run when this returns.
+            try:
+                self._async_rpcs.wait()
+            except Exception:
+                logger.error("asynchronous RPC failed", exc_info=True)
+            raise
+
+    def _serve(self, embedding_map, symbolizer, demangler):
         while True:
             self._read_header()
             if self._read_type == Reply.RPCRequest:
                 self._serve_rpc(embedding_map)
-            elif self._read_type == Reply.KernelException:
+                continue
+
+            self._async_rpcs.wait()
+            if self._read_type == Reply.KernelException:
                 self._serve_exception(embedding_map, symbolizer, demangler)
             elif self._read_type == Reply.WatchdogExpired:
                 raise exceptions.WatchdogExpired
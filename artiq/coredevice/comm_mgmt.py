@@ -1,8 +1,9 @@
 from enum import Enum
 import logging
-import socket
 import struct
 
+from artiq.coredevice.comm_socket import create_connection
+
 
 logger = logging.getLogger(__name__)
 
@@ -60,9 +61,8 @@ class CommMgmt:
     def open(self):
         if hasattr(self, "socket"):
             return
-        self.socket = socket.create_connection((self.host, self.port))
+        self.socket = create_connection(self.host, self.port, b"ARTIQ management\n")
         logger.debug("connected to %s:%d", self.host, self.port)
-        self.socket.sendall(b"ARTIQ management\n")
 
     def close(self):
         if not hasattr(self, "socket"):
@@ -74,7 +74,7 @@ class CommMgmt:
     # Protocol elements
 
     def _write(self, data):
-        self.socket.sendall(data)
+        self.socket.write(data)
 
     def _write_header(self, ty):
         self.open()
@@ -96,13 +96,8 @@ class CommMgmt:
         self._write_bytes(value.encode("utf-8"))
 
     def _read(self, length):
-        r = bytes()
-        while len(r) < length:
-            rn = self.socket.recv(min(8192, length - len(r)))
-            if not rn:
-                raise ConnectionResetError("Connection closed")
-            r += rn
-        return r
+        # Also sends the request being answered.
+        return self.socket.read(length)
 
     def _read_header(self):
         ty = Reply(*struct.unpack("B", self._read(1)))
@@ -228,3 +223,4 @@ class CommMgmt:
 
     def debug_allocator(self):
         self._write_header(Request.DebugAllocator)
+        self.socket.flush()
@@ -10,6 +10,11 @@ __all__ = ["TTLProbe", "TTLOverride", "CommMonInj"]
 logger = logging.getLogger(__name__)
 
 
+_monitor_packet = struct.Struct(">blbl")
+_injection_status_packet = struct.Struct(">blbb")
+_packet_sizes = {0: _monitor_packet.size, 1: _injection_status_packet.size}
+
+
 class TTLProbe(Enum):
     level = 0
     oe = 1
@@ -22,10 +27,28 @@ class TTLOverride(Enum):
 
 
 class CommMonInj:
-    def __init__(self, monitor_cb, injection_status_cb, disconnect_cb=None):
+    """
+    Connection to the monitoring and injection interface of a core device.
+
+    ``monitor_cb(channel, probe, value)`` and
+    ``injection_status_cb(channel, override, value)`` are called with the
+    updates sent by the core device. If ``coalesce_interval`` is given
+    (in seconds), the updates are held back and delivered at most once
+    per interval, with only the last value of each probe and override;
+    the number of updates that were superseded and not delivered is kept
+    in ``dropped_updates``. The pending updates are delivered before
+    ``disconnect_cb`` is called, and discarded by :meth:`close`.
+    """
+    def __init__(self, monitor_cb, injection_status_cb, disconnect_cb=None,
+                 coalesce_interval=None):
         self.monitor_cb = monitor_cb
         self.injection_status_cb = injection_status_cb
         self.disconnect_cb = disconnect_cb
+        self.coalesce_interval = coalesce_interval
+        self.dropped_updates = 0
+        self._monitor_updates = dict()
+        self._injection_status_updates = dict()
+        self._deliver_handle = None
 
     async def connect(self, host, port=1383):
         self._reader, self._writer = await asyncio.open_connection(host, port)
@@ -52,11 +75,23 @@ class CommMonInj:
             del self._writer
 
     def monitor_probe(self, enable, channel, probe):
-        packet = struct.pack(">bblb", 0, enable, channel, probe)
+        self.monitor_probes(enable, [(channel, probe)])
+
+    def monitor_probes(self, enable, probes):
+        """Enable or disable the monitoring of several probes, given as
+        ``(channel, probe)`` pairs, in one write."""
+        packet = b"".join(struct.pack(">bblb", 0, enable, channel, probe)
+                          for channel, probe in probes)
         self._writer.write(packet)
 
     def monitor_injection(self, enable, channel, overrd):
-        packet = struct.pack(">bblb", 3, enable, channel, overrd)
+        self.monitor_injections(enable, [(channel, overrd)])
+
+    def monitor_injections(self, enable, overrides):
+        """Enable or disable the monitoring of several overrides, given as
+        ``(channel, override)`` pairs, in one write."""
+        packet = b"".join(struct.pack(">bblb", 3, enable, channel, overrd)
+                          for channel, overrd in overrides)
         self._writer.write(packet)
 
     def inject(self, channel, override, value):
@@ -67,22 +102,82 @@ class CommMonInj:
         packet = struct.pack(">blb", 2, channel, override)
         self._writer.write(packet)
 
+    def _deliver_updates(self):
+        self._deliver_handle = None
+        monitor_updates = self._monitor_updates
+        injection_status_updates = self._injection_status_updates
+        self._monitor_updates = dict()
+        self._injection_status_updates = dict()
+        for (channel, probe), value in monitor_updates.items():
+            self.monitor_cb(channel, probe, value)
+        for (channel, override), value in injection_status_updates.items():
+            self.injection_status_cb(channel, override, value)
+
+    def _process_packets(self, data):
+        """Process the complete packets at the start of ``data``, and
+        return the number of bytes remaining after them."""
+        if self.coalesce_interval is None:
+            monitor_cb = self.monitor_cb
+            injection_status_cb = self.injection_status_cb
+        else:
+            monitor_updates = self._monitor_updates
+            injection_status_updates = self._injection_status_updates
+            pending = len(monitor_updates) + len(injection_status_updates)
+            updates = 0
+        offset = 0
+        while offset < len(data):
+            ty = data[offset]
+            if ty == 0:
+                if offset + _monitor_packet.size > len(data):
+                    break
+                _, channel, probe, value = _monitor_packet.unpack_from(data, offset)
+                offset += _monitor_packet.size
+                if self.coalesce_interval is None:
+                    monitor_cb(channel, probe, value)
+                else:
+                    monitor_updates[(channel, probe)] = value
+                    updates += 1
+            elif ty == 1:
+                if offset + _injection_status_packet.size > len(data):
+                    break
+                _, channel, override, value = \
+                    _injection_status_packet.unpack_from(data, offset)
+                offset += _injection_status_packet.size
+                if self.coalesce_interval is None:
+                    injection_status_cb(channel, override, value)
+                else:
+                    injection_status_updates[(channel, override)] = value
+                    updates += 1
+            else:
+                raise ValueError("Unknown packet type", bytes([ty]))
+        if self.coalesce_interval is not None and updates:
+            self.dropped_updates += (pending + updates -
+                len(monitor_updates) - len(injection_status_updates))
+            if self._deliver_handle is None:
+                self._deliver_handle = asyncio.get_event_loop().call_later(
+                    self.coalesce_interval, self._deliver_updates)
+        return len(data) - offset
+
     async def _receive_cr(self):
         try:
             while True:
-                ty = await self._reader.read(1)
-                if not ty:
+                # Process all the packets that have been received at once,
+                # and wait for the rest of an incomplete one.
+                data = await self._reader.read(65536)
+                if not data:
                     return
-                if ty == b"\x00":
-                    payload = await self._reader.read(9)
-                    channel, probe, value = struct.unpack(">lbl", payload)
-                    self.monitor_cb(channel, probe, value)
-                elif ty == b"\x01":
-                    payload = await self._reader.read(6)
-                    channel, override, value = struct.unpack(">lbb", payload)
-                    self.injection_status_cb(channel, override, value)
-                else:
-                    raise ValueError("Unknown packet type", ty)
+                remaining = self._process_packets(data)
+                if remaining:
+                    data = data[len(data) - remaining:]
+                    data += await self._reader.readexactly(
+                        _packet_sizes[data[0]] - remaining)
+                    self._process_packets(data)
+        except asyncio.IncompleteReadError:
+            return
         finally:
+            if self._deliver_handle is not None:
+                self._deliver_handle.cancel()
+                self._deliver_handle = None
             if self.disconnect_cb is not None:
+                self._deliver_updates()
                 self.disconnect_cb()
@@ -0,0 +1,88 @@
+"""
+Buffered TCP transport shared by the core device protocols.
+"""
+
+import socket
+
+
+class BufferedSocket:
+    """
+    Wraps a connected socket with a receive buffer filled by
+    ``recv_into`` and a write buffer that is sent in one go by
+    :meth:`flush`. Pending writes are also flushed before waiting for
+    data, so that a request is always sent before its reply is awaited.
+
+    :param sock: connected stream socket
+    :param buffer_size: size of the receive buffer, and amount of written
+        data above which the write buffer is flushed immediately
+    """
+
+    def __init__(self, sock, buffer_size=65536):
+        self.socket = sock
+        self.buffer_size = buffer_size
+        self._rx = bytearray(buffer_size)
+        self._rx_view = memoryview(self._rx)
+        self._rx_start = 0
+        self._rx_end = 0
+        self._tx = bytearray()
+
+    def _recv_into(self, view):
+        self.flush()
+        n = self.socket.recv_into(view)
+        if not n:
+            raise ConnectionResetError("Connection closed")
+        return n
+
+    def read(self, length):
+        """Read exactly ``length`` bytes."""
+        available = self._rx_end - self._rx_start
+        if available >= length:
+            start = self._rx_start
+            self._rx_start += length
+            return bytes(self._rx_view[start:start + length])
+
+        result = bytearray(length)
+        view = memoryview(result)
+        view[:available] = self._rx_view[self._rx_start:self._rx_end]
+        position = available
+        self._rx_start = self._rx_end = 0
+        while position < length:
+            remaining = length - position
+            if remaining >= self.buffer_size:
+                # Large blocks are received directly in place.
+                position += self._recv_into(view[position:])
+            else:
+                self._rx_end = self._recv_into(self._rx_view)
+                n = min(remaining, self._rx_end)
+                view[position:position + n] = self._rx_view[:n]
+                self._rx_start = n
+                position += n
+        return bytes(result)
+
+    def write(self, data):
+        """Queue ``data`` to be sent by the next :meth:`flush`."""
+        self._tx += data
+        if len(self._tx) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Send all queued data."""
+        if self._tx:
+            self.socket.sendall(self._tx)
+            del self._tx[:]
+
+    def close(self):
+        self.socket.close()
+
+
+def create_connection(host, port, greeting):
+    """Connect to a core device service and send its greeting.
+
+    Small messages are exchanged in lockstep with the device, so Nagle's
+    algorithm is disabled.
+    """
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    connection = BufferedSocket(sock)
+    connection.write(greeting)
+    return connection
@@ -1,5 +1,7 @@
 import os, sys
+import logging
 import numpy
+from collections import OrderedDict
 
 from pythonparser import diagnostic
 
@@ -11,13 +13,20 @@ from artiq.language.units import *
 
 from artiq.compiler.module import Module
 from artiq.compiler.embedding import Stitcher
-from artiq.compiler.targets import OR1KTarget, CortexA9Target
+from artiq.compiler.targets import (OR1KTarget, CortexA9Target,
+                                    shutdown_codegen_pool)
+from artiq.compiler.compilation_cache import CompilationCache
+from artiq.compiler.symbolizer import Symbolizer
+from artiq.compiler import timing
 
 from artiq.coredevice.comm_kernel import CommKernel, CommKernelDummy
 # Import for side effects (creating the exception classes).
 from artiq.coredevice import exceptions
 
 
+logger = logging.getLogger(__name__)
+
+
 def _render_diagnostic(diagnostic, colored):
     def shorten_path(path):
         return path.replace(artiq_dir, "<artiq>")
@@ -65,13 +74,37 @@ class Core:
     :param ref_multiplier: ratio between the RTIO fine timestamp frequency
         and the RTIO coarse timestamp frequency (e.g. SERDES multiplication
         factor).
+    :param compile_cache_size: number of compiled kernels kept in memory
+        and reused when an identical kernel is compiled again (0 disables
+        the cache).
+    :param compile_cache_dir: directory where compiled kernels are stored
+        and shared between processes (e.g. the workers of the master), or
+        ``None``.
+    :param parameter_slots: pass the scalar attributes of host objects
+        that are not kernel invariants, and the ``bool``, ``float``,
+        ``numpy.int32`` and ``numpy.int64`` arguments of the kernel,
+        in the data section of the kernel library instead of compiling them
+        in as constants. Kernels that only differ by these values then reuse
+        the cached library, with the new values written into it.
+    :param compile_profile: time the phases of each kernel compilation.
+        The reports (see :mod:`artiq.compiler.timing`) are logged at the
+        INFO level and accumulated in ``compile_profiles``, which the master
+        stores in the results of the experiment.
+    :param codegen_partitions: after optimization, split the LLVM module of
+        each kernel into this many partitions, compiled to machine code in
+        parallel worker processes (see :mod:`artiq.compiler.partitioning`).
+        With the default of 1, the machine code of the whole module is
+        emitted at once.
     """
 
     kernel_invariants = {
         "core", "ref_period", "coarse_ref_period", "ref_multiplier",
     }
 
-    def __init__(self, dmgr, host, ref_period, ref_multiplier=8, target="or1k"):
+    def __init__(self, dmgr, host, ref_period, ref_multiplier=8, target="or1k",
+                 compile_cache_size=32, compile_cache_dir=None,
+                 parameter_slots=False, compile_profile=False,
+                 codegen_partitions=1):
         self.ref_period = ref_period
         self.ref_multiplier = ref_multiplier
         if target == "or1k":
@@ -86,6 +119,16 @@ class Core:
         else:
             self.comm = CommKernel(host)
 
+        self.compile_cache = CompilationCache(compile_cache_size,
+                                              compile_cache_dir)
+        self.parameter_slots = parameter_slots
+        self.compile_profile = compile_profile
+        self.compile_profiles = []
+        self.codegen_partitions = codegen_partitions
+        # Symbolizers of the most recently run kernel libraries, so that
+        # exceptions raised repeatedly by a kernel are resolved quickly.
+        self._symbolizers = OrderedDict()
+
         self.first_run = True
         self.dmgr = dmgr
         self.core = self
@@ -93,28 +136,78 @@ class Core:
 
     def close(self):
         self.comm.close()
+        for symbolizer in self._symbolizers.values():
+            symbolizer.close()
+        self._symbolizers.clear()
+        if self.codegen_partitions > 1:
+            shutdown_codegen_pool()
+
+    def _get_symbolizer(self, library):
+        symbolizer = self._symbolizers.pop(library, None)
+        if symbolizer is None:
+            symbolizer = Symbolizer(library, self.target_cls.triple)
+        self._symbolizers[library] = symbolizer
+        while len(self._symbolizers) > 4:
+            _, evicted = self._symbolizers.popitem(last=False)
+            evicted.close()
+        return symbolizer
 
     def compile(self, function, args, kwargs, set_result=None,
                 attribute_writeback=True, print_as_rpc=True):
+        if not self.compile_profile:
+            return self._compile(function, args, kwargs, set_result,
+                                 attribute_writeback, print_as_rpc)
+
+        timer = timing.CompileTimer(getattr(function, "__qualname__", repr(function)))
+        try:
+            with timer.activate(), timer.phase("kernel compilation"):
+                return self._compile(function, args, kwargs, set_result,
+                                     attribute_writeback, print_as_rpc)
+        finally:
+            report = timer.report()
+            self.compile_profiles.append(report)
+            logger.info("%s", timing.format_report(report))
+
+    def _compile(self, function, args, kwargs, set_result,
+                 attribute_writeback, print_as_rpc):
         try:
             engine = _DiagnosticEngine(all_errors_are_fatal=True)
 
-            stitcher = Stitcher(engine=engine, core=self, dmgr=self.dmgr,
-                                print_as_rpc=print_as_rpc)
-            stitcher.stitch_call(function, args, kwargs, set_result)
-            stitcher.finalize()
-
-            module = Module(stitcher,
-                ref_period=self.ref_period,
-                attribute_writeback=attribute_writeback)
-            target = self.target_cls()
-
-            library = target.compile_and_link([module])
-            stripped_library = target.strip(library)
-
+            with timing.phase("stitching"):
+                stitcher = Stitcher(engine=engine, core=self, dmgr=self.dmgr,
+                                    print_as_rpc=print_as_rpc,
+                                    parameter_slots=self.parameter_slots)
+                stitcher.stitch_call(function, args, kwargs, set_result)
+            with timing.phase("Stitcher.finalize"):
+                stitcher.finalize()
+            target = self.target_cls(codegen_partitions=self.codegen_partitions)
+
+            with timing.phase("compilation cache lookup"):
+                fingerprint = self.compile_cache.fingerprint(stitcher, target,
+                    ref_period=self.ref_period,
+                    attribute_writeback=attribute_writeback)
+                cached = None
+                if fingerprint is not None:
+                    cached = self.compile_cache.get(fingerprint)
+            if cached is not None:
+                library, stripped_library = cached
+            else:
+                with timing.phase("ARTIQ passes"):
+                    module = Module(stitcher,
+                        ref_period=self.ref_period,
+                        attribute_writeback=attribute_writeback,
+                        parameter_slots=self.parameter_slots)
+
+                library = target.compile_and_link([module])
+                with timing.phase("strip"):
+                    stripped_library = target.strip(library)
+                if fingerprint is not None:
+                    self.compile_cache.put(fingerprint, target, library,
+                                           stripped_library, module.parameter_slots)
+
+            symbolizer = self._get_symbolizer(library)
             return stitcher.embedding_map, stripped_library, \
-                   lambda addresses: target.symbolize(library, addresses), \
-                   lambda symbols: target.demangle(symbols)
+                   symbolizer.backtrace, symbolizer.demangle
         except diagnostic.Error as error:
             raise CompileError(error.diagnostic) from error
 
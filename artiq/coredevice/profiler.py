@@ -1,36 +1,6 @@
 from collections import defaultdict
-import subprocess
 
-
-class Symbolizer:
-    def __init__(self, binary, triple, demangle=True):
-        cmdline = [
-            triple + "-addr2line", "--exe=" + binary,
-            "--addresses", "--functions", "--inlines"
-        ]
-        if demangle:
-            cmdline.append("--demangle=rust")
-        self._addr2line = subprocess.Popen(cmdline, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                           universal_newlines=True)
-
-    def symbolize(self, addr):
-        self._addr2line.stdin.write("0x{:08x}\n0\n".format(addr))
-        self._addr2line.stdin.flush()
-        self._addr2line.stdout.readline() # 0x[addr]
-
-        result = []
-        while True:
-            function = self._addr2line.stdout.readline().rstrip()
-
-            # check for end marker
-            if function == "0x00000000":          # 0x00000000
-                self._addr2line.stdout.readline() # ??
-                self._addr2line.stdout.readline() # ??:0
-                return result
-
-            file, line = self._addr2line.stdout.readline().rstrip().split(":")
-
-            result.append((function, file, line, addr))
+from artiq.compiler.symbolizer import Symbolizer
 
 
 class CallgrindWriter:
@@ -40,7 +10,8 @@ class CallgrindWriter:
         self._current = defaultdict(lambda: None)
         self._ids = defaultdict(lambda: {})
         self._compression = compression
-        self._symbolizer = Symbolizer(binary, triple, demangle=demangle)
+        self._symbolizer = Symbolizer(binary, triple,
+                                      demangle="rust" if demangle else False)
 
     def _write(self, fmt, *args, **kwargs):
         self._output.write(fmt.format(*args, **kwargs))
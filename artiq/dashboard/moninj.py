@@ -273,28 +273,35 @@ class _DeviceManager:
 
         self.dds_sysclk = dds_sysclk
 
+        disabled_ttl = []
+        disabled_probes = []
         for to_remove in self.description - description:
             widget = self.widgets_by_uid[to_remove.uid]
             del self.widgets_by_uid[to_remove.uid]
 
             if isinstance(widget, _TTLWidget):
-                self.setup_ttl_monitoring(False, widget.channel)
+                disabled_ttl.append(widget.channel)
                 widget.deleteLater()
                 del self.ttl_widgets[widget.channel]
                 self.ttl_cb()
             elif isinstance(widget, _DDSWidget):
-                self.setup_dds_monitoring(False, widget.bus_channel, widget.channel)
+                disabled_probes.append((widget.bus_channel, widget.channel))
                 widget.deleteLater()
                 del self.dds_widgets[(widget.bus_channel, widget.channel)]
                 self.dds_cb()
             elif isinstance(widget, _DACWidget):
-                self.setup_dac_monitoring(False, widget.spi_channel, widget.channel)
+                disabled_probes.append((widget.spi_channel, widget.channel))
                 widget.deleteLater()
                 del self.dac_widgets[(widget.spi_channel, widget.channel)]
                 self.dac_cb()     
             else:
                 raise ValueError
 
+        self.setup_ttl_monitoring(False, disabled_ttl)
+        self.setup_probe_monitoring(False, disabled_probes)
+
+        enabled_ttl = []
+        enabled_probes = []
         for to_add in description - self.description:
             widget = to_add.cls(self, *to_add.arguments)
             if to_add.comment is not None:
@@ -304,18 +311,21 @@ class _DeviceManager:
             if isinstance(widget, _TTLWidget):
                 self.ttl_widgets[widget.channel] = widget
                 self.ttl_cb()
-                self.setup_ttl_monitoring(True, widget.channel)
+                enabled_ttl.append(widget.channel)
             elif isinstance(widget, _DDSWidget):
                 self.dds_widgets[(widget.bus_channel, widget.channel)] = widget
                 self.dds_cb()
-                self.setup_dds_monitoring(True, widget.bus_channel, widget.channel)
+                enabled_probes.append((widget.bus_channel, widget.channel))
             elif isinstance(widget, _DACWidget):
                 self.dac_widgets[(widget.spi_channel, widget.channel)] = widget
                 self.dac_cb()
-                self.setup_dac_monitoring(True, widget.spi_channel, widget.channel)
+                enabled_probes.append((widget.spi_channel, widget.channel))
             else:
                 raise ValueError
 
+        self.setup_ttl_monitoring(True, enabled_ttl)
+        self.setup_probe_monitoring(True, enabled_probes)
+
         self.description = description
 
     def ttl_set_mode(self, channel, mode):
@@ -341,22 +351,22 @@ class _DeviceManager:
             # override state may have changed
             widget.refresh_display()
 
-    def setup_ttl_monitoring(self, enable, channel):
-        if self.core_connection is not None:
-            self.core_connection.monitor_probe(enable, channel, TTLProbe.level.value)
-            self.core_connection.monitor_probe(enable, channel, TTLProbe.oe.value)
-            self.core_connection.monitor_injection(enable, channel, TTLOverride.en.value)
-            self.core_connection.monitor_injection(enable, channel, TTLOverride.level.value)
+    def setup_ttl_monitoring(self, enable, channels):
+        if self.core_connection is not None and channels:
+            self.core_connection.monitor_probes(enable,
+                [(channel, probe.value) for channel in channels
+                 for probe in (TTLProbe.level, TTLProbe.oe)])
+            self.core_connection.monitor_injections(enable,
+                [(channel, override.value) for channel in channels
+                 for override in (TTLOverride.en, TTLOverride.level)])
             if enable:
-                self.core_connection.get_injection_status(channel, TTLOverride.en.value)
+                for channel in channels:
+                    self.core_connection.get_injection_status(channel, TTLOverride.en.value)
 
-    def setup_dds_monitoring(self, enable, bus_channel, channel):
-        if self.core_connection is not None:
-            self.core_connection.monitor_probe(enable, bus_channel, channel)
-
-    def setup_dac_monitoring(self, enable, spi_channel, channel):
-        if self.core_connection is not None:
-            self.core_connection.monitor_probe(enable, spi_channel, channel)
+    def setup_probe_monitoring(self, enable, probes):
+        """Monitor the DDS and DAC probes, given as (channel, probe) pairs."""
+        if self.core_connection is not None and probes:
+            self.core_connection.monitor_probes(enable, probes)
 
     def monitor_cb(self, channel, probe, value):
         if channel in self.ttl_widgets:
@@ -395,8 +405,9 @@ class _DeviceManager:
             if self.core_connection is not None:
                 await self.core_connection.close()
                 self.core_connection = None
+            # Deliver at most one update of each probe per frame.
             new_core_connection = CommMonInj(self.monitor_cb, self.injection_status_cb,
-                    self.disconnect_cb)
+                    self.disconnect_cb, coalesce_interval=1/60)
             try:
                 await new_core_connection.connect(self.core_addr, 1383)
             except:
@@ -405,12 +416,9 @@ class _DeviceManager:
                 self.reconnect_core.set()
             else:
                 self.core_connection = new_core_connection
-                for ttl_channel in self.ttl_widgets.keys():
-                    self.setup_ttl_monitoring(True, ttl_channel)
-                for bus_channel, channel in self.dds_widgets.keys():
-                    self.setup_dds_monitoring(True, bus_channel, channel)
-                for spi_channel, channel in self.dac_widgets.keys():
-                    self.setup_dac_monitoring(True, spi_channel, channel)
+                self.setup_ttl_monitoring(True, list(self.ttl_widgets.keys()))
+                self.setup_probe_monitoring(True, list(self.dds_widgets.keys()) +
+                                                  list(self.dac_widgets.keys()))
 
     async def close(self):
         self.core_connector_task.cancel()
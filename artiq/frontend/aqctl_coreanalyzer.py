@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+
+from sipyco.pc_rpc import Server
+from sipyco import common_args
+
+from artiq.coredevice.analyzer_capture import CaptureStore, AnalyzerCapture
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(
+        description="ARTIQ controller for continuous RTIO analyzer capture")
+    common_args.verbosity_args(parser)
+    common_args.simple_network_args(parser, 1069)
+    parser.add_argument("-d", "--directory", default="analyzer",
+                        help="directory where the analyzer dumps are stored "
+                             "(default: '%(default)s')")
+    parser.add_argument("-s", "--max-size", type=int, default=1024,
+                        help="maximum size of the stored dumps in MiB, "
+                             "above which the oldest ones are deleted "
+                             "(default: %(default)d)")
+    parser.add_argument("-i", "--interval", type=float, default=1.0,
+                        help="time between reads of the analyzer, "
+                             "in seconds (default: %(default)s)")
+    parser.add_argument("core_addr", metavar="CORE_ADDR",
+                        help="hostname or IP address of the core device")
+    return parser
+
+
+def main():
+    args = get_argparser().parse_args()
+    common_args.init_logger_from_args(args)
+
+    store = CaptureStore(args.directory, args.max_size*1024*1024)
+    capture = AnalyzerCapture(args.core_addr, store, args.interval)
+
+    loop = asyncio.get_event_loop()
+    try:
+        capture_task = asyncio.ensure_future(capture.run())
+        try:
+            server = Server({"coreanalyzer": capture}, None, True)
+            loop.run_until_complete(server.start(common_args.bind_address_from_args(args), args.port))
+            try:
+                loop.run_until_complete(server.wait_terminate())
+            finally:
+                loop.run_until_complete(server.stop())
+        finally:
+            capture_task.cancel()
+            try:
+                loop.run_until_complete(capture_task)
+            except asyncio.CancelledError:
+                pass
+    finally:
+        loop.close()
+
+if __name__ == "__main__":
+    main()
@@ -100,10 +100,12 @@ def get_argparser():
     parser_del_dataset.add_argument("name", help="name of the dataset")
 
     parser_show = subparsers.add_parser(
-        "show", help="show schedule, log, devices or datasets")
+        "show", help="show schedule, scheduler statistics, log, devices "
+                     "or datasets")
     parser_show.add_argument(
         "what", metavar="WHAT",
-        choices=["schedule", "log", "ccb", "devices", "datasets"],
+        choices=["schedule", "schedule-stats", "log", "ccb", "devices",
+                 "datasets"],
         help="select object to show: %(choices)s")
 
     subparsers.add_parser(
@@ -217,6 +219,21 @@ def _show_schedule(schedule):
         print("Schedule is empty")
 
 
+def _show_schedule_stats(stats):
+    clear_screen()
+    table = PrettyTable(["Pipeline", "Metric", "Count", "Mean", "Min",
+                         "Max", "Total"])
+    for pipeline, metrics in sorted(stats["pipelines"].items(),
+                                    key=itemgetter(0)):
+        for metric, h in sorted(metrics.items(), key=itemgetter(0)):
+            table.add_row([pipeline, metric, h["count"]] +
+                          ["{:.3f}".format(h[k])
+                           for k in ("mean", "min", "max", "total")])
+    table.align["Metric"] = "l"
+    print("Durations of the stages of runs, in seconds")
+    print(table)
+
+
 def _show_devices(devices):
     clear_screen()
     table = PrettyTable(["Name", "Description"])
@@ -289,6 +306,8 @@ def main():
     if action == "show":
         if args.what == "schedule":
             _show_dict(args, "schedule", _show_schedule)
+        elif args.what == "schedule-stats":
+            _show_dict(args, "schedule_stats", _show_schedule_stats)
         elif args.what == "log":
             _show_log(args)
         elif args.what == "ccb":
@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
 
 import argparse
+import gzip
 import sys
 
+import h5py
 from sipyco import common_args
 
 from artiq.master.databases import DeviceDB
 from artiq.master.worker_db import DeviceManager
 from artiq.coredevice.comm_analyzer import (get_analyzer_dump,
-                                            decode_dump, decoded_dump_to_vcd)
+                                            decode_dump, decoded_dump_to_vcd,
+                                            decoded_dump_to_hdf5,
+                                            decoded_dump_to_trace)
 
 
 def get_argparser():
@@ -24,7 +28,15 @@ def get_argparser():
     parser.add_argument("-p", "--print-decoded", default=False,
                         action="store_true", help="print raw decoded messages")
     parser.add_argument("-w", "--write-vcd", type=str, default=None,
-                        help="format and write contents to VCD file")
+                        help="format and write contents to VCD file "
+                             "(gzip-compressed if the name ends with '.gz')")
+    parser.add_argument("--write-hdf5", type=str, default=None,
+                        help="write the value changes of each channel, "
+                             "indexed by time, to HDF5 file")
+    parser.add_argument("--write-trace", type=str, default=None,
+                        help="write the value changes to Perfetto/Chrome "
+                             "trace JSON file "
+                             "(gzip-compressed if the name ends with '.gz')")
     parser.add_argument("-d", "--write-dump", type=str, default=None,
                         help="write raw dump file")
 
@@ -36,13 +48,22 @@ def get_argparser():
     return parser
 
 
+def open_text_output(filename):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "wt", compresslevel=6)
+    else:
+        return open(filename, "w")
+
+
 def main():
     args = get_argparser().parse_args()
     common_args.init_logger_from_args(args)
 
     if (not args.print_decoded
-            and args.write_vcd is None and args.write_dump is None):
-        print("No action selected, use -p, -w and/or -d. See -h for help.")
+            and args.write_vcd is None and args.write_dump is None
+            and args.write_hdf5 is None and args.write_trace is None):
+        print("No action selected, use -p, -w, -d, --write-hdf5 and/or "
+              "--write-trace. See -h for help.")
         sys.exit(1)
 
     device_mgr = DeviceManager(DeviceDB(args.device_db))
@@ -59,10 +80,16 @@ def main():
         for message in decoded_dump.messages:
             print(message)
     if args.write_vcd:
-        with open(args.write_vcd, "w") as f:
+        with open_text_output(args.write_vcd) as f:
             decoded_dump_to_vcd(f, device_mgr.get_device_db(),
                                 decoded_dump,
                                 uniform_interval=args.vcd_uniform_interval)
+    if args.write_hdf5:
+        with h5py.File(args.write_hdf5, "w") as f:
+            decoded_dump_to_hdf5(f, device_mgr.get_device_db(), decoded_dump)
+    if args.write_trace:
+        with open_text_output(args.write_trace) as f:
+            decoded_dump_to_trace(f, device_mgr.get_device_db(), decoded_dump)
     if args.write_dump:
         with open(args.write_dump, "wb") as f:
             f.write(dump)
@@ -17,6 +17,7 @@ from artiq import __version__ as artiq_version
 from artiq.master.log import log_args, init_log
 from artiq.master.databases import DeviceDB, DatasetDB
 from artiq.master.scheduler import Scheduler
+from artiq.master.worker import WorkerPool
 from artiq.master.rid_counter import RIDCounter
 from artiq.master.experiments import (FilesystemBackend, GitBackend,
                                       ExperimentDB)
@@ -42,6 +43,22 @@ def get_argparser():
                        help="device database file (default: '%(default)s')")
     group.add_argument("--dataset-db", default="dataset_db.pyon",
                        help="dataset file (default: '%(default)s')")
+    group.add_argument(
+        "--dataset-flush-interval", default=None, type=float,
+        help="let workers accumulate and coalesce modifications of "
+             "broadcast datasets for up to this number of seconds "
+             "(default: send each modification immediately)")
+    group.add_argument(
+        "--dataset-flush-size", default=None, type=int,
+        help="let workers accumulate and coalesce up to this number of "
+             "modifications of broadcast datasets "
+             "(default: send each modification immediately)")
+
+    group = parser.add_argument_group("results")
+    group.add_argument(
+        "--results-compression", default=None, choices=["gzip", "lzf"],
+        help="compress the arrays in the HDF5 result files with this "
+             "filter (default: no compression)")
 
     group = parser.add_argument_group("repository")
     group.add_argument(
@@ -50,6 +67,36 @@ def get_argparser():
     group.add_argument(
         "-r", "--repository", default="repository",
         help="path to the repository (default: '%(default)s')")
+    group.add_argument(
+        "--git-cache-size", default=8, type=int,
+        help="number of unused Git checkouts to keep for later runs "
+             "(default: %(default)s)")
+    group.add_argument(
+        "--git-cache-max-size", default=None, type=float,
+        help="delete unused Git checkouts when the files of all checkouts "
+             "exceed this size, in MiB (default: no limit)")
+    group.add_argument(
+        "--scan-cache", default=None,
+        help="file in which to keep the results of repository scans "
+             "across restarts of the master (default: keep them in memory)")
+    group.add_argument(
+        "--scan-workers", default=None, type=int,
+        help="number of worker processes examining files concurrently "
+             "during repository scans (default: number of CPUs, up to 8)")
+
+    group = parser.add_argument_group("worker pool")
+    group.add_argument(
+        "--worker-pool-size", default=0, type=int,
+        help="number of worker processes to spawn in advance "
+             "(default: %(default)s, spawn on demand)")
+    group.add_argument(
+        "--worker-max-runs", default=1, type=int,
+        help="number of runs a pooled worker process may serve before "
+             "being terminated (default: %(default)s)")
+    group.add_argument(
+        "--worker-max-rss", default=None, type=float,
+        help="do not reuse pooled worker processes whose resident set "
+             "size exceeds this value in MiB (default: no limit)")
 
     log_args(parser)
 
@@ -101,13 +148,33 @@ def main():
     worker_handlers = dict()
 
     if args.git:
-        repo_backend = GitBackend(args.repository)
+        if args.git_cache_max_size is None:
+            git_cache_max_bytes = None
+        else:
+            git_cache_max_bytes = int(args.git_cache_max_size*1024*1024)
+        repo_backend = GitBackend(args.repository,
+                                  cache_size=args.git_cache_size,
+                                  cache_max_bytes=git_cache_max_bytes)
     else:
         repo_backend = FilesystemBackend(args.repository)
-    experiment_db = ExperimentDB(repo_backend, worker_handlers)
+    experiment_db = ExperimentDB(repo_backend, worker_handlers,
+                                 scan_cache=args.scan_cache,
+                                 scan_workers=args.scan_workers)
     atexit.register(experiment_db.close)
 
-    scheduler = Scheduler(RIDCounter(), worker_handlers, experiment_db)
+    if args.worker_max_rss is None:
+        worker_max_rss = None
+    else:
+        worker_max_rss = int(args.worker_max_rss*1024*1024)
+    worker_pool = WorkerPool(worker_handlers,
+                             size=args.worker_pool_size,
+                             max_runs=args.worker_max_runs,
+                             max_rss=worker_max_rss)
+    scheduler = Scheduler(RIDCounter(), worker_handlers, experiment_db,
+                          worker_pool,
+                          dataset_flush_interval=args.dataset_flush_interval,
+                          dataset_flush_size=args.dataset_flush_size,
+                          results_compression=args.results_compression)
     scheduler.start()
     atexit_register_coroutine(scheduler.stop)
 
@@ -140,10 +207,12 @@ def main():
 
     server_notify = Publisher({
         "schedule": scheduler.notifier,
+        "schedule_stats": scheduler.stats,
         "devices": device_db.data,
         "datasets": dataset_db.data,
         "explist": experiment_db.explist,
-        "explist_status": experiment_db.status
+        "explist_status": experiment_db.status,
+        "worker_pool": worker_pool.stats
     })
     loop.run_until_complete(server_notify.start(
         bind, args.port_notify))
@@ -26,8 +26,7 @@ def main():
             lambda channel, override, value: None)
         loop.run_until_complete(comm.connect(args.core_addr))
         try:
-            for channel in args.channel:
-                comm.monitor_probe(True, channel, 0)
+            comm.monitor_probes(True, [(channel, 0) for channel in args.channel])
             loop.run_forever()
         finally:
             loop.run_until_complete(comm.close())
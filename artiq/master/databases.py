@@ -1,11 +1,18 @@
 import asyncio
+import hashlib
+import logging
+import os
 import tokenize
+from concurrent.futures import ThreadPoolExecutor
 
 from sipyco.sync_struct import Notifier, process_mod, update_from_dict
 from sipyco import pyon
 from sipyco.asyncio_tools import TaskObject
 
 
+logger = logging.getLogger(__name__)
+
+
 def device_db_from_file(filename):
     glbs = dict()
     with tokenize.open(filename) as f:
@@ -34,33 +41,163 @@ class DeviceDB:
 
 
 class DatasetDB(TaskObject):
+    """Dataset database, whose persistent datasets are kept in
+    ``persist_file``.
+
+    The file holds a PYON snapshot of the persistent datasets. Their
+    modifications are appended to a journal next to it (``persist_file``
+    followed by ``.journal``), which is replayed when the database is
+    loaded. Every ``autosave_period`` seconds, the modifications made since
+    are written to the journal by a background thread, which also compacts
+    the journal into a new snapshot once it grows larger than the snapshot.
+    :meth:`save` writes the journal and a new snapshot, so that the file
+    alone holds the persistent datasets afterwards."""
+    # minimum size of the journal for compaction, in bytes
+    compact_min_size = 1 << 20
+
     def __init__(self, persist_file, autosave_period=30):
         self.persist_file = persist_file
+        self.journal_file = persist_file + ".journal"
         self.autosave_period = autosave_period
 
+        # State of the files, used by the journal thread.
+        self._snapshot_hash = None
+        self._snapshot_size = 0
+        self._journal_size = None
+        # Journal lines not written yet
+        self._journal_lines = []
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        file_data = self._read_files()
+        self.data = Notifier({k: (True, v) for k, v in file_data.items()})
+
+    def _read_files(self):
         try:
-            file_data = pyon.load_file(self.persist_file)
+            with open(self.persist_file, "rb") as f:
+                snapshot = f.read()
         except FileNotFoundError:
-            file_data = dict()
-        self.data = Notifier({k: (True, v) for k, v in file_data.items()})
+            snapshot = None
+            data = dict()
+        else:
+            data = pyon.decode(snapshot.decode())
+        self._snapshot_hash = _journal_header(snapshot)
+        self._snapshot_size = 0 if snapshot is None else len(snapshot)
+
+        self._journal_size = None
+        try:
+            f = open(self.journal_file, "rb")
+        except FileNotFoundError:
+            return data
+        with f:
+            header = f.readline()
+            if header != self._snapshot_hash:
+                # The journal was compacted into the snapshot, or the
+                # snapshot was replaced.
+                logger.warning("ignoring dataset journal '%s' that does not "
+                               "match '%s'", self.journal_file,
+                               self.persist_file)
+                return data
+            size = len(header)
+            datasets = {k: (True, v) for k, v in data.items()}
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    process_mod(datasets, pyon.decode(line.decode()))
+                except:
+                    # Incomplete write of the last modification.
+                    logger.warning("truncating dataset journal '%s' at "
+                                   "byte %d", self.journal_file, size,
+                                   exc_info=True)
+                    break
+                size += len(line)
+        self._journal_size = size
+        return {k: v[1] for k, v in datasets.items()}
+
+    # The methods below run in the journal thread.
+
+    def _write_journal(self, lines):
+        if not lines:
+            return
+        if self._journal_size is None:
+            mode = "wb"
+            lines.insert(0, self._snapshot_hash)
+            self._journal_size = 0
+        else:
+            mode = "r+b"
+        with open(self.journal_file, mode) as f:
+            # discard what follows the last complete line
+            f.seek(self._journal_size)
+            f.truncate()
+            for line in lines:
+                f.write(line)
+                self._journal_size += len(line)
+        if self._journal_size > max(self._snapshot_size,
+                                    self.compact_min_size):
+            self._compact()
+
+    def _compact(self):
+        data = self._read_files()
+        snapshot = pyon.encode(data, True).encode()
+        _atomic_write(self.persist_file, snapshot)
+        self._snapshot_hash = _journal_header(snapshot)
+        self._snapshot_size = len(snapshot)
+        _atomic_write(self.journal_file, self._snapshot_hash)
+        self._journal_size = len(self._snapshot_hash)
+
+    def _save(self, lines):
+        self._write_journal(lines)
+        if self._journal_size is None:
+            # nothing was ever journaled
+            if not os.path.exists(self.persist_file):
+                self._compact()
+        elif self._journal_size > len(self._snapshot_hash):
+            self._compact()
+
+    #
+
+    def _take_journal_lines(self):
+        lines = self._journal_lines
+        self._journal_lines = []
+        return lines
 
     def save(self):
-        data = {k: v[1] for k, v in self.data.raw_view.items() if v[0]}
-        pyon.store_file(self.persist_file, data)
+        """Writes a snapshot of the persistent datasets. Blocks until it is
+        written."""
+        self._executor.submit(self._save, self._take_journal_lines()).result()
 
     async def _do(self):
+        loop = asyncio.get_event_loop()
         try:
             while True:
                 await asyncio.sleep(self.autosave_period)
-                self.save()
+                await loop.run_in_executor(self._executor,
+                    self._write_journal, self._take_journal_lines())
         finally:
             self.save()
 
     def get(self, key):
         return self.data.raw_view[key][1]
 
+    def _journal(self, mod, was_persistent):
+        if mod["path"]:
+            if not was_persistent:
+                return
+        elif mod["action"] == "setitem":
+            if not mod["value"][0]:
+                if not was_persistent:
+                    return
+                mod = {"action": "delitem", "path": [], "key": mod["key"]}
+        elif not was_persistent:
+            return
+        self._journal_lines.append((pyon.encode(mod) + "\n").encode())
+
     def update(self, mod):
+        key = mod["path"][0] if mod["path"] else mod["key"]
+        entry = self.data.raw_view.get(key)
+        was_persistent = entry is not None and entry[0]
         process_mod(self.data, mod)
+        self._journal(mod, was_persistent)
 
     # convenience functions (update() can be used instead)
     def set(self, key, value, persist=None):
@@ -69,8 +206,25 @@ class DatasetDB(TaskObject):
                 persist = self.data.raw_view[key][0]
             else:
                 persist = False
-        self.data[key] = (persist, value)
+        self.update({"action": "setitem", "path": [], "key": key,
+                     "value": (persist, value)})
 
     def delete(self, key):
-        del self.data[key]
+        self.update({"action": "delitem", "path": [], "key": key})
     #
+
+
+def _journal_header(snapshot):
+    # identifies the snapshot to which a journal applies
+    if snapshot is None:
+        digest = "none"
+    else:
+        digest = hashlib.sha256(snapshot).hexdigest()
+    return "# snapshot {}\n".format(digest).encode()
+
+
+def _atomic_write(filename, data):
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, filename)
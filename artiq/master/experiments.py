@@ -1,11 +1,19 @@
 import asyncio
+import collections
+import hashlib
 import os
+import stat
 import tempfile
 import shutil
+import threading
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from sipyco.sync_struct import Notifier, update_from_dict
+from sipyco import pyon
+
+from artiq import __version__ as artiq_version
 
 from artiq.master.worker import (Worker, WorkerInternalException,
                                  log_worker_exception)
@@ -15,19 +23,173 @@ from artiq.tools import get_windows_drives, exc_to_warning
 logger = logging.getLogger(__name__)
 
 
+class _ScanCache:
+    """Results of previous repository scans.
+
+    Entries are keyed by the path of the file relative to the repository
+    root and are valid while the content of the file and of the modules it
+    imported are unchanged. Modules within the repository are compared by
+    content hash, and modules outside of it by modification time and size.
+    If ``filename`` is given, the cache is loaded from and saved to that
+    file."""
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = dict()
+        self.used = set()
+        self.modified = False
+        if filename is not None:
+            try:
+                data = pyon.load_file(filename)
+            except FileNotFoundError:
+                pass
+            except:
+                logger.warning("failed to load repository scan cache from "
+                               "'%s'", filename, exc_info=True)
+            else:
+                if data.get("artiq_version") == artiq_version:
+                    self.entries = data["entries"]
+
+    @staticmethod
+    def _file_hash(path):
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _signature(self, root, name):
+        if os.path.isabs(name):
+            st = os.stat(name)
+            return [st.st_mtime_ns, st.st_size]
+        return self._file_hash(os.path.join(root, name))
+
+    def _dependency_name(self, root, path):
+        relpath = os.path.relpath(path, root)
+        if relpath == os.pardir or relpath.startswith(os.pardir + os.sep):
+            return os.path.abspath(path)
+        return relpath
+
+    def get(self, root, filename):
+        """Returns the cached description of ``filename`` or ``None``."""
+        try:
+            entry = self.entries[filename]
+            if entry["hash"] != self._file_hash(os.path.join(root, filename)):
+                return None
+            for name, signature in entry["dependencies"].items():
+                if self._signature(root, name) != signature:
+                    return None
+        except (KeyError, OSError):
+            return None
+        self.used.add(filename)
+        return entry["description"]
+
+    def put(self, root, filename, description, dependencies):
+        try:
+            entry = {
+                "hash": self._file_hash(os.path.join(root, filename)),
+                "dependencies": dict(),
+                "description": description
+            }
+            for path in dependencies:
+                name = self._dependency_name(root, path)
+                entry["dependencies"][name] = self._signature(root, name)
+        except OSError:
+            return
+        self.entries[filename] = entry
+        self.used.add(filename)
+        self.modified = True
+
+    def commit(self):
+        """Drops the entries that were not used since the last call and
+        saves the cache if it changed."""
+        for filename in set(self.entries.keys()) - self.used:
+            del self.entries[filename]
+            self.modified = True
+        self.used = set()
+        if self.filename is not None and self.modified:
+            try:
+                pyon.store_file(self.filename, {
+                    "artiq_version": artiq_version,
+                    "entries": self.entries
+                })
+            except:
+                logger.warning("failed to save repository scan cache to "
+                               "'%s'", self.filename, exc_info=True)
+        self.modified = False
+
+
 class _RepoScanner:
-    def __init__(self, worker_handlers):
+    def __init__(self, worker_handlers, cache=None, max_workers=None):
         self.worker_handlers = worker_handlers
-        self.worker = None
+        if cache is None:
+            cache = _ScanCache()
+        self.cache = cache
+        if max_workers is None:
+            max_workers = min(os.cpu_count() or 1, 8)
+        self.max_workers = max(max_workers, 1)
+        self.files = 0
+        self.cache_hits = 0
+
+    def _walk(self, root, subdir=""):
+        r = []
+        for de in os.scandir(os.path.join(root, subdir)):
+            if de.name.startswith("."):
+                continue
+            if de.is_file() and de.name.endswith(".py"):
+                r.append(os.path.join(subdir, de.name))
+            if de.is_dir():
+                r += self._walk(root, os.path.join(subdir, de.name))
+        return r
 
-    async def process_file(self, entry_dict, root, filename):
-        logger.debug("processing file %s %s", root, filename)
+    def _make_handlers(self, uses_databases):
+        # Descriptions that depend on the contents of the device or dataset
+        # databases are not cached.
+        handlers = dict(self.worker_handlers)
+        for action in "get_device_db", "get_dataset":
+            if action in handlers:
+                def wrapper(*args, _func=handlers[action], **kwargs):
+                    uses_databases[0] = True
+                    return _func(*args, **kwargs)
+                handlers[action] = wrapper
+        return handlers
+
+    async def _examine_files(self, root, pending, descriptions):
+        uses_databases = [False]
+        handlers = self._make_handlers(uses_databases)
+        worker = Worker(handlers)
         try:
-            description = await self.worker.examine(
-                "scan", os.path.join(root, filename))
-        except:
-            log_worker_exception()
-            raise
+            while pending:
+                filename = pending.popleft()
+                logger.debug("processing file %s %s", root, filename)
+                uses_databases[0] = False
+                dependencies = []
+                try:
+                    try:
+                        description = await worker.examine(
+                            "scan", os.path.join(root, filename),
+                            dependencies=dependencies)
+                    except:
+                        log_worker_exception()
+                        raise
+                except Exception as exc:
+                    logger.warning("Skipping file '%s'", filename,
+                        exc_info=not isinstance(exc, WorkerInternalException))
+                    # restart worker
+                    await worker.close()
+                    worker = Worker(handlers)
+                    continue
+                descriptions[filename] = description
+                if not uses_databases[0]:
+                    self.cache.put(root, filename, description, dependencies)
+        finally:
+            await worker.close()
+
+    def process_file(self, entry_dict, names, filename, description):
+        # ``names`` holds the experiment names already used in the
+        # directory of ``filename``.
+        prefix = os.path.dirname(filename).replace(os.sep, "/")
+        if prefix:
+            prefix += "/"
         for class_name, class_desc in description.items():
             name = class_desc["name"]
             arginfo = class_desc["arginfo"]
@@ -35,10 +197,10 @@ class _RepoScanner:
                 logger.warning("Character '/' is not allowed in experiment "
                                "name (%s)", name)
                 name = name.replace("/", "_")
-            if name in entry_dict:
+            if name in names:
                 basename = name
                 i = 1
-                while name in entry_dict:
+                while name in names:
                     name = basename + str(i)
                     i += 1
                 logger.warning("Duplicate experiment name: '%s'\n"
@@ -50,43 +212,44 @@ class _RepoScanner:
                 "arginfo": arginfo,
                 "scheduler_defaults": class_desc["scheduler_defaults"]
             }
-            entry_dict[name] = entry
+            names.add(name)
+            entry_dict[prefix + name] = entry
+
+    async def scan(self, root):
+        filenames = self._walk(root)
+        descriptions = dict()
+        pending = collections.deque()
+        for filename in filenames:
+            description = self.cache.get(root, filename)
+            if description is None:
+                pending.append(filename)
+            else:
+                descriptions[filename] = description
+        self.files = len(filenames)
+        self.cache_hits = len(filenames) - len(pending)
+
+        workers = min(self.max_workers, len(pending))
+        await asyncio.gather(*[self._examine_files(root, pending, descriptions)
+                               for _ in range(workers)])
+        self.cache.commit()
 
-    async def _scan(self, root, subdir=""):
         entry_dict = dict()
-        for de in os.scandir(os.path.join(root, subdir)):
-            if de.name.startswith("."):
-                continue
-            if de.is_file() and de.name.endswith(".py"):
-                filename = os.path.join(subdir, de.name)
-                try:
-                    await self.process_file(entry_dict, root, filename)
-                except Exception as exc:
-                    logger.warning("Skipping file '%s'", filename,
-                        exc_info=not isinstance(exc, WorkerInternalException))
-                    # restart worker
-                    await self.worker.close()
-                    self.worker = Worker(self.worker_handlers)
-            if de.is_dir():
-                subentries = await self._scan(
-                    root, os.path.join(subdir, de.name))
-                entries = {de.name + "/" + k: v for k, v in subentries.items()}
-                entry_dict.update(entries)
+        dir_names = collections.defaultdict(set)
+        for filename in filenames:
+            if filename in descriptions:
+                self.process_file(entry_dict,
+                                  dir_names[os.path.dirname(filename)],
+                                  filename, descriptions[filename])
         return entry_dict
 
-    async def scan(self, root):
-        self.worker = Worker(self.worker_handlers)
-        try:
-            r = await self._scan(root)
-        finally:
-            await self.worker.close()
-        return r
-
 
 class ExperimentDB:
-    def __init__(self, repo_backend, worker_handlers):
+    def __init__(self, repo_backend, worker_handlers, scan_cache=None,
+                 scan_workers=None):
         self.repo_backend = repo_backend
         self.worker_handlers = worker_handlers
+        self.scan_cache = _ScanCache(scan_cache)
+        self.scan_workers = scan_workers
 
         self.cur_rev = self.repo_backend.get_head_rev()
         self.repo_backend.request_rev(self.cur_rev)
@@ -95,12 +258,14 @@ class ExperimentDB:
 
         self.status = Notifier({
             "scanning": False,
-            "cur_rev": self.cur_rev
+            "cur_rev": self.cur_rev,
+            "last_scan": None
         })
 
     def close(self):
         # The object cannot be used anymore after calling this method.
         self.repo_backend.release_rev(self.cur_rev)
+        self.repo_backend.close()
 
     async def scan_repository(self, new_cur_rev=None):
         if self._scanning:
@@ -110,14 +275,30 @@ class ExperimentDB:
         try:
             if new_cur_rev is None:
                 new_cur_rev = self.repo_backend.get_head_rev()
-            wd, _ = self.repo_backend.request_rev(new_cur_rev)
+            try:
+                wd, _ = await self.repo_backend.request_rev_async(new_cur_rev)
+            except:
+                self.repo_backend.release_rev(new_cur_rev)
+                raise
             self.repo_backend.release_rev(self.cur_rev)
             self.cur_rev = new_cur_rev
             self.status["cur_rev"] = new_cur_rev
             t1 = time.monotonic()
-            new_explist = await _RepoScanner(self.worker_handlers).scan(wd)
-            logger.info("repository scan took %d seconds", time.monotonic()-t1)
+            scanner = _RepoScanner(self.worker_handlers, self.scan_cache,
+                                   self.scan_workers)
+            new_explist = await scanner.scan(wd)
+            scan_time = time.monotonic() - t1
+            logger.info("repository scan took %d seconds (%d files, "
+                        "%d cached)", scan_time, scanner.files,
+                        scanner.cache_hits)
             update_from_dict(self.explist, new_explist)
+            self.status["last_scan"] = {
+                "time": scan_time,
+                "files": scanner.files,
+                "cache_hits": scanner.cache_hits,
+                "hit_ratio": (scanner.cache_hits/scanner.files
+                              if scanner.files else None)
+            }
         finally:
             self._scanning = False
             self.status["scanning"] = False
@@ -130,15 +311,19 @@ class ExperimentDB:
         if use_repository:
             if revision is None:
                 revision = self.cur_rev
-            wd, _ = self.repo_backend.request_rev(revision)
-            filename = os.path.join(wd, filename)
-        worker = Worker(self.worker_handlers)
+            checkout = self.repo_backend.request_rev_async(revision)
         try:
-            description = await worker.examine("examine", filename)
+            if use_repository:
+                wd, _ = await checkout
+                filename = os.path.join(wd, filename)
+            worker = Worker(self.worker_handlers)
+            try:
+                description = await worker.examine("examine", filename)
+            finally:
+                await worker.close()
         finally:
-            await worker.close()
-        if use_repository:
-            self.repo_backend.release_rev(revision)
+            if use_repository:
+                self.repo_backend.release_rev(revision)
         return description
 
     def list_directory(self, directory):
@@ -169,47 +354,213 @@ class FilesystemBackend:
     def request_rev(self, rev):
         return self.root, None
 
+    async def request_rev_async(self, rev):
+        return self.request_rev(rev)
+
     def release_rev(self, rev):
         pass
 
+    def close(self):
+        pass
+
 
-class _GitCheckout:
-    def __init__(self, git, rev):
-        self.path = tempfile.mkdtemp()
-        commit = git.get(rev)
-        git.checkout_tree(commit, directory=self.path)
-        self.message = commit.message.strip()
-        self.ref_count = 1
-        logger.info("checked out revision %s into %s", rev, self.path)
+def _remove_tree(path):
+    def onerror(func, path, exc_info):
+        # Files of checkouts are read-only, which prevents their removal
+        # on Windows.
+        os.chmod(path, stat.S_IWRITE)
+        func(path)
+    shutil.rmtree(path, onerror=onerror)
 
-    def dispose(self):
-        logger.info("disposing of checkout in folder %s", self.path)
-        shutil.rmtree(self.path)
+
+class _GitCheckout:
+    def __init__(self, rev):
+        self.rev = rev
+        self.path = None
+        self.message = None
+        self.ref_count = 0
+        # paths in the object store of the blobs used by the checkout
+        self.objects = set()
+        # concurrent.futures.Future of (path, message)
+        self.future = None
 
 
 class GitBackend:
-    def __init__(self, root):
+    """Serves the revisions of a Git repository.
+
+    Revisions are checked out by a background thread into a cache directory
+    created within ``cache_dir`` (by default, the system temporary
+    directory). The files of a checkout are hard links to a store of blobs
+    shared by all checkouts, so that files unchanged between revisions are
+    only written once.
+
+    Checkouts that are no longer used are kept for future requests. The
+    least recently used ones are deleted when there are more than
+    ``cache_size`` of them, or when the blob store exceeds
+    ``cache_max_bytes``."""
+    def __init__(self, root, cache_dir=None, cache_size=8,
+                 cache_max_bytes=None):
         # lazy import - make dependency optional
         import pygit2
 
         self.git = pygit2.Repository(root)
+        self.cache_size = cache_size
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_dir = tempfile.mkdtemp(prefix="artiq_git_", dir=cache_dir)
         self.checkouts = dict()
+        self.unused = collections.OrderedDict()  # least recently used first
+        self.size = 0  # of the blob store, in bytes
+
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._thread_git = None
 
     def get_head_rev(self):
         return str(self.git.head.target)
 
+    def _request(self, rev):
+        with self._lock:
+            co = self.checkouts.get(rev)
+            if co is None:
+                if self.git.get(rev) is None:
+                    raise ValueError("Unknown revision '{}'".format(rev))
+                co = _GitCheckout(rev)
+                co.future = self._executor.submit(self._checkout, co)
+                self.checkouts[rev] = co
+            co.ref_count += 1
+            self.unused.pop(rev, None)
+        return co.future
+
     def request_rev(self, rev):
-        if rev in self.checkouts:
+        future = self._request(rev)
+        try:
+            return future.result()
+        except:
+            self.release_rev(rev)
+            raise
+
+    def request_rev_async(self, rev):
+        """Returns an awaitable of the result of :meth:`request_rev`.
+
+        The revision is requested, and needs to be released, even if the
+        awaitable fails."""
+        # Cancelling the awaitable must not cancel the checkout, which may
+        # be shared with other requests.
+        return asyncio.shield(asyncio.wrap_future(self._request(rev)))
+
+    def release_rev(self, rev):
+        with self._lock:
             co = self.checkouts[rev]
-            co.ref_count += 1
-        else:
-            co = _GitCheckout(self.git, rev)
-            self.checkouts[rev] = co
+            co.ref_count -= 1
+            if co.ref_count:
+                return
+            if co.future.done() and co.future.exception() is not None:
+                del self.checkouts[rev]
+                return
+            self.unused[rev] = co
+        self._executor.submit(self._evict)
+
+    def close(self):
+        self._executor.shutdown()
+        _remove_tree(self.cache_dir)
+
+    # The methods below are run by the checkout thread.
+
+    def _store_blob(self, git, oid, executable, objects):
+        name = str(oid) + ("x" if executable else "")
+        path = os.path.join(self.cache_dir, "objects", name[:2], name[2:])
+        if not os.path.exists(path):
+            data = git[oid].data
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.chmod(path + ".tmp", 0o555 if executable else 0o444)
+            os.replace(path + ".tmp", path)
+            with self._lock:
+                self.size += len(data)
+        objects.add(path)
+        return path
+
+    def _write_tree(self, git, tree, directory, objects):
+        import pygit2
+
+        for entry in tree:
+            path = os.path.join(directory, entry.name)
+            if entry.filemode == pygit2.GIT_FILEMODE_TREE:
+                os.mkdir(path)
+                self._write_tree(git, git[entry.id], path, objects)
+            elif entry.filemode == pygit2.GIT_FILEMODE_LINK:
+                target = git[entry.id].data
+                try:
+                    os.symlink(target.decode(), path)
+                except OSError:
+                    # same as Git without symbolic link support
+                    with open(path, "wb") as f:
+                        f.write(target)
+            elif entry.filemode in (pygit2.GIT_FILEMODE_BLOB,
+                                    pygit2.GIT_FILEMODE_BLOB_EXECUTABLE):
+                blob = self._store_blob(
+                    git, entry.id,
+                    entry.filemode == pygit2.GIT_FILEMODE_BLOB_EXECUTABLE,
+                    objects)
+                try:
+                    os.link(blob, path)
+                except OSError:
+                    shutil.copy2(blob, path)
+            # submodules are not checked out
+
+    def _checkout(self, co):
+        import pygit2
+
+        # pygit2 objects are not shared between threads
+        if self._thread_git is None:
+            self._thread_git = pygit2.Repository(self.git.path)
+        git = self._thread_git
+        commit = git.get(co.rev)
+        path = tempfile.mkdtemp(dir=self.cache_dir, prefix="checkout_")
+        try:
+            self._write_tree(git, commit.tree, path, co.objects)
+        except:
+            self._dispose(co, path)
+            with self._lock:
+                if not co.ref_count:
+                    del self.checkouts[co.rev]
+                    self.unused.pop(co.rev, None)
+            raise
+        co.path = path
+        co.message = commit.message.strip()
+        logger.info("checked out revision %s into %s", co.rev, path)
+        self._evict()
         return co.path, co.message
 
-    def release_rev(self, rev):
-        co = self.checkouts[rev]
-        co.ref_count -= 1
-        if not co.ref_count:
-            co.dispose()
-            del self.checkouts[rev]
+    def _dispose(self, co, path):
+        logger.info("disposing of checkout in folder %s", path)
+        _remove_tree(path)
+        freed = 0
+        for blob in co.objects:
+            st = os.stat(blob)
+            if st.st_nlink == 1:
+                os.chmod(blob, stat.S_IWRITE)
+                os.unlink(blob)
+                freed += st.st_size
+        co.objects.clear()
+        with self._lock:
+            self.size -= freed
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if (len(self.unused) <= self.cache_size
+                        and (self.cache_max_bytes is None
+                             or self.size <= self.cache_max_bytes)):
+                    return
+                # Checkouts released before they are written are skipped
+                # here, and evicted at the end of their own _checkout.
+                for rev, co in self.unused.items():
+                    if co.path is not None:
+                        break
+                else:
+                    return
+                del self.unused[rev]
+                del self.checkouts[rev]
+            self._dispose(co, co.path)
@@ -1,12 +1,15 @@
 import asyncio
+import bisect
 import logging
+import heapq
 from enum import Enum
+from itertools import count
 from time import time
 
 from sipyco.sync_struct import Notifier
 from sipyco.asyncio_tools import TaskObject, Condition
 
-from artiq.master.worker import Worker, log_worker_exception
+from artiq.master.worker import Worker, WorkerPool, log_worker_exception
 from artiq.tools import asyncio_wait_or_cancel
 
 
@@ -45,23 +48,152 @@ def _mk_worker_method(name):
     return worker_method
 
 
+class _RunQueue:
+    """Priority queue of runs supporting removal of arbitrary runs.
+
+    The run with the smallest ``key`` is at the head of the queue. Removed
+    runs are discarded lazily when they reach the head, and the heap is
+    rebuilt when it accumulates too many of them."""
+    def __init__(self, key):
+        self._key = key
+        self._heap = []
+        self._entries = dict()  # rid -> sequence number of the valid entry
+        self._counter = count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, run):
+        return run.rid in self._entries
+
+    def add(self, run):
+        seq = next(self._counter)
+        self._entries[run.rid] = seq
+        heapq.heappush(self._heap, (self._key(run), seq, run))
+
+    def discard(self, run):
+        if self._entries.pop(run.rid, None) is not None:
+            if len(self._heap) > 2*len(self._entries) + 16:
+                self._heap = [e for e in self._heap
+                              if self._entries.get(e[2].rid) == e[1]]
+                heapq.heapify(self._heap)
+
+    def peek(self):
+        heap = self._heap
+        while heap and self._entries.get(heap[0][2].rid) != heap[0][1]:
+            heapq.heappop(heap)
+        if heap:
+            return heap[0][2]
+        else:
+            return None
+
+    def pop(self):
+        run = self.peek()
+        if run is not None:
+            heapq.heappop(self._heap)
+            del self._entries[run.rid]
+        return run
+
+
+class _Histogram:
+    """Distribution of durations, in seconds."""
+    # Upper bounds of the bins. The last bin is not bounded.
+    edges = [1e-3*2**i for i in range(20)]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.bins = [0]*(len(self.edges) + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.bins[bisect.bisect_left(self.edges, value)] += 1
+
+    def describe(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total/self.count,
+            "min": self.min,
+            "max": self.max,
+            "bins": list(self.bins)
+        }
+
+
+class _PipelineStats:
+    """Histograms of the durations of the stages of the runs of a
+    pipeline, published in ``notifier[name]``."""
+    # metric recorded when a run leaves each status
+    status_metrics = {
+        "pending": "queue_wait",
+        "flushing": "flush_wait",
+        "preparing": "prepare",
+        "prepare_done": "prepare_done_wait",
+        "running": "run",
+        "paused": "paused",
+        "run_done": "run_done_wait",
+        "analyzing": "analyze"
+    }
+
+    def __init__(self, notifier, name):
+        self.histograms = dict()
+        self._notifier = notifier
+        self._name = name
+        notifier[name] = dict()
+
+    def record(self, metric, value):
+        histogram = self.histograms.get(metric)
+        if histogram is None:
+            histogram = _Histogram()
+            self.histograms[metric] = histogram
+        histogram.add(value)
+        self._notifier[self._name][metric] = histogram.describe()
+
+
+def _queue_key(run):
+    # priority_key() is maximal for the run to be scheduled first
+    return tuple(-k for k in run.priority_key())
+
+
 class Run:
     def __init__(self, rid, pipeline_name,
-                 wd, expid, priority, due_date, flush,
+                 checkout, expid, priority, due_date, flush,
                  pool, **kwargs):
         # called through pool
+        # checkout is None or an awaitable of the working directory and
+        # revision message of the repository backend.
         self.rid = rid
         self.pipeline_name = pipeline_name
-        self.wd = wd
+        self.wd = None
+        if checkout is None:
+            self._checkout = None
+        else:
+            self._checkout = asyncio.ensure_future(checkout)
+            self._checkout.add_done_callback(self._checkout_done)
         self.expid = expid
         self.priority = priority
         self.due_date = due_date
         self.flush = flush
 
         self.worker = Worker(pool.worker_handlers)
+        self._worker_pool = pool.worker_pool
+        self._build_options = pool.build_options
         self.termination_requested = False
 
         self._status = RunStatus.pending
+        # (status, time) of each status transition
+        self.status_times = [(self._status.name, time())]
+        # time at which the run became ready to (re)enter running
+        self._ready_time = None
+        self._stats = pool.stats
+        self._run_stage = pool.run_stage_state
 
         notification = {
             "pipeline": self.pipeline_name,
@@ -75,6 +207,7 @@ class Run:
         self._notifier = pool.notifier
         self._notifier[self.rid] = notification
         self._state_changed = pool.state_changed
+        self._status_changed = pool.status_changed
 
     @property
     def status(self):
@@ -82,11 +215,54 @@ class Run:
 
     @status.setter
     def status(self, value):
+        old_status = self._status
         self._status = value
+        self._record_status_time(old_status, value)
+        self._status_changed(self, old_status)
         if not self.worker.closed.is_set():
             self._notifier[self.rid]["status"] = self._status.name
         self._state_changed.notify()
 
+    def _record_status_time(self, old_status, status):
+        now = time()
+        since = self.status_times[-1][1]
+        self.status_times.append((status.name, now))
+        run_stage = self._run_stage
+        if old_status == RunStatus.running:
+            run_stage["exit_time"] = now
+        if old_status == RunStatus.deleting:
+            # a deleted run leaving its stage; already accounted for
+            return
+        if (status == RunStatus.deleting
+                and old_status != RunStatus.analyzing):
+            # deleted before completion
+            return
+
+        if old_status == RunStatus.pending and self.due_date is not None:
+            # timed runs only wait from their due date
+            since = max(since, self.due_date)
+        self._stats.record(_PipelineStats.status_metrics[old_status.name],
+                           max(now - since, 0.0))
+        if status in (RunStatus.prepare_done, RunStatus.paused):
+            self._ready_time = now
+        elif (status == RunStatus.running
+                and run_stage["exit_time"] is not None):
+            # Time from the previous run leaving the run stage, or this run
+            # becoming ready if that happened later, to this run starting:
+            # the overhead of switching between runs, e.g. on pause/resume.
+            self._stats.record(
+                "switch", now - max(run_stage["exit_time"], self._ready_time))
+
+    def describe_schedule(self):
+        """Returns the timing information of the run written into its
+        results file."""
+        return {
+            "status": [status for status, _ in self.status_times],
+            "time": [t for _, t in self.status_times],
+            "spawn_time": self.worker.spawn_time,
+            "ipc_time": self.worker.ipc_time
+        }
+
     # The run with the largest priority_key is to be scheduled first
     def priority_key(self, now=None):
         if self.due_date is None:
@@ -99,35 +275,119 @@ class Run:
             runnable = 1
         return (runnable, self.priority, due_date_k, -self.rid)
 
+    def _checkout_done(self, checkout):
+        if (checkout.cancelled() or checkout.exception() is not None
+                or self.worker.closed.is_set()):
+            return
+        self._notifier[self.rid]["repo_msg"] = checkout.result()[1]
+
     async def close(self):
         # called through pool
-        await self.worker.close()
+        await self._worker_pool.release(self.worker)
         del self._notifier[self.rid]
 
     _build = _mk_worker_method("build")
 
     async def build(self):
+        if self._checkout is not None:
+            self.wd, _ = await self._checkout
+        if not self.worker.closed.is_set():
+            self._worker_pool.provide(self.worker)
         await self._build(self.rid, self.pipeline_name,
                           self.wd, self.expid,
-                          self.priority)
+                          self.priority,
+                          **self._build_options)
 
     prepare = _mk_worker_method("prepare")
     run = _mk_worker_method("run")
     resume = _mk_worker_method("resume")
     analyze = _mk_worker_method("analyze")
-    write_results = _mk_worker_method("write_results")
+    _write_results = _mk_worker_method("write_results")
+
+    async def write_results(self):
+        await self._write_results(schedule=self.describe_schedule())
 
 
 class RunPool:
-    def __init__(self, ridc, worker_handlers, notifier, experiment_db):
+    def __init__(self, ridc, worker_handlers, notifier, experiment_db,
+                 worker_pool, build_options, stats):
         self.runs = dict()
         self.state_changed = Condition()
 
         self.ridc = ridc
         self.worker_handlers = worker_handlers
+        self.worker_pool = worker_pool
+        # keyword arguments of Worker.build
+        self.build_options = build_options
+        self.stats = stats
+        # time at which the last run left the running status
+        self.run_stage_state = {"exit_time": None}
         self.notifier = notifier
         self.experiment_db = experiment_db
 
+        # Indexes of self.runs, maintained on status changes.
+        self._by_status = {status: dict() for status in RunStatus}
+        self._pending = _RunQueue(_queue_key)  # pending runs that are due
+        self._timed = _RunQueue(lambda r: r.due_date)  # not yet due
+        self._prepared = _RunQueue(_queue_key)
+        self._run_done = _RunQueue(_queue_key)
+        self._queues = {
+            RunStatus.prepare_done: self._prepared,
+            RunStatus.run_done: self._run_done
+        }
+
+    def _index_add(self, run):
+        status = run.status
+        self._by_status[status][run.rid] = run
+        if status == RunStatus.pending:
+            if run.due_date is None:
+                self._pending.add(run)
+            else:
+                self._timed.add(run)
+        elif status in self._queues:
+            self._queues[status].add(run)
+
+    def _index_remove(self, run, status):
+        self._by_status[status].pop(run.rid, None)
+        if status == RunStatus.pending:
+            self._pending.discard(run)
+            self._timed.discard(run)
+        elif status in self._queues:
+            self._queues[status].discard(run)
+
+    def status_changed(self, run, old_status):
+        # called through run
+        if self.runs.get(run.rid) is not run:
+            return
+        self._index_remove(run, old_status)
+        self._index_add(run)
+
+    def runs_with_status(self, status):
+        """Returns an iterable over the runs with the given status."""
+        return self._by_status[status].values()
+
+    def top_pending(self, now):
+        """Returns the highest-priority pending run that is due at ``now``,
+        and the due date of the earliest timed run that is not due yet (or
+        ``None``)."""
+        while True:
+            run = self._timed.peek()
+            if run is None or not now > run.due_date:
+                break
+            self._timed.pop()
+            self._pending.add(run)
+        if run is None:
+            next_due_date = None
+        else:
+            next_due_date = run.due_date
+        return self._pending.peek(), next_due_date
+
+    def top_prepared(self):
+        return self._prepared.peek()
+
+    def top_run_done(self):
+        return self._run_done.peek()
+
     def submit(self, expid, priority, due_date, flush, pipeline_name):
         # mutates expid to insert head repository revision if None.
         # called through scheduler.
@@ -135,13 +395,16 @@ class RunPool:
         if "repo_rev" in expid:
             if expid["repo_rev"] is None:
                 expid["repo_rev"] = self.experiment_db.cur_rev
-            wd, repo_msg = self.experiment_db.repo_backend.request_rev(
+            # The checkout proceeds in the background and is awaited by
+            # Run.build.
+            checkout = self.experiment_db.repo_backend.request_rev_async(
                 expid["repo_rev"])
         else:
-            wd, repo_msg = None, None
-        run = Run(rid, pipeline_name, wd, expid, priority, due_date, flush,
-                  self, repo_msg=repo_msg)
+            checkout = None
+        run = Run(rid, pipeline_name, checkout, expid, priority, due_date,
+                  flush, self, repo_msg=None)
         self.runs[rid] = run
+        self._index_add(run)
         self.state_changed.notify()
         return rid
 
@@ -154,6 +417,7 @@ class RunPool:
         if "repo_rev" in run.expid:
             self.experiment_db.repo_backend.release_rev(run.expid["repo_rev"])
         del self.runs[rid]
+        self._index_remove(run, run.status)
 
 
 class PrepareStage(TaskObject):
@@ -166,32 +430,28 @@ class PrepareStage(TaskObject):
         Otherwise, return a float representing the time before the next timed
         run becomes due, or None if there is no such run."""
         now = time()
-        pending_runs = filter(lambda r: r.status == RunStatus.pending,
-                              self.pool.runs.values())
-        try:
-            candidate = max(pending_runs, key=lambda r: r.priority_key(now))
-        except ValueError:
-            # pending_runs is an empty sequence
+        candidate, next_due_date = self.pool.top_pending(now)
+        if candidate is not None:
+            top_prepared_run = self.pool.top_prepared()
+            # prepare <candidate> (as well) only if it has higher priority
+            # than the highest priority prepared run
+            if (top_prepared_run is None or
+                    top_prepared_run.priority_key() < candidate.priority_key()):
+                return candidate
+
+        if next_due_date is None:
             return None
-
-        prepared_runs = filter(lambda r: r.status == RunStatus.prepare_done,
-                               self.pool.runs.values())
-        try:
-            top_prepared_run = max(prepared_runs,
-                                   key=lambda r: r.priority_key())
-        except ValueError:
-            # there are no existing prepared runs - go ahead with <candidate>
-            pass
-        else:
-            # prepare <candidate> (as well) only if it has higher priority than
-            # the highest priority prepared run
-            if top_prepared_run.priority_key() >= candidate.priority_key():
-                return None
-
-        if candidate.due_date is None or candidate.due_date < now:
-            return candidate
         else:
-            return candidate.due_date - now
+            return next_due_date - now
+
+    def _is_flushed(self, run):
+        for status in RunStatus:
+            if status in (RunStatus.pending, RunStatus.deleting):
+                continue
+            for r in self.pool.runs_with_status(status):
+                if r.priority >= run.priority and r is not run:
+                    return False
+        return True
 
     async def _do(self):
         while True:
@@ -204,11 +464,7 @@ class PrepareStage(TaskObject):
             else:
                 if run.flush:
                     run.status = RunStatus.flushing
-                    while not all(r.status in (RunStatus.pending,
-                                               RunStatus.deleting)
-                                  or r.priority < run.priority
-                                  or r is run
-                                  for r in self.pool.runs.values()):
+                    while not self._is_flushed(run):
                         ev = [self.pool.state_changed.wait(),
                               run.worker.closed.wait()]
                         await asyncio_wait_or_cancel(
@@ -236,14 +492,7 @@ class RunStage(TaskObject):
         self.delete_cb = delete_cb
 
     def _get_run(self):
-        prepared_runs = filter(lambda r: r.status == RunStatus.prepare_done,
-                               self.pool.runs.values())
-        try:
-            r = max(prepared_runs, key=lambda r: r.priority_key())
-        except ValueError:
-            # prepared_runs is an empty sequence
-            r = None
-        return r
+        return self.pool.top_prepared()
 
     async def _do(self):
         stack = []
@@ -290,14 +539,7 @@ class AnalyzeStage(TaskObject):
         self.delete_cb = delete_cb
 
     def _get_run(self):
-        run_runs = filter(lambda r: r.status == RunStatus.run_done,
-                          self.pool.runs.values())
-        try:
-            r = max(run_runs, key=lambda r: r.priority_key())
-        except ValueError:
-            # run_runs is an empty sequence
-            r = None
-        return r
+        return self.pool.top_run_done()
 
     async def _do(self):
         while True:
@@ -321,8 +563,10 @@ class AnalyzeStage(TaskObject):
 
 
 class Pipeline:
-    def __init__(self, ridc, deleter, worker_handlers, notifier, experiment_db):
-        self.pool = RunPool(ridc, worker_handlers, notifier, experiment_db)
+    def __init__(self, ridc, deleter, worker_handlers, notifier, experiment_db,
+                 worker_pool, build_options, stats):
+        self.pool = RunPool(ridc, worker_handlers, notifier, experiment_db,
+                            worker_pool, build_options, stats)
         self._prepare = PrepareStage(self.pool, deleter.delete)
         self._run = RunStage(self.pool, deleter.delete)
         self._analyze = AnalyzeStage(self.pool, deleter.delete)
@@ -379,8 +623,9 @@ class Deleter(TaskObject):
         for name in pipeline_names:
             if not self._pipelines[name].pool.runs:
                 logger.debug("garbage-collecting pipeline '%s'...", name)
-                await self._pipelines[name].stop()
-                del self._pipelines[name]
+                # remove it first, so that runs submitted while it stops
+                # go to a new pipeline
+                await self._pipelines.pop(name).stop()
                 logger.debug("garbage-collection of pipeline '%s' completed",
                              name)
 
@@ -393,18 +638,49 @@ class Deleter(TaskObject):
 
 
 class Scheduler:
-    def __init__(self, ridc, worker_handlers, experiment_db):
+    """Schedules and executes runs in their pipelines.
+
+    :param worker_pool: :class:`artiq.master.worker.WorkerPool` providing
+        the worker processes. By default, each run spawns its own process.
+    :param dataset_flush_interval: if not ``None``, workers accumulate
+        modifications of broadcast datasets and send them at most this
+        number of seconds late (see
+        :meth:`artiq.master.worker_db.DatasetManager.set_flush_policy`).
+    :param dataset_flush_size: if not ``None``, workers accumulate up to
+        this number of modifications of broadcast datasets before sending
+        them.
+    :param results_compression: HDF5 compression filter (e.g. ``"gzip"``)
+        applied to the arrays in the result files, or ``None``.
+    """
+    def __init__(self, ridc, worker_handlers, experiment_db,
+                 worker_pool=None, dataset_flush_interval=None,
+                 dataset_flush_size=None, results_compression=None):
         self.notifier = Notifier(dict())
+        # Durations of the stages of the runs, per pipeline
+        self.stats = Notifier({
+            "histogram_edges": _Histogram.edges,
+            "pipelines": dict()
+        })
+        self._pipeline_stats = dict()
 
         self._pipelines = dict()
         self._worker_handlers = worker_handlers
         self._experiment_db = experiment_db
         self._terminated = False
 
+        if worker_pool is None:
+            worker_pool = WorkerPool(worker_handlers)
+        self.worker_pool = worker_pool
+        self._build_options = {
+            "dataset_flush": (dataset_flush_interval, dataset_flush_size),
+            "results_compression": results_compression
+        }
+
         self._ridc = ridc
         self._deleter = Deleter(self._pipelines)
 
     def start(self):
+        self.worker_pool.start()
         self._deleter.start()
 
     async def stop(self):
@@ -415,6 +691,7 @@ class Scheduler:
                 self._deleter.delete(rid)
         await self._deleter.join()
         await self._deleter.stop()
+        await self.worker_pool.stop()
         if self._pipelines:
             logger.warning("some pipelines were not garbage-collected")
 
@@ -431,9 +708,14 @@ class Scheduler:
             pipeline = self._pipelines[pipeline_name]
         except KeyError:
             logger.debug("creating pipeline '%s'", pipeline_name)
+            stats = self._pipeline_stats.get(pipeline_name)
+            if stats is None:
+                stats = _PipelineStats(self.stats["pipelines"], pipeline_name)
+                self._pipeline_stats[pipeline_name] = stats
             pipeline = Pipeline(self._ridc, self._deleter,
                                 self._worker_handlers, self.notifier,
-                                self._experiment_db)
+                                self._experiment_db, self.worker_pool,
+                                self._build_options, stats)
             self._pipelines[pipeline_name] = pipeline
             pipeline.start()
         return pipeline.pool.submit(expid, priority, due_date, flush, pipeline_name)
@@ -480,12 +762,8 @@ class Scheduler:
                 if run.termination_requested:
                     return True
 
-                prepared_runs = filter(lambda r: r.status == RunStatus.prepare_done,
-                                       pipeline.pool.runs.values())
-                try:
-                    r = max(prepared_runs, key=lambda r: r.priority_key())
-                except ValueError:
-                    # prepared_runs is an empty sequence
+                r = pipeline.pool.top_prepared()
+                if r is None:
                     return False
                 return r.priority_key() > run.priority_key()
         raise KeyError("RID not found")
@@ -4,12 +4,16 @@ import asyncio
 import logging
 import subprocess
 import time
+from collections import deque
 
-from sipyco import pipe_ipc, pyon
+from sipyco import pipe_ipc
 from sipyco.logging_tools import LogParser
 from sipyco.packed_exceptions import current_exc_packed
+from sipyco.sync_struct import Notifier
+from sipyco.asyncio_tools import TaskObject
 
 from artiq.tools import asyncio_wait_or_cancel
+from artiq.master import worker_ipc
 
 
 logger = logging.getLogger(__name__)
@@ -42,14 +46,30 @@ def log_worker_exception():
 
 
 class Worker:
-    def __init__(self, handlers=dict(), send_timeout=10.0):
+    def __init__(self, handlers=dict(), send_timeout=10.0, binary_ipc=True):
         self.handlers = handlers
         self.send_timeout = send_timeout
+        # Use binary frames (see artiq.master.worker_ipc) in both directions
+        # instead of PYON lines.
+        self.binary_ipc = binary_ipc
 
         self.rid = None
         self.filename = None
         self.ipc = None
         self.watchdogs = dict()  # wid -> expiration (using time.monotonic)
+        # Number of runs built by the worker process, including those
+        # served before the process was handed over to this object.
+        self.run_count = 0
+        # Set when the worker process is idle after a complete run and can
+        # be reset for another one (see WorkerPool).
+        self.can_recycle = False
+        # The log parsers of the process look up their source through this
+        # cell, so that it follows the process when it changes owner.
+        self._log_owner = [self]
+        # Time taken to start the worker process (0 if it was provided by
+        # the pool), and spent sending messages to it, in seconds.
+        self.spawn_time = 0.0
+        self.ipc_time = 0.0
 
         self.io_lock = asyncio.Lock()
         self.closed = asyncio.Event()
@@ -83,23 +103,41 @@ class Worker:
         try:
             if self.closed.is_set():
                 raise WorkerError("Attempting to create process after close")
+            t0 = time.monotonic()
             self.ipc = pipe_ipc.AsyncioParentComm()
             env = os.environ.copy()
             env["PYTHONUNBUFFERED"] = "1"
             await self.ipc.create_subprocess(
                 sys.executable, "-m", "artiq.master.worker_impl",
                 self.ipc.get_address(), str(log_level),
+                "binary" if self.binary_ipc else "pyon",
                 stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                 env=env, start_new_session=True)
+            log_owner = self._log_owner
+            def get_log_source():
+                return log_owner[0]._get_log_source()
             asyncio.ensure_future(
-                LogParser(self._get_log_source).stream_task(
+                LogParser(get_log_source).stream_task(
                     self.ipc.process.stdout))
             asyncio.ensure_future(
-                LogParser(self._get_log_source).stream_task(
+                LogParser(get_log_source).stream_task(
                     self.ipc.process.stderr))
+            self.spawn_time = time.monotonic() - t0
         finally:
             self.io_lock.release()
 
+    def _take_process(self, other):
+        """Transfers the (idle) worker process of ``other`` to this object.
+
+        ``other`` is left without a process and should be closed."""
+        assert self.ipc is None
+        assert not other.io_lock.locked()
+        self.ipc, other.ipc = other.ipc, None
+        self.binary_ipc = other.binary_ipc
+        self.run_count = other.run_count
+        self._log_owner = other._log_owner
+        self._log_owner[0] = self
+
     async def close(self, term_timeout=2.0):
         """Interrupts any I/O with the worker process and terminates the
         worker process.
@@ -157,8 +195,18 @@ class Worker:
 
     async def _send(self, obj, cancellable=True):
         assert self.io_lock.locked()
-        line = pyon.encode(obj)
-        self.ipc.write((line + "\n").encode())
+        t0 = time.monotonic()
+        try:
+            await self._send_timed(obj, cancellable)
+        finally:
+            self.ipc_time += time.monotonic() - t0
+
+    async def _send_timed(self, obj, cancellable):
+        if self.binary_ipc:
+            for chunk in worker_ipc.encode_frame(obj):
+                self.ipc.write(chunk)
+        else:
+            self.ipc.write(worker_ipc.encode_line(obj))
         ifs = [self.ipc.drain()]
         if cancellable:
             ifs.append(self.closed.wait())
@@ -179,7 +227,8 @@ class Worker:
     async def _recv(self, timeout):
         assert self.io_lock.locked()
         fs = await asyncio_wait_or_cancel(
-            [self.ipc.readline(), self.closed.wait()],
+            [worker_ipc.read_object_async(self.ipc.read, self.ipc.readline),
+             self.closed.wait()],
             timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
         if all(f.cancelled() for f in fs):
             raise WorkerTimeout(
@@ -188,15 +237,14 @@ class Worker:
             raise WorkerError(
                 "Receiving data from worker cancelled (RID {})".format(
                     self.rid))
-        line = fs[0].result()
-        if not line:
+        try:
+            obj = fs[0].result()
+        except EOFError:
             raise WorkerError(
                 "Worker ended while attempting to receive data (RID {})".
                 format(self.rid))
-        try:
-            obj = pyon.decode(line.decode())
         except:
-            raise WorkerError("Worker sent invalid PYON data (RID {})".format(
+            raise WorkerError("Worker sent invalid data (RID {})".format(
                 self.rid))
         return obj
 
@@ -223,6 +271,10 @@ class Worker:
                 func = self.delete_watchdog
             elif action == "register_experiment":
                 func = self.register_experiment
+            elif action == "report_memory":
+                func = self.report_memory
+            elif action == "register_dependencies":
+                func = self.register_dependencies
             else:
                 func = self.handlers[action]
             try:
@@ -258,17 +310,21 @@ class Worker:
         return completed
 
     async def build(self, rid, pipeline_name, wd, expid, priority,
-                    timeout=15.0):
+                    timeout=15.0, dataset_flush=(None, None),
+                    results_compression=None):
         self.rid = rid
         self.filename = os.path.basename(expid["file"])
         await self._create_process(expid["log_level"])
+        self.run_count += 1
         await self._worker_action(
             {"action": "build",
              "rid": rid,
              "pipeline_name": pipeline_name,
              "wd": wd,
              "expid": expid,
-             "priority": priority},
+             "priority": priority,
+             "dataset_flush": dataset_flush,
+             "results_compression": results_compression},
             timeout)
 
     async def prepare(self):
@@ -293,11 +349,35 @@ class Worker:
     async def analyze(self):
         await self._worker_action({"action": "analyze"})
 
-    async def write_results(self, timeout=15.0):
-        await self._worker_action({"action": "write_results"},
+    async def write_results(self, timeout=15.0, schedule=None):
+        await self._worker_action({"action": "write_results",
+                                   "schedule": schedule},
                                   timeout)
+        self.can_recycle = True
+
+    async def reset(self, timeout=15.0):
+        """Brings the worker process back into the state it had just after
+        being spawned (no experiment loaded, devices closed).
 
-    async def examine(self, rid, file, timeout=20.0):
+        Returns the resident set size of the process in bytes, or ``None``
+        if the worker cannot determine it."""
+        await self._create_process(logging.WARNING)
+        rss = None
+
+        def report_memory(value):
+            nonlocal rss
+            rss = value
+        self.report_memory = report_memory
+        await self._worker_action({"action": "reset"}, timeout)
+        del self.report_memory
+        self.can_recycle = False
+        return rss
+
+    async def examine(self, rid, file, timeout=20.0, dependencies=None):
+        """Returns the experiments found in ``file``.
+
+        If ``dependencies`` is a list, the names of the files of the modules
+        imported by ``file`` are appended to it."""
         self.rid = rid
         self.filename = os.path.basename(file)
 
@@ -307,7 +387,169 @@ class Worker:
         def register(class_name, name, arginfo, scheduler_defaults):
             r[class_name] = {"name": name, "arginfo": arginfo, "scheduler_defaults": scheduler_defaults}
         self.register_experiment = register
-        await self._worker_action({"action": "examine", "file": file},
+        if dependencies is not None:
+            self.register_dependencies = dependencies.extend
+        await self._worker_action({"action": "examine", "file": file,
+                                   "dependencies": dependencies is not None},
                                   timeout)
         del self.register_experiment
+        if dependencies is not None:
+            del self.register_dependencies
         return r
+
+
+class WorkerPool(TaskObject):
+    """Keeps a number of worker processes spawned in advance, so that runs
+    do not have to wait for a new Python interpreter to start and import
+    the ARTIQ libraries before building their experiment.
+
+    :param size: number of idle worker processes to maintain. When zero,
+        every run spawns its own worker process on demand.
+    :param max_runs: number of runs a worker process may serve before it is
+        terminated. With the default of 1, processes are never reused.
+    :param max_rss: resident set size in bytes above which a worker process
+        is not reused, even if it has served fewer than ``max_runs`` runs.
+    """
+    def __init__(self, handlers=dict(), size=0, max_runs=1, max_rss=None,
+                 retry_period=5.0):
+        self.handlers = handlers
+        self.size = size
+        self.max_runs = max_runs
+        self.max_rss = max_rss
+        self.retry_period = retry_period
+
+        self._idle = deque()
+        self._spawning = set()
+        self._wake = asyncio.Event()
+        self._stopped = False
+
+        self.stats = Notifier({
+            "size": size,
+            "idle": 0,
+            "hits": 0,
+            "misses": 0,
+            "hit_rate": None,
+            "spawned": 0,
+            "spawn_time_last": None,
+            "spawn_time_mean": None,
+            "recycled": 0,
+            "retired": 0
+        })
+        self._spawn_time_total = 0.0
+
+    def _update_idle(self):
+        self.stats["idle"] = len(self._idle)
+
+    def _count_request(self, hit):
+        if hit:
+            self.stats["hits"] = self.stats.raw_view["hits"] + 1
+        else:
+            self.stats["misses"] = self.stats.raw_view["misses"] + 1
+        self.stats["hit_rate"] = (self.stats.raw_view["hits"] /
+            (self.stats.raw_view["hits"] + self.stats.raw_view["misses"]))
+
+    def provide(self, worker):
+        """Gives an idle worker process to ``worker``, if one is available.
+
+        Returns ``True`` if a pre-spawned process was attached. Otherwise,
+        ``worker`` will spawn its own process when it is first used."""
+        if not self.size or worker.ipc is not None:
+            return False
+        while self._idle:
+            idle = self._idle.popleft()
+            if idle.ipc.process.returncode is None:
+                worker._take_process(idle)
+                self._update_idle()
+                self._count_request(True)
+                self._wake.set()
+                return True
+            logger.debug("discarding dead worker from pool")
+            asyncio.ensure_future(idle.close())
+        self._update_idle()
+        self._count_request(False)
+        self._wake.set()
+        return False
+
+    async def release(self, worker):
+        """Closes ``worker``, returning its process to the pool if it can
+        serve another run."""
+        recycled = None
+        if (not self._stopped
+                and worker.can_recycle
+                and worker.run_count < self.max_runs
+                and len(self._idle) < self.size
+                and worker.ipc is not None
+                and worker.ipc.process.returncode is None):
+            recycled = Worker(self.handlers)
+            recycled._take_process(worker)
+        await worker.close()
+        if recycled is None:
+            return
+
+        try:
+            rss = await recycled.reset()
+        except:
+            logger.debug("failed to reset worker, terminating it",
+                         exc_info=True)
+            await recycled.close()
+            return
+        if (self.max_rss is not None and rss is not None
+                and rss > self.max_rss):
+            logger.debug("worker uses %d bytes, terminating it", rss)
+            self.stats["retired"] = self.stats.raw_view["retired"] + 1
+            await recycled.close()
+            return
+        if self._stopped:
+            await recycled.close()
+            return
+        recycled.rid = None
+        recycled.filename = None
+        self._idle.append(recycled)
+        self._update_idle()
+        self.stats["recycled"] = self.stats.raw_view["recycled"] + 1
+
+    async def _spawn(self):
+        worker = Worker(self.handlers)
+        self._spawning.add(worker)
+        try:
+            t0 = time.monotonic()
+            await worker.reset()
+            spawn_time = time.monotonic() - t0
+        except:
+            await worker.close()
+            raise
+        finally:
+            self._spawning.discard(worker)
+
+        self.stats["spawned"] = self.stats.raw_view["spawned"] + 1
+        self._spawn_time_total += spawn_time
+        self.stats["spawn_time_last"] = spawn_time
+        self.stats["spawn_time_mean"] = (self._spawn_time_total /
+                                         self.stats.raw_view["spawned"])
+        self._idle.append(worker)
+        self._update_idle()
+
+    async def _do(self):
+        while True:
+            while len(self._idle) + len(self._spawning) < self.size:
+                try:
+                    await self._spawn()
+                except asyncio.CancelledError:
+                    raise
+                except:
+                    logger.warning("failed to spawn pool worker, retrying "
+                                   "in %.1f seconds", self.retry_period,
+                                   exc_info=True)
+                    await asyncio.sleep(self.retry_period)
+            self._wake.clear()
+            await self._wake.wait()
+
+    async def stop(self):
+        self._stopped = True
+        await TaskObject.stop(self)
+        workers = list(self._idle) + list(self._spawning)
+        self._idle.clear()
+        self._spawning.clear()
+        self._update_idle()
+        for worker in workers:
+            await worker.close()
@@ -5,10 +5,16 @@ standalone command line tools).
 """
 
 from operator import setitem
+from collections import OrderedDict
+import copy
 import importlib
 import logging
+import threading
+import time
 
-from sipyco.sync_struct import Notifier
+import numpy
+
+from sipyco.sync_struct import Notifier, process_mod
 from sipyco.pc_rpc import AutoTarget, Client, BestEffortClient
 
 
@@ -19,6 +25,23 @@ class DummyDevice:
     pass
 
 
+class _LazyClient:
+    """Controller RPC client that connects when it is first used."""
+    def __init__(self, cls, *args):
+        self._cls = cls
+        self._args = args
+        self._client = None
+
+    def __getattr__(self, name):
+        if self._client is None:
+            self._client = self._cls(*self._args)
+        return getattr(self._client, name)
+
+    def close_rpc(self):
+        if self._client is not None:
+            self._client.close_rpc()
+
+
 def _create_device(desc, device_mgr):
     ty = desc["type"]
     if ty == "local":
@@ -35,14 +58,15 @@ def _create_device(desc, device_mgr):
         target_name = desc.get("target_name", None)
         if target_name is None:
             target_name = AutoTarget
-        return cls(desc["host"], desc["port"], target_name)
+        return _LazyClient(cls, desc["host"], desc["port"], target_name)
     elif ty == "controller_aux_target":
         controller = device_mgr.get_desc(desc["controller"])
         if desc.get("best_effort", controller.get("best_effort", False)):
             cls = BestEffortClient
         else:
             cls = Client
-        return cls(controller["host"], controller["port"], desc["target_name"])
+        return _LazyClient(cls, controller["host"], controller["port"],
+                           desc["target_name"])
     elif ty == "dummy":
         return DummyDevice()
     else:
@@ -53,20 +77,43 @@ class DeviceError(Exception):
     pass
 
 
+def _freeze(desc):
+    # hashable equivalent of a device description
+    if isinstance(desc, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in desc.items()))
+    if isinstance(desc, (list, tuple)):
+        return tuple(_freeze(e) for e in desc)
+    hash(desc)
+    return desc
+
+
 class DeviceManager:
     """Handles creation and destruction of local device drivers and controller
-    RPC clients."""
+    RPC clients.
+
+    The device database is retrieved once and kept until
+    :meth:`close_devices` is called. Controller RPC clients connect when
+    they are first used."""
     def __init__(self, ddb, virtual_devices=dict()):
         self.ddb = ddb
         self.virtual_devices = virtual_devices
         self.active_devices = []
+        # description (see _freeze) -> device, for active_devices
+        self._active_index = dict()
+        self._device_db = None
 
     def get_device_db(self):
         """Returns the full contents of the device database."""
-        return self.ddb.get_device_db()
+        if self._device_db is None:
+            self._device_db = self.ddb.get_device_db()
+        return self._device_db
 
     def get_desc(self, name):
-        return self.ddb.get(name, resolve_alias=True)
+        device_db = self.get_device_db()
+        desc = device_db[name]
+        while isinstance(desc, str):
+            desc = device_db[desc]
+        return desc
 
     def get(self, name):
         """Get the device driver or controller client corresponding to a
@@ -80,9 +127,19 @@ class DeviceManager:
             raise DeviceError("Failed to get description of device '{}'"
                               .format(name)) from e
 
-        for existing_desc, existing_dev in self.active_devices:
-            if desc == existing_desc:
-                return existing_dev
+        try:
+            key = _freeze(desc)
+        except TypeError:
+            # unhashable argument values
+            key = None
+            for existing_desc, existing_dev in self.active_devices:
+                if desc == existing_desc:
+                    return existing_dev
+        else:
+            try:
+                return self._active_index[key]
+            except KeyError:
+                pass
 
         try:
             dev = _create_device(desc, self)
@@ -90,6 +147,8 @@ class DeviceManager:
             raise DeviceError("Failed to create device '{}'"
                               .format(name)) from e
         self.active_devices.append((desc, dev))
+        if key is not None:
+            self._active_index[key] = dev
         return dev
 
     def close_devices(self):
@@ -97,23 +156,180 @@ class DeviceManager:
         requested."""
         for _desc, dev in reversed(self.active_devices):
             try:
-                if isinstance(dev, (Client, BestEffortClient)):
+                if isinstance(dev, (Client, BestEffortClient, _LazyClient)):
                     dev.close_rpc()
                 elif hasattr(dev, "close"):
                     dev.close()
             except Exception as e:
                 logger.warning("Exception %r when closing device %r", e, dev)
         self.active_devices.clear()
+        self._active_index.clear()
+        self._device_db = None
 
 
 class DatasetManager:
-    def __init__(self, ddb):
+    def __init__(self, ddb, flush_interval=None, flush_size=None):
         self._broadcaster = Notifier(dict())
         self.local = dict()
         self.archive = dict()
 
         self.ddb = ddb
-        self._broadcaster.publish = ddb.update
+        # If set, receives the changes to archived datasets as they happen.
+        self.results_writer = None
+
+        # Write-behind state: key -> modifications not yet sent to ddb
+        self._pending = OrderedDict()
+        # key -> (mod, start index) of the append being coalesced
+        self._pending_append = dict()
+        self._pending_count = 0
+        self._pending_since = None
+        # Sends the pending modifications when flush_interval expires.
+        self._timer = None
+        # The timer thread sends modifications while the experiment makes
+        # new ones.
+        self._lock = threading.RLock()
+        self.set_flush_policy(flush_interval, flush_size)
+
+    def set_flush_policy(self, interval=None, size=None):
+        """Sets when modifications of broadcast datasets are sent.
+
+        If both ``interval`` and ``size`` are ``None`` (the default), each
+        modification is sent immediately. Otherwise, modifications are
+        accumulated and coalesced per dataset, and sent by a timer thread
+        once the oldest one has been pending for ``interval`` seconds, or
+        when ``size`` of them are pending. They are also sent by
+        :meth:`flush` and before a dataset is read back from ``ddb``.
+
+        The modifications are copied when they are made, so that the values
+        sent are the same as in immediate mode. With an ``interval``,
+        ``ddb.update`` is called from the timer thread, and must be safe to
+        call concurrently with the other methods of ``ddb``."""
+        self.flush()
+        self.flush_interval = interval
+        self.flush_size = size
+        if interval is None and size is None:
+            self._broadcaster.publish = self.ddb.update
+        else:
+            self._broadcaster.publish = self._queue_mod
+
+    def _get_broadcast_target(self, path):
+        target = self._broadcaster.raw_view
+        for element in path:
+            target = target[element]
+        return target
+
+    def _preserves_length(self, mod):
+        # Slice assignments can resize lists, but not NumPy arrays.
+        return (isinstance(mod["key"], int)
+                or not isinstance(self._get_broadcast_target(mod["path"]),
+                                  list))
+
+    def _queue_mod(self, mod):
+        # The modification refers to objects of the experiment, which may
+        # change before it is sent.
+        mod = dict(mod)
+        for field in "value", "x":
+            if field in mod:
+                mod[field] = copy.deepcopy(mod[field])
+        with self._lock:
+            self._queue_mod_locked(mod)
+
+    def _queue_mod_locked(self, mod):
+        path = mod["path"]
+        key = path[0] if path else mod["key"]
+        mods = self._pending.setdefault(key, [])
+        if not path:
+            if mod["action"] == "setitem":
+                # Setting the dataset supersedes earlier changes.
+                self._pending_count -= len(mods)
+                mods.clear()
+            mods.append(mod)
+            self._pending_append.pop(key, None)
+        elif mods and not mods[0]["path"] and mods[0]["action"] == "setitem":
+            # Apply the change to the pending value of the dataset instead.
+            process_mod({key: mods[0]["value"]}, mod)
+            self._maybe_flush()
+            return
+        elif mod["action"] == "append":
+            append = self._pending_append.get(key)
+            if (append is not None and append[0] is mods[-1]
+                    and append[0]["path"] == path):
+                last, start = append
+                if last["action"] == "append":
+                    # Turn the append into an extension of the list.
+                    last = {"action": "setitem", "path": path,
+                            "key": slice(start, start), "value": [last["x"]]}
+                    mods[-1] = last
+                    self._pending_append[key] = last, start
+                last["value"].append(mod["x"])
+                self._maybe_flush()
+                return
+            start = len(self._get_broadcast_target(path)) - 1
+            mods.append(mod)
+            self._pending_append[key] = mod, start
+        else:
+            if mod["action"] == "setitem" and self._preserves_length(mod):
+                # Drop an earlier assignment to the same item, unless list
+                # lengths (and thus indices) may have changed in between.
+                append = self._pending_append.get(key)
+                for i in reversed(range(len(mods))):
+                    earlier = mods[i]
+                    if (earlier["action"] != "setitem"
+                            or (append is not None and earlier is append[0])
+                            or not self._preserves_length(earlier)):
+                        break
+                    if (earlier["path"] == path
+                            and type(earlier["key"]) is type(mod["key"])
+                            and earlier["key"] == mod["key"]):
+                        del mods[i]
+                        self._pending_count -= 1
+                        break
+            mods.append(mod)
+        if self._pending_count == 0:
+            self._pending_since = time.monotonic()
+            if self.flush_interval is not None:
+                self._timer = threading.Timer(self.flush_interval,
+                                              self._timer_expired)
+                self._timer.daemon = True
+                self._timer.start()
+        self._pending_count += 1
+        self._maybe_flush()
+
+    def _timer_expired(self):
+        with self._lock:
+            # A timer that was cancelled may still get here.
+            if self._timer is threading.current_thread():
+                self._send_pending()
+
+    def _maybe_flush(self):
+        if ((self.flush_size is not None
+                and self._pending_count >= self.flush_size)
+                or (self.flush_interval is not None
+                    and self._pending_since is not None
+                    and time.monotonic() - self._pending_since
+                        >= self.flush_interval)):
+            self._send_pending()
+
+    def flush(self):
+        """Sends the pending modifications of broadcast datasets, and
+        writes the pending changes of the results file."""
+        with self._lock:
+            self._send_pending()
+        if self.results_writer is not None:
+            self.results_writer.sync()
+
+    def _send_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending = self._pending
+        self._pending = OrderedDict()
+        self._pending_append.clear()
+        self._pending_count = 0
+        self._pending_since = None
+        for mods in pending.values():
+            for mod in mods:
+                self.ddb.update(mod)
 
     def set(self, key, value, broadcast=False, persist=False, archive=True):
         if key in self.archive:
@@ -131,8 +347,12 @@ class DatasetManager:
 
         if archive:
             self.local[key] = value
+            if self.results_writer is not None:
+                self.results_writer.set(key, value)
         elif key in self.local:
             del self.local[key]
+            if self.results_writer is not None:
+                self.results_writer.remove(key)
 
     def _get_mutation_target(self, key):
         target = self.local.get(key, None)
@@ -152,20 +372,30 @@ class DatasetManager:
             else:
                 index = slice(*index)
         setitem(target, index, value)
+        if self.results_writer is not None and key in self.local:
+            self.results_writer.set(key, target)
 
     def append_to(self, key, value):
-        self._get_mutation_target(key).append(value)
+        target = self._get_mutation_target(key)
+        target.append(value)
+        if self.results_writer is not None and key in self.local:
+            self.results_writer.append(key, target, value)
 
     def get(self, key, archive=False):
         if key in self.local:
             return self.local[key]
-        
+
+        with self._lock:
+            if key in self._pending:
+                self._send_pending()
         data = self.ddb.get(key)
         if archive:
             if key in self.archive:
                 logger.warning("Dataset '%s' is already in archive, "
                                "overwriting", key, stack_info=True)
             self.archive[key] = data
+            if self.results_writer is not None:
+                self.results_writer.archive(key, data)
         return data
 
     def write_hdf5(self, f):
@@ -186,3 +416,123 @@ def _write(group, k, v):
     except TypeError as e:
         raise TypeError("Error writing dataset '{}' of type '{}': {}".format(
             k, type(v), e))
+
+
+class ResultsWriter:
+    """Writes the archived datasets of a :class:`DatasetManager` into an
+    HDF5 file while the experiment progresses, so that little is left to
+    write when it completes.
+
+    Numerical arrays and lists are stored as chunked datasets that can be
+    extended along their first axis, optionally compressed with the HDF5
+    filter ``compression``. Appended elements are buffered and written in
+    batches; other changes cause the dataset to be written again. Pending
+    changes are written by :meth:`sync`, which is also called when datasets
+    are modified ``sync_interval`` seconds or more after the previous
+    call.
+
+    Errors writing a dataset are raised by :meth:`finish`, which writes
+    the remaining changes at the end of the experiment, so that they do not
+    interrupt it.
+    """
+    def __init__(self, f, compression=None, sync_interval=5.0):
+        self.file = f
+        self.compression = compression
+        self.sync_interval = sync_interval
+        self._datasets_group = f.create_group("datasets")
+        self._archive_group = f.create_group("archive")
+        # key -> value to write in full
+        self._dirty = dict()
+        # key -> elements to append to the extendable HDF5 dataset
+        self._appends = dict()
+        # key -> extendable HDF5 dataset holding the complete value
+        self._extendable = dict()
+        # (group name, key) -> exception raised when writing the dataset
+        self._errors = dict()
+        self._last_sync = time.monotonic()
+
+    def set(self, key, value):
+        self._errors.pop(("datasets", key), None)
+        self._appends.pop(key, None)
+        self._dirty[key] = value
+        self._maybe_sync()
+
+    def remove(self, key):
+        self._errors.pop(("datasets", key), None)
+        self._dirty.pop(key, None)
+        self._appends.pop(key, None)
+        self._extendable.pop(key, None)
+        if key in self._datasets_group:
+            del self._datasets_group[key]
+
+    def append(self, key, value, x):
+        """Records that ``x`` was appended to the list ``value``."""
+        if key not in self._dirty:
+            dataset = self._extendable.get(key)
+            x = numpy.asarray(x)
+            if (dataset is not None and x.dtype == dataset.dtype
+                    and x.shape == dataset.shape[1:]):
+                self._appends.setdefault(key, []).append(x)
+            else:
+                # The element does not fit, so the type of the whole
+                # dataset changes.
+                self._appends.pop(key, None)
+                self._dirty[key] = value
+        self._maybe_sync()
+
+    def archive(self, key, value):
+        group = self._archive_group
+        self._errors.pop(("archive", key), None)
+        if key in group:
+            del group[key]
+        try:
+            _write(group, key, value)
+        except Exception as e:
+            self._errors[("archive", key)] = e
+
+    def _write_dataset(self, key, value):
+        group = self._datasets_group
+        if key in group:
+            del group[key]
+        self._extendable.pop(key, None)
+        try:
+            array = numpy.asarray(value)
+        except ValueError:
+            array = None
+        try:
+            if (array is not None and array.dtype.kind in "biufc"
+                    and array.ndim):
+                self._extendable[key] = group.create_dataset(
+                    key, data=array, maxshape=(None, ) + array.shape[1:],
+                    chunks=True, compression=self.compression)
+            else:
+                _write(group, key, value)
+        except Exception as e:
+            self._errors[("datasets", key)] = e
+
+    def _maybe_sync(self):
+        if time.monotonic() - self._last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """Writes the pending changes and flushes the file."""
+        dirty = self._dirty
+        self._dirty = dict()
+        for key, value in dirty.items():
+            self._write_dataset(key, value)
+        appends = self._appends
+        self._appends = dict()
+        for key, elements in appends.items():
+            dataset = self._extendable[key]
+            start = dataset.shape[0]
+            dataset.resize(start + len(elements), axis=0)
+            dataset[start:] = numpy.stack(elements)
+        self.file.flush()
+        self._last_sync = time.monotonic()
+
+    def finish(self):
+        """Writes the pending changes and raises the first error that
+        occurred when writing a dataset, if any."""
+        self.sync()
+        for e in self._errors.values():
+            raise e
@@ -10,6 +10,7 @@ import sys
 import time
 import os
 import logging
+import threading
 import traceback
 from collections import OrderedDict
 
@@ -21,34 +22,54 @@ from sipyco.logging_tools import multiline_log_config
 
 import artiq
 from artiq.tools import file_import
-from artiq.master.worker_db import DeviceManager, DatasetManager, DummyDevice
+from artiq.master.worker_db import (DeviceManager, DatasetManager,
+                                    DummyDevice, ResultsWriter)
+from artiq.master import worker_ipc
 from artiq.language.environment import (is_experiment, TraceArgumentManager,
                                         ProcessArgumentManager)
 from artiq.language.core import set_watchdog_factory, TerminationRequested
 from artiq.language.types import TBool
 from artiq.compiler import import_cache
-from artiq.coredevice.core import CompileError, host_only, _render_diagnostic
+from artiq.coredevice.core import (Core, CompileError, host_only,
+                                   _render_diagnostic)
 from artiq import __version__ as artiq_version
 
 
 ipc = None
+binary_ipc = False
+# Requests to the master are also made by the thread sending dataset
+# modifications in write-behind mode, and by asynchronous RPCs.
+ipc_lock = threading.RLock()
 
 
 def get_object():
-    line = ipc.readline().decode()
-    return pyon.decode(line)
+    return worker_ipc.read_object(ipc.read, ipc.readline)
+
+
+def _write(data):
+    data = memoryview(data)
+    while data:
+        n = ipc.write(data)
+        if n is None:
+            break
+        data = data[n:]
 
 
 def put_object(obj):
-    ds = pyon.encode(obj)
-    ipc.write((ds + "\n").encode())
+    with ipc_lock:
+        if binary_ipc:
+            for chunk in worker_ipc.encode_frame(obj):
+                _write(chunk)
+        else:
+            _write(worker_ipc.encode_line(obj))
 
 
 def make_parent_action(action):
     def parent_action(*args, **kwargs):
         request = {"action": action, "args": args, "kwargs": kwargs}
-        put_object(request)
-        reply = get_object()
+        with ipc_lock:
+            put_object(request)
+            reply = get_object()
         if "action" in reply:
             if reply["action"] == "terminate":
                 sys.exit()
@@ -89,13 +110,23 @@ set_watchdog_factory(Watchdog)
 
 
 class Scheduler:
+    def __init__(self):
+        # Pending dataset modifications are sent before pausing, so that
+        # other experiments and clients see them.
+        self.dataset_mgr = None
+
     def set_run_info(self, rid, pipeline_name, expid, priority):
         self.rid = rid
         self.pipeline_name = pipeline_name
         self.expid = expid
         self.priority = priority
 
-    pause_noexc = staticmethod(make_parent_action("pause"))
+    _pause = staticmethod(make_parent_action("pause"))
+    def pause_noexc(self):
+        if self.dataset_mgr is not None:
+            self.dataset_mgr.flush()
+        return self._pause()
+
     @host_only
     def pause(self):
         if self.pause_noexc():
@@ -141,6 +172,28 @@ def get_exp(file, class_name):
 
 
 register_experiment = make_parent_action("register_experiment")
+register_dependencies = make_parent_action("register_dependencies")
+report_memory = make_parent_action("report_memory")
+
+
+def get_rss():
+    """Returns the resident set size of the worker process in bytes, or
+    ``None`` if it cannot be determined on this platform."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages*os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss
+    else:
+        return rss*1024
 
 
 class ExamineDeviceMgr:
@@ -161,7 +214,7 @@ class ExamineDatasetMgr:
         pass
 
 
-def examine(device_mgr, dataset_mgr, file):
+def examine(device_mgr, dataset_mgr, file, report_dependencies=False):
     previous_keys = set(sys.modules.keys())
     try:
         module = file_import(file)
@@ -182,6 +235,13 @@ def examine(device_mgr, dataset_mgr, file):
                     (k, (proc.describe(), group, tooltip))
                     for k, (proc, group, tooltip) in argument_mgr.requested_args.items())
                 register_experiment(class_name, name, arginfo, scheduler_defaults)
+        if report_dependencies:
+            dependencies = []
+            for key in set(sys.modules.keys()) - previous_keys:
+                filename = getattr(sys.modules[key], "__file__", None)
+                if filename is not None and filename != file:
+                    dependencies.append(filename)
+            register_dependencies(sorted(dependencies))
     finally:
         new_keys = set(sys.modules.keys())
         for key in new_keys - previous_keys:
@@ -234,10 +294,12 @@ def put_exception_report():
 
 
 def main():
-    global ipc
+    global ipc, binary_ipc
 
     multiline_log_config(level=int(sys.argv[2]))
     ipc = pipe_ipc.ChildComm(sys.argv[1])
+    # The master accepts binary frames only if it asked for them.
+    binary_ipc = len(sys.argv) > 3 and sys.argv[3] == "binary"
 
     start_time = None
     run_time = None
@@ -246,14 +308,22 @@ def main():
     exp = None
     exp_inst = None
     repository_path = None
+    results_file = None
 
+    scheduler = Scheduler()
     device_mgr = DeviceManager(ParentDeviceDB,
-                               virtual_devices={"scheduler": Scheduler(),
+                               virtual_devices={"scheduler": scheduler,
                                                 "ccb": CCB()})
     dataset_mgr = DatasetManager(ParentDatasetDB)
+    scheduler.dataset_mgr = dataset_mgr
 
     import_cache.install_hook()
 
+    # State to return to when the process is reset to serve another run.
+    initial_modules = set(sys.modules.keys())
+    initial_import_cache = set(import_cache.cache.keys())
+    initial_cwd = os.getcwd()
+
     try:
         while True:
             obj = get_object()
@@ -262,6 +332,7 @@ def main():
                 start_time = time.time()
                 rid = obj["rid"]
                 expid = obj["expid"]
+                logging.getLogger().setLevel(expid["log_level"])
                 if obj["wd"] is not None:
                     # Using repository
                     experiment_file = os.path.join(obj["wd"], expid["file"])
@@ -270,8 +341,9 @@ def main():
                     experiment_file = expid["file"]
                     repository_path = None
                 setup_diagnostics(experiment_file, repository_path)
+                dataset_mgr.set_flush_policy(*obj["dataset_flush"])
                 exp = get_exp(experiment_file, expid["class_name"])
-                device_mgr.virtual_devices["scheduler"].set_run_info(
+                scheduler.set_run_info(
                     rid, obj["pipeline_name"], expid, obj["priority"])
                 start_local_time = time.localtime(start_time)
                 dirname = os.path.join("results",
@@ -279,15 +351,26 @@ def main():
                                    time.strftime("%H", start_local_time))
                 os.makedirs(dirname, exist_ok=True)
                 os.chdir(dirname)
+                results_file = h5py.File(
+                    "{:09}-{}.h5".format(rid, exp.__name__), "w")
+                dataset_mgr.results_writer = ResultsWriter(
+                    results_file, obj["results_compression"])
+                results_file["artiq_version"] = artiq_version
+                results_file["rid"] = rid
+                results_file["start_time"] = start_time
+                results_file["expid"] = pyon.encode(expid)
                 argument_mgr = ProcessArgumentManager(expid["arguments"])
                 exp_inst = exp((device_mgr, dataset_mgr, argument_mgr, {}))
+                dataset_mgr.flush()
                 put_object({"action": "completed"})
             elif action == "prepare":
                 exp_inst.prepare()
+                dataset_mgr.flush()
                 put_object({"action": "completed"})
             elif action == "run":
                 run_time = time.time()
                 exp_inst.run()
+                dataset_mgr.flush()
                 put_object({"action": "completed"})
             elif action == "analyze":
                 try:
@@ -295,27 +378,77 @@ def main():
                 except:
                     # make analyze failure non-fatal, as we may still want to
                     # write results afterwards
+                    dataset_mgr.flush()
                     put_exception_report()
                 else:
+                    dataset_mgr.flush()
                     put_object({"action": "completed"})
             elif action == "write_results":
-                filename = "{:09}-{}.h5".format(rid, exp.__name__)
-                with h5py.File(filename, "w") as f:
-                    dataset_mgr.write_hdf5(f)
-                    f["artiq_version"] = artiq_version
-                    f["rid"] = rid
-                    f["start_time"] = start_time
-                    f["run_time"] = run_time
-                    f["expid"] = pyon.encode(expid)
+                # Datasets were written to the file as they changed.
+                try:
+                    dataset_mgr.results_writer.finish()
+                    results_file["run_time"] = run_time
+                    # Only look at cores: other devices may be controller
+                    # clients that would connect to answer getattr().
+                    compile_profiles = [
+                        report
+                        for _desc, dev in device_mgr.active_devices
+                        if isinstance(dev, Core)
+                        for report in dev.compile_profiles]
+                    if compile_profiles:
+                        results_file["compile_profile"] = \
+                            pyon.encode(compile_profiles)
+                    if obj.get("schedule") is not None:
+                        group = results_file.create_group("schedule")
+                        for k, v in obj["schedule"].items():
+                            group[k] = v
+                finally:
+                    dataset_mgr.results_writer = None
+                    results_file.close()
+                    results_file = None
                 put_object({"action": "completed"})
             elif action == "examine":
-                examine(ExamineDeviceMgr, ExamineDatasetMgr, obj["file"])
+                examine(ExamineDeviceMgr, ExamineDatasetMgr, obj["file"],
+                        obj.get("dependencies", False))
+                put_object({"action": "completed"})
+            elif action == "reset":
+                device_mgr.close_devices()
+                dataset_mgr = DatasetManager(ParentDatasetDB)
+                scheduler.dataset_mgr = dataset_mgr
+                start_time = run_time = rid = expid = None
+                exp = exp_inst = repository_path = None
+                # Experiment files and the modules they import may be
+                # different in the next run (e.g. other repository revision).
+                for key in set(sys.modules.keys()) - initial_modules:
+                    del sys.modules[key]
+                for key in set(import_cache.cache.keys()) - initial_import_cache:
+                    del import_cache.cache[key]
+                os.chdir(initial_cwd)
+                report_memory(get_rss())
                 put_object({"action": "completed"})
             elif action == "terminate":
                 break
+    except Exception:
+        # Send what the experiment broadcast before failing.
+        try:
+            dataset_mgr.flush()
+        except:
+            logging.debug("failed to send pending dataset modifications",
+                          exc_info=True)
+        put_exception_report()
     except:
         put_exception_report()
     finally:
+        if results_file is not None:
+            # Keep what was written of the results of a run that failed,
+            # unless it failed before starting.
+            try:
+                filename = results_file.filename
+                results_file.close()
+                if run_time is None:
+                    os.unlink(filename)
+            except:
+                logging.debug("failed to close results file", exc_info=True)
         device_mgr.close_devices()
         ipc.close()
 
@@ -0,0 +1,175 @@
+"""Message encoding for the pipe between the master and the worker processes.
+
+A message is either a PYON line, or a binary frame in which NumPy arrays are
+transferred as raw buffers next to the PYON text instead of being encoded
+into it. A binary frame starts with a NUL byte, which cannot start a PYON
+line, so receivers accept both formats and each sender chooses the format
+its peer has agreed to (see :class:`artiq.master.worker.Worker`).
+
+Binary frame layout (integers are little-endian)::
+
+    b"\\x00"
+    u32     length of the header
+    header  PYON encoding of ``(obj, buffers)``, where ``obj`` is the message
+            with the arrays replaced by ``None`` and ``buffers`` lists the
+            ``(path, dtype, shape)`` of each array
+    data    contents of the arrays, in the order of ``buffers``
+"""
+
+import struct
+
+import numpy
+
+from sipyco import pyon
+
+
+__all__ = ["FRAME_MARKER", "encode_line", "encode_frame",
+           "read_object", "read_object_async"]
+
+
+FRAME_MARKER = b"\x00"
+_header_length = struct.Struct("<I")
+# Array types that have a fixed-size binary representation.
+_raw_kinds = "biufcSU"
+
+
+def _extract_arrays(obj, path, buffers):
+    if isinstance(obj, numpy.ndarray):
+        if obj.dtype.kind in _raw_kinds:
+            buffers.append((list(path), obj))
+            return None
+        return obj
+    if isinstance(obj, dict):
+        r = None
+        for k, v in obj.items():
+            path.append(k)
+            nv = _extract_arrays(v, path, buffers)
+            path.pop()
+            if nv is not v:
+                if r is None:
+                    r = obj.copy()
+                r[k] = nv
+        return obj if r is None else r
+    if isinstance(obj, (list, tuple)):
+        r = None
+        for i, v in enumerate(obj):
+            path.append(i)
+            nv = _extract_arrays(v, path, buffers)
+            path.pop()
+            if nv is not v:
+                if r is None:
+                    r = list(obj)
+                r[i] = nv
+        if r is None:
+            return obj
+        return tuple(r) if isinstance(obj, tuple) else r
+    return obj
+
+
+def _insert_array(obj, path, array):
+    if not path:
+        return array
+    key = path[0]
+    child = _insert_array(obj[key], path[1:], array)
+    if isinstance(obj, tuple):
+        return obj[:key] + (child,) + obj[key+1:]
+    obj[key] = child
+    return obj
+
+
+def encode_line(obj):
+    return (pyon.encode(obj) + "\n").encode()
+
+
+def encode_frame(obj):
+    """Encodes ``obj`` as a binary frame.
+
+    Returns a list of bytes-like objects to be written in sequence. The
+    array buffers are not copied."""
+    arrays = []
+    stripped = _extract_arrays(obj, [], arrays)
+    buffers = []
+    chunks = []
+    for path, array in arrays:
+        buffers.append((path, array.dtype.str, array.shape))
+        array = numpy.ascontiguousarray(array)
+        chunks.append(array.reshape(-1).view(numpy.uint8).data)
+    header = pyon.encode((stripped, buffers)).encode()
+    return [FRAME_MARKER + _header_length.pack(len(header)) + header] + chunks
+
+
+def _parse_header(header):
+    obj, buffers = pyon.decode(header.decode())
+    length = 0
+    for _path, dtype, shape in buffers:
+        length += numpy.dtype(dtype).itemsize*int(numpy.prod(shape))
+    return obj, buffers, length
+
+
+def _insert_arrays(obj, buffers, data):
+    # Arrays are views into ``data``, which is a bytearray so that they
+    # are writable.
+    offset = 0
+    for path, dtype, shape in buffers:
+        dtype = numpy.dtype(dtype)
+        count = int(numpy.prod(shape))
+        array = numpy.frombuffer(data, dtype, count, offset).reshape(shape)
+        offset += dtype.itemsize*count
+        obj = _insert_array(obj, path, array)
+    return obj
+
+
+def _read_exactly(read, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = read(n - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def read_object(read, readline):
+    """Reads a message in either format using the blocking ``read(n)``
+    and ``readline()`` functions of a pipe.
+
+    Raises ``EOFError`` if the pipe was closed."""
+    first = read(1)
+    if not first:
+        raise EOFError
+    if first != FRAME_MARKER:
+        line = first + readline()
+        return pyon.decode(line.decode())
+    length, = _header_length.unpack(_read_exactly(read, _header_length.size))
+    obj, buffers, data_length = _parse_header(_read_exactly(read, length))
+    if buffers:
+        obj = _insert_arrays(obj, buffers, _read_exactly(read, data_length))
+    return obj
+
+
+async def _read_exactly_async(read, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = await read(n - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+async def read_object_async(read, readline):
+    """Coroutine version of :func:`read_object`."""
+    first = await read(1)
+    if not first:
+        raise EOFError
+    if first != FRAME_MARKER:
+        line = first + await readline()
+        return pyon.decode(line.decode())
+    length, = _header_length.unpack(
+        await _read_exactly_async(read, _header_length.size))
+    obj, buffers, data_length = _parse_header(
+        await _read_exactly_async(read, length))
+    if buffers:
+        obj = _insert_arrays(obj, buffers,
+                             await _read_exactly_async(read, data_length))
+    return obj
@@ -0,0 +1,208 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+from artiq.language.core import kernel
+from artiq.coredevice.core import Core
+from artiq.compiler.embedding import Stitcher
+from artiq.compiler.module import Module
+from artiq.compiler.targets import RunTool, NativeTarget
+from artiq.compiler.compilation_cache import CompilationCache
+from artiq.compiler import elf
+
+
+class _Dmgr:
+    def __init__(self, core):
+        self.core = core
+
+    def get(self, name):
+        return self.core
+
+
+class _Experiment:
+    def __init__(self, core):
+        self.core = core
+        self.x = 1
+        self.y = 0.5
+
+    @kernel
+    def get(self):
+        return float(self.x) + self.y
+
+
+class _HostTarget(NativeTarget):
+    def link(self, objects):
+        with RunTool(["ld", "-shared", "--eh-frame-hdr"] +
+                     ["{{obj{}}}".format(index) for index in range(len(objects))] +
+                     ["-o", "{output}"],
+                     output=None,
+                     **{"obj{}".format(index): obj for index, obj in enumerate(objects)}) \
+                as results:
+            return results["output"].read()
+
+
+def _disable_dumps(testcase):
+    # Compilations with dumps enabled are not cached.
+    environ = {name: value for name, value in os.environ.items()
+               if not name.startswith("ARTIQ_DUMP_") and name != "ARTIQ_IR_NO_LOC"}
+    patcher = mock.patch.dict(os.environ, environ, clear=True)
+    patcher.start()
+    testcase.addCleanup(patcher.stop)
+
+
+class CompilationCacheTest(unittest.TestCase):
+    def setUp(self):
+        _disable_dumps(self)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.core = Core(None, host=None, ref_period=1e-9)
+        self.experiment = _Experiment(self.core)
+        self.target = NativeTarget()
+
+    def stitch(self, cache, parameter_slots=False):
+        stitcher = Stitcher(core=self.core, dmgr=_Dmgr(self.core),
+                            parameter_slots=parameter_slots)
+        stitcher.stitch_call(self.experiment.get, (), {})
+        stitcher.finalize()
+        fingerprint = cache.fingerprint(stitcher, self.target, ref_period=1e-9)
+        self.assertIsNotNone(fingerprint)
+        return stitcher, fingerprint
+
+    def test_fingerprint(self):
+        cache = CompilationCache()
+        _, fingerprint = self.stitch(cache)
+        _, same = self.stitch(cache)
+        self.assertEqual(same.key, fingerprint.key)
+
+        # Quoted constants are part of the kernel...
+        self.experiment.x = 2
+        _, changed = self.stitch(cache)
+        self.assertNotEqual(changed.key, fingerprint.key)
+        self.experiment.y = 1.5
+        _, changed_float = self.stitch(cache)
+        self.assertNotIn(changed_float.key, (fingerprint.key, changed.key))
+
+        # ... unless they are stored in parameter slots.
+        _, slots = self.stitch(cache, parameter_slots=True)
+        self.experiment.x = 3
+        _, slots_changed = self.stitch(cache, parameter_slots=True)
+        self.assertEqual(slots_changed.key, slots.key)
+        self.assertNotEqual(slots.key, changed_float.key)
+
+        self.assertEqual(cache.uncacheable, 0)
+
+    def test_disk(self):
+        cache = CompilationCache(size=0, directory=self.directory)
+        stitcher, fingerprint = self.stitch(cache)
+        self.assertIsNone(cache.get(fingerprint))
+        self.assertEqual(cache.misses, 1)
+
+        # Code generation enters the host objects into the embedding map.
+        self.target.compile(Module(stitcher, ref_period=1e-9))
+        object_count = stitcher.embedding_map.object_current_key
+        self.assertGreater(object_count, fingerprint.object_count)
+        cache.put(fingerprint, self.target, b"library", b"stripped")
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        # Another process, e.g. the next experiment.
+        cache = CompilationCache(size=0, directory=self.directory)
+        stitcher, fingerprint = self.stitch(cache)
+        self.assertEqual(cache.get(fingerprint), (b"library", b"stripped"))
+        self.assertEqual((cache.hits, cache.disk_hits, cache.misses), (1, 1, 0))
+        self.assertEqual(stitcher.embedding_map.object_current_key, object_count)
+
+        self.experiment.x = 2
+        _, fingerprint = self.stitch(cache)
+        self.assertIsNone(cache.get(fingerprint))
+        self.assertEqual(cache.misses, 1)
+
+
+@unittest.skipUnless(shutil.which("ld"), "no host toolchain")
+class ParameterSlotsTest(unittest.TestCase):
+    def setUp(self):
+        _disable_dumps(self)
+        self.core = Core(None, host=None, ref_period=1e-9, parameter_slots=True)
+        self.experiment = _Experiment(self.core)
+        self.cache = CompilationCache()
+
+    def compile(self):
+        """Compile like :meth:`Core.compile`, and return the stripped library
+        and whether it was compiled rather than taken from the cache."""
+        stitcher = Stitcher(core=self.core, dmgr=_Dmgr(self.core),
+                            parameter_slots=True)
+        stitcher.stitch_call(self.experiment.get, (), {})
+        stitcher.finalize()
+        target = _HostTarget()
+        fingerprint = self.cache.fingerprint(stitcher, target, ref_period=1e-9)
+        self.assertIsNotNone(fingerprint)
+        cached = self.cache.get(fingerprint)
+        if cached is not None:
+            self.embedding_map = stitcher.embedding_map
+            return cached[1], False
+
+        module = Module(stitcher, ref_period=1e-9, parameter_slots=True)
+        library = target.compile_and_link([module])
+        stripped_library = target.strip(library)
+        self.cache.put(fingerprint, target, library, stripped_library,
+                       module.parameter_slots)
+        self.embedding_map = stitcher.embedding_map
+        self.parameter_slots = module.parameter_slots
+        return stripped_library, True
+
+    def read_slots(self, library):
+        symbols = {"O.{}".format(objectid) for objectid, _, _, _ in self.parameter_slots}
+        symbol_offsets = elf.symbol_offsets(library, symbols)
+        endian = "<" if elf.ELFFile(library).endian == "<" else ">"
+        values = {}
+        for objectid, attr, fmt, offset in self.parameter_slots:
+            self.assertIs(self.embedding_map.retrieve_object(objectid), self.experiment)
+            values[attr], = struct.unpack_from(
+                endian + fmt, library, symbol_offsets["O.{}".format(objectid)] + offset)
+        return values
+
+    def test_patch(self):
+        library, compiled = self.compile()
+        self.assertTrue(compiled)
+        self.assertEqual(sorted(attr for _, attr, _, _ in self.parameter_slots), ["x", "y"])
+        self.assertEqual(self.read_slots(library), {"x": 1, "y": 0.5})
+
+        self.experiment.x = -7
+        self.experiment.y = 2.25
+        patched, compiled = self.compile()
+        self.assertFalse(compiled)
+        self.assertEqual(len(patched), len(library))
+        self.assertEqual(self.read_slots(patched), {"x": -7, "y": 2.25})
+        # Only the slots differ.
+        self.assertEqual(sum(a != b for a, b in zip(library, patched)),
+                         sum(a != b for a, b in zip(
+                             struct.pack("<id", 1, 0.5), struct.pack("<id", -7, 2.25))))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_overflow(self):
+        self.compile()
+        self.assertEqual([fmt for _, attr, fmt, _ in self.parameter_slots if attr == "x"],
+                         ["i"])
+
+        # Does not fit into the int32 slot: the attribute is stitched as
+        # an int64, and the kernel is compiled again.
+        self.experiment.x = 2**40
+        library, compiled = self.compile()
+        self.assertTrue(compiled)
+        self.assertEqual(self.cache.stats()["misses"], 2)
+        self.assertEqual([fmt for _, attr, fmt, _ in self.parameter_slots if attr == "x"],
+                         ["q"])
+        self.assertEqual(self.read_slots(library), {"x": 2**40, "y": 0.5})
+
+        # A value changed after the kernel was identified cannot be written
+        # either.
+        stitcher = Stitcher(core=self.core, dmgr=_Dmgr(self.core),
+                            parameter_slots=True)
+        stitcher.stitch_call(self.experiment.get, (), {})
+        stitcher.finalize()
+        fingerprint = self.cache.fingerprint(stitcher, _HostTarget(), ref_period=1e-9)
+        self.experiment.x = 2**70
+        self.assertIsNone(self.cache.get(fingerprint))
+        self.assertEqual(self.cache.stats()["misses"], 3)
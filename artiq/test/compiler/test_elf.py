@@ -0,0 +1,60 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from artiq.compiler import elf
+
+
+_source = """
+static int counter = 3;
+int data[4] = {1, 2, 3, 4};
+int f(int x) { return x + counter + data[x & 3]; }
+"""
+
+
+@unittest.skipUnless(shutil.which("cc") and shutil.which("ld") and shutil.which("strip"),
+                     "no host toolchain")
+class StripTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, "library.c")
+        with open(self.source, "w") as f:
+            f.write(_source)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_strip_debug(self, library):
+        with open(library, "rb") as f:
+            data = f.read()
+        stripped = elf.strip_debug(data)
+        binutils_stripped = os.path.join(self.directory, "stripped.so")
+        subprocess.check_call(["strip", "--strip-debug", library,
+                               "-o", binutils_stripped])
+        with open(binutils_stripped, "rb") as f:
+            self.assertEqual(stripped, f.read())
+        self.assertLess(len(stripped), len(data))
+        self.assertEqual(elf.strip_debug(stripped), stripped)
+
+        elf_file = elf.ELFFile(stripped)
+        offset = elf.symbol_offsets(stripped, {"data"})["data"]
+        self.assertEqual(stripped[offset:offset + 4],
+                         (1).to_bytes(4, "little" if elf_file.endian == "<" else "big"))
+
+    def test_strip_debug(self):
+        library = os.path.join(self.directory, "library.so")
+        subprocess.check_call(["cc", "-g", "-fPIC", "-shared",
+                               "-o", library, self.source])
+        self.check_strip_debug(library)
+
+    def test_strip_debug_ld(self):
+        # Linked like kernels, without the C runtime.
+        obj = os.path.join(self.directory, "library.o")
+        library = os.path.join(self.directory, "library.so")
+        subprocess.check_call(["cc", "-g", "-O2", "-fPIC", "-c",
+                               "-o", obj, self.source])
+        subprocess.check_call(["ld", "-shared", "--eh-frame-hdr",
+                               "-o", library, obj])
+        self.check_strip_debug(library)
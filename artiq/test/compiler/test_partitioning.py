@@ -0,0 +1,84 @@
+import unittest
+
+from llvmlite_artiq import binding as llvm
+
+from artiq.compiler.partitioning import Partitioning
+
+
+_module = r"""
+@counter = private global i32 0
+@message = private unnamed_addr constant [3 x i8] c"ok\00"
+
+define private i32 @increment(i32 %x) {
+  %c = load i32, i32* @counter
+  %n = add i32 %c, %x
+  store i32 %n, i32* @counter
+  ret i32 %n
+}
+
+define private i32 @"shared.helper"(i32 %x) noinline {
+  %r = add i32 %x, 1000
+  ret i32 %r
+}
+
+define i32 @first(i32 %x) {
+  %a = call i32 @increment(i32 %x)
+  %b = call i32 @"shared.helper"(i32 %a)
+  ret i32 %b
+}
+
+define i32 @second(i32 %x) {
+  %a = mul i32 %x, %x
+  %b = call i32 @"shared.helper"(i32 %a)
+  %c = load i8, i8* getelementptr ([3 x i8], [3 x i8]* @message, i32 0, i32 0)
+  %d = zext i8 %c to i32
+  %e = add i32 %b, %d
+  ret i32 %e
+}
+
+define i32 @third(i32 %x) {
+  %a = call i32 @first(i32 %x)
+  %b = call i32 @second(i32 %a)
+  ret i32 %b
+}
+"""
+
+
+class PartitioningTest(unittest.TestCase):
+    def setUp(self):
+        llvm.initialize()
+
+    def test_single(self):
+        partitioning = Partitioning(llvm.parse_assembly(_module), 1)
+        self.assertEqual(len(partitioning), 1)
+
+    def test_partitions(self):
+        partitioning = Partitioning(llvm.parse_assembly(_module), 3)
+        self.assertEqual(len(partitioning), 3)
+        self.assertEqual(Partitioning(llvm.parse_assembly(_module), 3).partitions,
+                         partitioning.partitions)
+
+        functions = ["increment", "shared.helper", "first", "second", "third"]
+        owners = {name: [index for index, partition in enumerate(partitioning.partitions)
+                         if name in partition]
+                  for name in functions}
+        self.assertTrue(all(len(owner) == 1 for owner in owners.values()))
+        # Private functions with a single caller stay with it.
+        self.assertEqual(owners["increment"], owners["first"])
+        self.assertIn("counter", partitioning.partitions[0])
+        self.assertEqual("counter" in partitioning.exported, owners["increment"] != [0])
+        self.assertIn("shared.helper", partitioning.exported)
+
+        for index, partition in enumerate(partitioning.partitions):
+            llmodule = llvm.parse_assembly(partitioning.extract(_module, index))
+            partitioning.localize(llmodule, index)
+            llmodule.verify()
+            for llfunction in llmodule.functions:
+                self.assertEqual(llfunction.is_declaration, llfunction.name not in partition)
+                if llfunction.name in partitioning.exported:
+                    self.assertEqual(llfunction.linkage.name, "external")
+            for llglobal in llmodule.global_variables:
+                if index != 0:
+                    self.assertEqual(llglobal.linkage.name, "available_externally")
+                elif llglobal.name in partitioning.exported:
+                    self.assertEqual(llglobal.linkage.name, "external")
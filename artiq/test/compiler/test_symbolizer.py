@@ -0,0 +1,48 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from artiq.compiler import elf
+from artiq.compiler.symbolizer import Symbolizer
+
+
+_source = """int f(int x)
+{
+    return x * 3;
+}
+"""
+
+
+@unittest.skipUnless(shutil.which("cc") and shutil.which("addr2line"),
+                     "no host toolchain")
+class SymbolizerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        source = os.path.join(self.directory, "library.c")
+        with open(source, "w") as f:
+            f.write(_source)
+        library = os.path.join(self.directory, "library.so")
+        subprocess.check_call(["cc", "-g", "-O0", "-fPIC", "-shared",
+                               "-o", library, source])
+        with open(library, "rb") as f:
+            self.library = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_symbolize(self):
+        address = elf.symbol_offsets(self.library, {"f"})["f"]
+        with Symbolizer(self.library, None) as symbolizer:
+            locations = symbolizer.symbolize(address)
+            self.assertEqual(len(locations), 1)
+            function, filename, line, _ = locations[0]
+            self.assertEqual(function, "f")
+            self.assertEqual(os.path.basename(filename), "library.c")
+            self.assertEqual(line, "2")
+            self.assertIs(symbolizer.symbolize(address), locations)
+
+            backtrace = symbolizer.backtrace([address + 1])
+            self.assertEqual(backtrace, [(filename, 2, -1, "f", address + 1)])
+        self.assertIsNone(symbolizer._addr2line)
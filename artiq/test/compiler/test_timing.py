@@ -0,0 +1,41 @@
+import json
+import threading
+import unittest
+
+from artiq.compiler import timing
+
+
+class CompileTimerTest(unittest.TestCase):
+    def test_phases(self):
+        timer = timing.CompileTimer("kernel")
+        with timing.phase("inactive"):
+            pass
+        with timer.activate():
+            with timing.phase("outer"):
+                with timing.phase("inner"):
+                    pass
+            with timing.phase("second"):
+                pass
+        with timing.phase("inactive"):
+            pass
+
+        report = timer.report()
+        self.assertEqual([(phase["name"], phase["depth"]) for phase in report["phases"]],
+                         [("outer", 0), ("inner", 1), ("second", 0)])
+        outer, inner, second = report["phases"]
+        self.assertLessEqual(outer["start"], inner["start"])
+        self.assertLessEqual(inner["duration"], outer["duration"])
+        self.assertGreaterEqual(second["start"], outer["start"] + outer["duration"])
+        self.assertIn("inner", timing.format_report(report))
+
+        trace = json.loads(json.dumps(timing.chrome_trace([report])))
+        self.assertEqual([event["name"] for event in trace["traceEvents"]],
+                         ["outer", "inner", "second"])
+
+    def test_thread_local(self):
+        timer = timing.CompileTimer("kernel")
+        with timer.activate():
+            thread = threading.Thread(target=lambda: timing.phase("other").__enter__())
+            thread.start()
+            thread.join()
+        self.assertEqual(timer.phases, [])
@@ -1,6 +1,20 @@
+import io
+import json
+import struct
+import time
+import unittest
+
+import numpy
+import h5py
+
 from artiq.experiment import *
 from artiq.coredevice.comm_analyzer import (decode_dump, StoppedMessage,
                                             OutputMessage, InputMessage,
+                                            ExceptionMessage, ExceptionType,
+                                            decode_message, DecodedDump,
+                                            decoded_dump_to_vcd,
+                                            decoded_dump_to_hdf5,
+                                            decoded_dump_to_trace,
                                            _extract_log_chars, get_analyzer_dump)
 from artiq.test.hardware_testbench import ExperimentCase
 
@@ -75,3 +89,146 @@ class AnalyzerTest(ExperimentCase):
                         for msg in dump.messages
                         if isinstance(msg, OutputMessage) and msg.channel == dump.log_channel])
         self.assertEqual(log, "foo\x1E32\x1D")
+
+
+def _synthetic_dump(count, seed=0):
+    rng = numpy.random.RandomState(seed)
+    raw = rng.randint(0, 256, size=(count, 32)).astype(numpy.uint8)
+    # Only use valid exception types.
+    exception_types = numpy.array([e.value for e in ExceptionType], numpy.uint8)
+    raw[:, 11] = exception_types[raw[:, 11] % len(exception_types)]
+    raw[-1, 31] |= 0b11  # stopped
+    header = struct.pack(">IQbbb", count*32, count*32, 0, 0, 0)
+    return header + raw.tobytes()
+
+
+def _ttl_dump(count, seed=0):
+    rng = numpy.random.RandomState(seed)
+    messages = numpy.zeros(count, numpy.dtype([
+        ("data", ">u8"), ("address", ">u4"), ("rtio_counter", ">u8"),
+        ("timestamp", ">u8"), ("message_type_channel", ">u4")]))
+    messages["timestamp"] = 1000 + numpy.cumsum(rng.randint(0, 10, count))
+    messages["rtio_counter"] = messages["timestamp"] - rng.randint(0, 100, count)
+    messages["data"] = rng.randint(0, 2, count)
+    messages["message_type_channel"] = rng.randint(0, 2, count) << 2
+    messages[-1] = (0, 0, messages["timestamp"][-1] + 100, 0, 0b11)
+    log_channel = 2
+    header = struct.pack(">IQbbb", count*32, count*32, 0, log_channel, 0)
+    return header + messages.tobytes()
+
+
+_ttl_devices = {
+    "core": {"type": "local", "module": "artiq.coredevice.core",
+             "class": "Core", "arguments": {"ref_period": 1e-9}},
+    "ttl0": {"type": "local", "module": "artiq.coredevice.ttl",
+             "class": "TTLOut", "arguments": {"channel": 0}},
+    "ttl1": {"type": "local", "module": "artiq.coredevice.ttl",
+             "class": "TTLOut", "arguments": {"channel": 1}},
+}
+
+
+class AnalyzerDecodeTest(unittest.TestCase):
+    def test_decode(self):
+        data = _synthetic_dump(1000)
+        dump = decode_dump(data)
+        expected = [decode_message(data[15 + 32*i:15 + 32*(i + 1)])
+                    for i in range(1000)]
+        self.assertEqual(len(dump.messages), len(expected))
+        self.assertEqual(list(dump.messages), expected)
+        self.assertEqual(dump.messages[-1], expected[-1])
+        self.assertEqual(list(dump.messages[10:20]), expected[10:20])
+        self.assertIsInstance(dump.messages[-1], StoppedMessage)
+        self.assertEqual(
+            {type(message) for message in expected},
+            {OutputMessage, InputMessage, ExceptionMessage, StoppedMessage})
+        self.assertEqual(dump.messages.time().tolist(),
+                         [getattr(message, "timestamp", message.rtio_counter)
+                          for message in expected])
+
+    def test_decode_rate(self):
+        data = _synthetic_dump(2*1024*1024)  # 64 MB
+        t0 = time.monotonic()
+        dump = decode_dump(data)
+        t1 = time.monotonic()
+        for message in dump.messages:
+            pass
+        t2 = time.monotonic()
+        print(len(data)/(t1 - t0), "B/s decoded,",
+              len(dump.messages)/(t2 - t1), "messages/s iterated")
+        self.assertGreater(len(data)/(t1 - t0), 100e6)
+
+    def test_vcd(self):
+        dump = decode_dump(_ttl_dump(1000))
+        vcd = io.StringIO()
+        decoded_dump_to_vcd(vcd, _ttl_devices, dump)
+        vcd = vcd.getvalue()
+        self.assertIn("$var wire 1 ! ttl/ttl0 $end", vcd)
+        self.assertIn("$var wire 64 # rtio_slack $end", vcd)
+
+        # Decoded messages can also be given as a list.
+        vcd_list = io.StringIO()
+        decoded_dump_to_vcd(vcd_list, _ttl_devices, DecodedDump(
+            dump.log_channel, dump.dds_onehot_sel, list(dump.messages)))
+        self.assertEqual(vcd_list.getvalue(), vcd)
+
+        # Check the value changes against the messages.
+        values = {}
+        time = None
+        for line in vcd[vcd.index("#0\n"):].splitlines():
+            if line.startswith("#"):
+                time = int(line[1:])
+            elif line[-1] in "!\"":
+                values[(time, line[-1])] = line[:-1]
+        expected = {}
+        start = dump.messages[0].timestamp
+        for message in dump.messages[:-1]:
+            key = (message.timestamp - start, "!\""[message.channel])
+            expected[key] = str(message.data)
+        self.assertEqual(values, expected)
+
+    def _ttl_changes(self, dump):
+        changes = {"ttl0": [], "ttl1": []}
+        start = dump.messages[0].timestamp
+        for message in dump.messages[:-1]:
+            changes["ttl" + str(message.channel)].append(
+                (message.timestamp - start, message.data))
+        return changes
+
+    def test_hdf5(self):
+        dump = decode_dump(_ttl_dump(1000))
+        with h5py.File("analyzer.h5", "w", driver="core",
+                       backing_store=False) as f:
+            decoded_dump_to_hdf5(f, _ttl_devices, dump)
+            self.assertEqual(f.attrs["ref_period"], 1e-9)
+            self.assertEqual(f.attrs["start_time"], dump.messages[0].timestamp)
+            for name, changes in self._ttl_changes(dump).items():
+                group = f["ttl"][name]
+                self.assertEqual(list(zip(group["time"][:].tolist(),
+                                          group["value"][:].tolist())),
+                                 changes)
+            self.assertEqual(len(f["rtio_slack/value"]), 999)
+            self.assertEqual(f["rtio_slack/value"][0],
+                             (dump.messages[0].timestamp -
+                              dump.messages[0].rtio_counter)*1e-9)
+
+    def test_trace(self):
+        dump = decode_dump(_ttl_dump(1000))
+        trace = io.StringIO()
+        decoded_dump_to_trace(trace, _ttl_devices, dump)
+        events = json.loads(trace.getvalue())["traceEvents"]
+        for name, changes in self._ttl_changes(dump).items():
+            self.assertEqual(
+                [(event["ts"], event["args"]["value"]) for event in events
+                 if event.get("name") == "ttl/" + name],
+                [(t*1e-3, value) for t, value in changes])
+        self.assertEqual(
+            len([event for event in events if event.get("name") == "rtio_slack"]),
+            999)
+
+    def test_vcd_rate(self):
+        dump = decode_dump(_ttl_dump(1000000))
+        t0 = time.monotonic()
+        decoded_dump_to_vcd(io.StringIO(), _ttl_devices, dump)
+        t1 = time.monotonic()
+        print(len(dump.messages)/(t1 - t0), "messages/s written to VCD")
+        self.assertGreater(len(dump.messages)/(t1 - t0), 50e3)
@@ -387,3 +387,50 @@ class ListTupleTest(ExperimentCase):
 
     def test_empty_list(self):
         self.create(_EmptyList).run()
+
+
+class _CompilationCache(EnvExperiment):
+    def build(self):
+        self.setattr_device("core")
+        self.x = 1
+
+    @kernel
+    def get_x(self):
+        return self.x
+
+    @kernel
+    def add(self, y):
+        return float(self.x) + y
+
+
+class CompilationCacheTest(ExperimentCase):
+    def test_compilation_cache(self):
+        exp = self.create(_CompilationCache)
+        cache = exp.core.compile_cache
+        hits = cache.hits
+        self.assertEqual(exp.get_x(), 1)
+        # The result is returned through a new closure on every call.
+        self.assertEqual(exp.get_x(), 1)
+        self.assertEqual(cache.hits, hits + 1)
+        # Quoted values are part of the key.
+        exp.x = 2
+        self.assertEqual(exp.get_x(), 2)
+        self.assertEqual(cache.hits, hits + 1)
+
+    def test_parameter_slots(self):
+        exp = self.create(_CompilationCache)
+        core = exp.core
+        core.parameter_slots = True
+        try:
+            exp.x = 1
+            self.assertEqual(exp.get_x(), 1)
+            hits = core.compile_cache.hits
+            # Only the value of the attribute changes.
+            exp.x = 2
+            self.assertEqual(exp.get_x(), 2)
+            self.assertEqual(core.compile_cache.hits, hits + 1)
+            self.assertEqual(exp.add(1.5), 3.5)
+            self.assertEqual(exp.add(2.5), 4.5)
+            self.assertEqual(core.compile_cache.hits, hits + 2)
+        finally:
+            core.parameter_slots = False
@@ -1,5 +1,6 @@
 import unittest
 import asyncio
+import struct
 
 from artiq.coredevice.comm_moninj import *
 from artiq.test.hardware_testbench import ExperimentCase
@@ -65,3 +66,79 @@ class MonInjTest(ExperimentCase):
             (loop_out_channel, TTLOverride.en.value, 1),
             (loop_out_channel, TTLOverride.en.value, 1)
         ])
+
+
+class MonInjProtocolTest(unittest.TestCase):
+    """Tests the host side of the protocol against a local server."""
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_server(self, packets, chunk_size, **kwargs):
+        received = []
+        notifications = []
+        injection_statuses = []
+        disconnected = asyncio.Event()
+
+        async def handle(reader, writer):
+            data = b"".join(packets)
+            for i in range(0, len(data), chunk_size):
+                writer.write(data[i:i + chunk_size])
+                await writer.drain()
+                await asyncio.sleep(0)
+            await asyncio.sleep(0.1)
+            received.append(await reader.read(4096))
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                comm = CommMonInj(
+                    lambda *args: notifications.append(args),
+                    lambda *args: injection_statuses.append(args),
+                    disconnected.set, **kwargs)
+                await comm.connect("127.0.0.1", port)
+                comm.monitor_probes(True, [(1, 0), (1, 1), (2, 0)])
+                comm.monitor_injections(False, [(1, 0)])
+                await asyncio.wait_for(disconnected.wait(), 5)
+                await asyncio.sleep(0.05)
+                await comm.close()
+            finally:
+                server.close()
+                await server.wait_closed()
+            return comm
+
+        comm = self.loop.run_until_complete(run())
+        self.assertEqual(received, [
+            b"ARTIQ moninj\n" +
+            struct.pack(">bblb", 0, 1, 1, 0) + struct.pack(">bblb", 0, 1, 1, 1) +
+            struct.pack(">bblb", 0, 1, 2, 0) + struct.pack(">bblb", 3, 0, 1, 0)])
+        return comm, notifications, injection_statuses
+
+    def test_receive(self):
+        packets = []
+        for i in range(100):
+            packets.append(struct.pack(">blbl", 0, i % 3, i % 2, i))
+            if i % 10 == 0:
+                packets.append(struct.pack(">blbb", 1, i, 0, i % 2))
+        expected = [(i % 3, i % 2, i) for i in range(100)]
+        expected_statuses = [(i, 0, i % 2) for i in range(0, 100, 10)]
+        for chunk_size in 1, 7, 1000:
+            _, notifications, injection_statuses = \
+                self.run_server(packets, chunk_size)
+            self.assertEqual(notifications, expected)
+            self.assertEqual(injection_statuses, expected_statuses)
+
+    def test_coalesce(self):
+        packets = [struct.pack(">blbl", 0, 1, 0, i) for i in range(100)]
+        packets += [struct.pack(">blbl", 0, 2, 0, 5),
+                    struct.pack(">blbb", 1, 1, 0, 1)]
+        comm, notifications, injection_statuses = self.run_server(
+            packets, 1000, coalesce_interval=0.01)
+        self.assertEqual(notifications, [(1, 0, 99), (2, 0, 5)])
+        self.assertEqual(injection_statuses, [(1, 0, 1)])
+        self.assertEqual(comm.dropped_updates, 99)
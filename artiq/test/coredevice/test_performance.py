@@ -2,7 +2,10 @@ import os
 import time
 import unittest
 
+import numpy
+
 from artiq.experiment import *
+from artiq.coredevice.comm_kernel import CommKernel
 from artiq.test.hardware_testbench import ExperimentCase
 
 
@@ -68,6 +71,145 @@ class TransferTest(ExperimentCase):
         self.assertGreater(rate, .15e6)
 
 
+class _LoopbackCommKernel(CommKernel):
+    """Reads from a byte buffer and collects the written data, without a
+    core device."""
+    def __init__(self, data=b""):
+        CommKernel.__init__(self, "::1")
+        self.data = data
+        self.position = 0
+        self.written = bytearray()
+
+    def open(self):
+        pass
+
+    def read(self, length):
+        r = self.data[self.position:self.position + length]
+        if len(r) < length:
+            raise ConnectionResetError("Connection closed")
+        self.position += length
+        return r
+
+    def write(self, data):
+        self.written += data
+
+    def flush(self):
+        pass
+
+
+class RPCCodecTest(unittest.TestCase):
+    def encode_list(self, tag, wire_type, values):
+        # as sent by the firmware: a tag before each element
+        record = numpy.dtype([("tag", "u1"), ("value", wire_type)])
+        records = numpy.zeros(len(values), record)
+        records["tag"] = ord(tag)
+        records["value"] = values
+        return b"l" + len(values).to_bytes(4, "big") + records.tobytes()
+
+    def test_receive_list(self):
+        for tag, wire_type, values, host_type in [
+                    ("i", ">i4", [1, -2, 3], numpy.int32),
+                    ("I", ">i8", [2**40, -1], numpy.int64),
+                    ("f", ">f8", [0.5, -1.0], float),
+                    ("b", "u1", [True, False], bool)]:
+            comm = _LoopbackCommKernel(self.encode_list(tag, wire_type, values))
+            received = comm._receive_rpc_value(None)
+            self.assertEqual(received, values)
+            self.assertTrue(all(type(v) is host_type for v in received))
+
+        comm = _LoopbackCommKernel(b"a\x00\x00\x00\x02iiiiI\x00\x00\x00\x00\x00\x00\x00\x01")
+        with self.assertRaises(IOError):
+            comm._receive_rpc_value(None)
+
+    def test_send_list(self):
+        for tags, value in [(b"li", [1, -2, True]), (b"lI", [2**40, -1]),
+                            (b"lf", [0.5, -1.0]), (b"lb", [True, False]),
+                            (b"lt\x02if", [(1, 0.5)])]:
+            fast, slow = _LoopbackCommKernel(), _LoopbackCommKernel()
+            fast._send_rpc_value(tags, 0, value, value, None)
+            slow._write_int32(len(value))
+            for elt in value:
+                slow._send_rpc_value(tags, 1, elt, value, None)
+            self.assertEqual(fast.written, slow.written)
+
+        for tags, value in [(b"li", [2**31]), (b"li", [1.0]),
+                            (b"lI", [2**64]), (b"lf", [1])]:
+            with self.assertRaises(ValueError):
+                _LoopbackCommKernel()._send_rpc_value(tags, 0, value, value, None)
+
+    def test_list_rate(self):
+        values = numpy.arange(1 << 18, dtype=numpy.int32)
+        data = self.encode_list("i", ">i4", values)
+        t0 = time.monotonic()
+        received = _LoopbackCommKernel(data)._receive_rpc_value(None)
+        t1 = time.monotonic()
+        self.assertEqual(len(received), len(values))
+        rate = len(values)*4/(t1 - t0)
+        print(rate, "B/s")
+        self.assertGreater(rate, 10e6)
+
+        comm = _LoopbackCommKernel()
+        value = values.tolist()
+        t0 = time.monotonic()
+        comm._send_rpc_value(b"li", 0, value, value, None)
+        t1 = time.monotonic()
+        self.assertEqual(len(comm.written), 4 + len(values)*4)
+        rate = len(values)*4/(t1 - t0)
+        print(rate, "B/s")
+        self.assertGreater(rate, 10e6)
+
+
+class _EmbeddingMap:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def retrieve_object(self, object_id):
+        return self.objects[object_id]
+
+
+class AsyncRPCTest(unittest.TestCase):
+    def rpc_request(self, is_async, service_id, arg):
+        return (b"\x5a\x5a\x5a\x5a\x0a" + bytes([is_async]) +
+                service_id.to_bytes(4, "big") +
+                b"i" + arg.to_bytes(4, "big") + b"\x00" +
+                b"\x00\x00\x00\x01n")
+
+    def test_ordering(self):
+        calls = []
+        def slow(x):
+            time.sleep(0.001)
+            calls.append(x)
+        def sync(x):
+            calls.append(("sync", list(calls)))
+
+        data = b"".join(self.rpc_request(True, 1, i) for i in range(10))
+        data += self.rpc_request(False, 2, 0)
+        data += b"".join(self.rpc_request(True, 1, i) for i in range(10, 20))
+        data += b"\x5a\x5a\x5a\x5a\x07"
+        comm = _LoopbackCommKernel(data)
+        comm.serve(_EmbeddingMap({1: slow, 2: sync}), None, None)
+
+        # everything has run when serve returns
+        self.assertEqual(calls, list(range(10)) +
+                         [("sync", list(range(10)))] + list(range(10, 20)))
+        stats = comm.rpc_stats()
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertGreater(stats["max_queue_depth"], 0)
+        self.assertEqual(stats["services"][slow.__qualname__]["calls"], 20)
+        self.assertGreater(stats["services"][slow.__qualname__]["time"], 0.01)
+        self.assertEqual(stats["services"][sync.__qualname__]["calls"], 1)
+        comm.close()
+
+    def test_exception(self):
+        def fail(x):
+            raise ValueError(x)
+        comm = _LoopbackCommKernel(self.rpc_request(True, 1, 1) +
+                                   b"\x5a\x5a\x5a\x5a\x07")
+        with self.assertRaises(ValueError):
+            comm.serve(_EmbeddingMap({1: fail}), None, None)
+        comm.close()
+
+
 class _KernelOverhead(EnvExperiment):
     def build(self):
         self.setattr_device("core")
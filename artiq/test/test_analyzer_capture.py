@@ -0,0 +1,84 @@
+import unittest
+import os
+import tempfile
+import shutil
+import struct
+
+from artiq.coredevice.comm_analyzer import (decode_dump, OutputMessage,
+                                            StoppedMessage)
+from artiq.coredevice.analyzer_capture import CaptureStore
+
+
+def _dump(events, rtio_counter, lost=0, log_channel=1):
+    data = b"".join(struct.pack(">QIQQI", value, 0, timestamp - 10, timestamp,
+                                channel << 2)
+                    for channel, timestamp, value in events)
+    data += struct.pack(">QIQQI", 0, 0, rtio_counter, 0, 0b11)
+    return struct.pack(">IQbbb", len(data), len(data) + 32*lost, 0,
+                       log_channel, 0) + data
+
+
+class CaptureStoreCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_query(self):
+        store = CaptureStore(self.directory)
+        self.assertIsNone(store.add(_dump([], 100)))
+        store.add(_dump([(0, 1000, 1), (3, 1010, 2)], 1100), rid=1)
+        store.add(_dump([(0, 2000, 3), (3, 2010, 4), (0, 2020, 5)], 2100,
+                        lost=5), rid=2)
+
+        segments = store.select()
+        self.assertEqual([(s["seq"], s["rid"], s["start"], s["end"],
+                           s["channels"], s["lost"]) for s in segments],
+                         [(0, 1, 1000, 1010, [0, 3], 0),
+                          (1, 2, 2000, 2020, [0, 3], 5)])
+        self.assertEqual(store.select(start=1500), segments[1:])
+        self.assertEqual(store.select(end=1010), segments[:1])
+
+        def events(**kwargs):
+            dump = decode_dump(store.query(**kwargs))
+            self.assertIsInstance(dump.messages[-1], StoppedMessage)
+            return [(m.channel, m.timestamp, m.data)
+                    for m in dump.messages[:-1]]
+        self.assertEqual(events(), [(0, 1000, 1), (3, 1010, 2), (0, 2000, 3),
+                                    (3, 2010, 4), (0, 2020, 5)])
+        self.assertEqual(events(rid=2, channels=[0]), [(0, 2000, 3), (0, 2020, 5)])
+        self.assertEqual(events(start=1010, end=2020), [(3, 1010, 2), (0, 2000, 3),
+                                                        (3, 2010, 4)])
+        self.assertEqual(events(rid=3), [])
+        self.assertEqual(decode_dump(store.query()).log_channel, 1)
+
+        # The dumps are stored as they were captured.
+        with open(os.path.join(self.directory, "0000000001.dump"), "rb") as f:
+            self.assertIsInstance(decode_dump(f.read()).messages[0],
+                                  OutputMessage)
+
+        # The index is reloaded.
+        loaded = CaptureStore(self.directory)
+        self.assertEqual(loaded.select(), segments)
+        self.assertEqual(loaded.add(_dump([(0, 3000, 6)], 3100))["seq"], 2)
+
+    def test_rotation(self):
+        size = len(_dump([(0, 1000, 0)], 0))
+        store = CaptureStore(self.directory, max_size=3*size)
+        for i in range(5):
+            store.add(_dump([(0, 1000*(i + 1), i)], 0))
+        self.assertEqual([s["seq"] for s in store.select()], [2, 3, 4])
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["0000000002.dump", "0000000003.dump",
+                          "0000000004.dump", "index"])
+        self.assertEqual([s["seq"] for s in CaptureStore(self.directory).select()],
+                         [2, 3, 4])
+
+    def test_truncated(self):
+        store = CaptureStore(self.directory)
+        dump = _dump([(0, 1000, 1)], 1100)
+        for truncated in dump[:5], dump[:-1], dump[:-32]:
+            with self.assertRaises(ValueError):
+                store.add(truncated)
+        self.assertEqual(store.select(), [])
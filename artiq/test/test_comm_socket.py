@@ -0,0 +1,49 @@
+import os
+import socket
+import threading
+import unittest
+
+from artiq.coredevice.comm_socket import BufferedSocket
+
+
+class BufferedSocketCase(unittest.TestCase):
+    def setUp(self):
+        a, b = socket.socketpair()
+        self.client = BufferedSocket(a, buffer_size=1024)
+        self.server = BufferedSocket(b, buffer_size=1024)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def echo(self):
+        length = int.from_bytes(self.server.read(4), "big")
+        self.server.write(self.server.read(length))
+        self.server.flush()
+
+    def test_echo(self):
+        payload = os.urandom(100000)
+        thread = threading.Thread(target=self.echo)
+        thread.start()
+        self.client.write(len(payload).to_bytes(4, "big"))
+        self.client.write(payload)
+        # Reading flushes the request.
+        received = b"".join(self.client.read(length)
+                            for length in [1, 1023, 5000, len(payload) - 6024])
+        thread.join()
+        self.assertEqual(received, payload)
+
+    def test_write_buffering(self):
+        self.client.write(b"abc")
+        self.client.write(b"def")
+        self.server.socket.setblocking(False)
+        with self.assertRaises(BlockingIOError):
+            self.server.socket.recv(1)
+        self.client.flush()
+        self.server.socket.setblocking(True)
+        self.assertEqual(self.server.read(6), b"abcdef")
+
+    def test_closed(self):
+        self.client.socket.shutdown(socket.SHUT_WR)
+        with self.assertRaises(ConnectionResetError):
+            self.server.read(1)
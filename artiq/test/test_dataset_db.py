@@ -0,0 +1,76 @@
+import unittest
+import os
+import tempfile
+import shutil
+
+import numpy
+
+from sipyco import pyon
+
+from artiq.master.databases import DatasetDB
+
+
+class DatasetDBCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.persist_file = os.path.join(self.directory, "dataset_db.pyon")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_journal(self, db):
+        db._executor.submit(db._write_journal,
+                            db._take_journal_lines()).result()
+
+    def test_journal_replay(self):
+        db = DatasetDB(self.persist_file)
+        db.set("array", numpy.zeros(4), persist=True)
+        db.set("list", [], persist=True)
+        db.set("volatile", 1)
+        db.set("unpersisted", 2, persist=True)
+        for i in range(10):
+            db.update({"action": "append", "path": ["list", 1], "x": i})
+        db.update({"action": "setitem", "path": ["array", 1],
+                   "key": 2, "value": 1.})
+        db.set("unpersisted", 2, persist=False)
+        db.delete("volatile")
+        self.write_journal(db)
+        self.assertFalse(os.path.exists(self.persist_file))
+
+        loaded = DatasetDB(self.persist_file)
+        self.assertEqual(set(loaded.data.raw_view.keys()), {"array", "list"})
+        self.assertEqual(loaded.get("list"), list(range(10)))
+        numpy.testing.assert_array_equal(loaded.get("array"), [0, 0, 1, 0])
+
+    def test_truncated_journal(self):
+        db = DatasetDB(self.persist_file)
+        db.set("x", 1, persist=True)
+        self.write_journal(db)
+        with open(db.journal_file, "ab") as f:
+            f.write(b"{\"action\": \"setit")
+        loaded = DatasetDB(self.persist_file)
+        self.assertEqual(loaded.get("x"), 1)
+        loaded.set("x", 2)
+        self.write_journal(loaded)
+        self.assertEqual(DatasetDB(self.persist_file).get("x"), 2)
+
+    def test_compaction(self):
+        db = DatasetDB(self.persist_file)
+        db.compact_min_size = 0
+        db.set("x", list(range(100)), persist=True)
+        self.write_journal(db)
+        self.assertEqual(pyon.load_file(self.persist_file),
+                         {"x": list(range(100))})
+        # The journal was emptied by the compaction.
+        self.assertEqual(DatasetDB(self.persist_file).get("x"),
+                         list(range(100)))
+
+    def test_save(self):
+        db = DatasetDB(self.persist_file)
+        db.set("x", 1, persist=True)
+        db.save()
+        self.assertEqual(pyon.load_file(self.persist_file), {"x": 1})
+        # A snapshot edited by hand replaces the journal.
+        pyon.store_file(self.persist_file, {"y": 2})
+        self.assertEqual(DatasetDB(self.persist_file).data.raw_view,
+                         {"y": (True, 2)})
@@ -1,17 +1,22 @@
 """Tests for the (Env)Experiment-facing dataset interface."""
 
 import copy
+import time
 import unittest
 
+import h5py
+import numpy
+
 from sipyco.sync_struct import process_mod
 
 from artiq.experiment import EnvExperiment
-from artiq.master.worker_db import DatasetManager
+from artiq.master.worker_db import DatasetManager, ResultsWriter
 
 
 class MockDatasetDB:
     def __init__(self):
         self.data = dict()
+        self.mods = []
 
     def get(self, key):
         return self.data[key][1]
@@ -20,7 +25,9 @@ class MockDatasetDB:
         # Copy mod before applying to avoid sharing references to objects
         # between this and the DatasetManager, which would lead to mods being
         # applied twice.
-        process_mod(self.data, copy.deepcopy(mod))
+        mod = copy.deepcopy(mod)
+        self.mods.append(mod)
+        process_mod(self.data, mod)
 
     def delete(self, key):
         del self.data[key]
@@ -103,3 +110,168 @@ class ExperimentDatasetCase(unittest.TestCase):
         with self.assertRaises(KeyError):
             self.exp.append(KEY, 0)
 
+
+
+class WriteBehindCase(unittest.TestCase):
+    def setUp(self):
+        self.dataset_db = MockDatasetDB()
+        self.dataset_mgr = DatasetManager(self.dataset_db, flush_size=100)
+        self.exp = TestExperiment((None, self.dataset_mgr, None, None))
+
+    def test_coalesce_append(self):
+        self.exp.set(KEY, [], broadcast=True)
+        for i in range(10):
+            self.exp.append(KEY, i)
+        self.assertEqual(self.dataset_db.mods, [])
+        self.dataset_mgr.flush()
+        self.assertEqual(len(self.dataset_db.mods), 1)
+        self.assertEqual(self.dataset_db.data[KEY][1], list(range(10)))
+
+        for i in range(10, 20):
+            self.exp.append(KEY, i)
+        self.dataset_mgr.flush()
+        self.assertEqual(len(self.dataset_db.mods), 2)
+        self.assertEqual(self.dataset_db.data[KEY][1], list(range(20)))
+
+    def test_coalesce_setitem(self):
+        self.exp.set(KEY, [0, 0, 0], broadcast=True)
+        self.dataset_mgr.flush()
+        for i in range(10):
+            self.dataset_mgr.mutate(KEY, 1, i)
+            self.dataset_mgr.mutate(KEY, (1, 1), [i])
+        self.dataset_mgr.flush()
+        self.assertEqual(self.dataset_db.data[KEY][1],
+                         self.dataset_mgr.get(KEY))
+
+        self.dataset_mgr.mutate(KEY, -1, 1)
+        self.dataset_mgr.mutate(KEY, -1, 2)
+        n = len(self.dataset_db.mods)
+        self.dataset_mgr.flush()
+        self.assertEqual(len(self.dataset_db.mods), n + 1)
+        self.assertEqual(self.dataset_db.data[KEY][1][-1], 2)
+
+    def test_set_supersedes(self):
+        for i in range(10):
+            self.exp.set(KEY, i, broadcast=True)
+        self.dataset_mgr.flush()
+        self.assertEqual(len(self.dataset_db.mods), 1)
+        self.assertEqual(self.dataset_db.get(KEY), 9)
+
+    def test_flush_size(self):
+        self.exp.set(KEY, [], broadcast=True)
+        self.dataset_mgr.flush()
+        for i in range(100):
+            self.exp.set(str(i), i, broadcast=True)
+        self.assertEqual(len(self.dataset_db.mods), 101)
+
+    def test_get_flushes(self):
+        self.exp.set(KEY, [], broadcast=True, archive=False)
+        self.exp.append(KEY, 0)
+        self.assertEqual(self.exp.get(KEY), [0])
+        self.assertEqual(self.dataset_db.data[KEY][1], [0])
+
+    def test_snapshot(self):
+        # Objects reused by the experiment after a modification do not
+        # change what is sent.
+        buf = numpy.zeros(10)
+        self.exp.set(KEY, numpy.zeros(20), broadcast=True, archive=False)
+        self.dataset_mgr.flush()
+        buf[:] = 1
+        self.dataset_mgr.mutate(KEY, (0, 10), buf)
+        buf[:] = 2
+        self.dataset_mgr.mutate(KEY, (10, 20), buf)
+        buf[:] = 3
+        self.dataset_mgr.flush()
+        numpy.testing.assert_array_equal(self.dataset_db.data[KEY][1],
+                                         [1]*10 + [2]*10)
+
+        row = [0]
+        self.exp.set(KEY, [], broadcast=True, archive=False)
+        self.dataset_mgr.flush()
+        for i in range(3):
+            row[0] = i
+            self.exp.append(KEY, row)
+        self.dataset_mgr.flush()
+        self.assertEqual(self.dataset_db.data[KEY][1], [[0], [1], [2]])
+
+        # Also when the dataset itself is pending.
+        value = numpy.zeros(2)
+        self.exp.set(KEY, value, broadcast=True, archive=False)
+        value[0] = 1
+        self.dataset_mgr.mutate(KEY, 1, 2)
+        self.dataset_mgr.flush()
+        numpy.testing.assert_array_equal(self.dataset_db.data[KEY][1], [0, 2])
+
+    def test_flush_interval(self):
+        self.dataset_mgr.set_flush_policy(interval=0.1)
+        self.exp.set(KEY, [], broadcast=True)
+        for i in range(10):
+            self.exp.append(KEY, i)
+        self.assertEqual(self.dataset_db.mods, [])
+        # Sent without further modifications.
+        deadline = time.monotonic() + 10
+        while not self.dataset_db.mods and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.dataset_db.mods), 1)
+        self.assertEqual(self.dataset_db.data[KEY][1], list(range(10)))
+
+
+def _h5_file(name):
+    return h5py.File(name, "w", driver="core", backing_store=False)
+
+
+class ResultsWriterCase(unittest.TestCase):
+    def setUp(self):
+        self.dataset_db = MockDatasetDB()
+        self.dataset_mgr = DatasetManager(self.dataset_db)
+        self.exp = TestExperiment((None, self.dataset_mgr, None, None))
+        self.file = _h5_file("streamed.h5")
+        self.writer = ResultsWriter(self.file, compression="gzip",
+                                    sync_interval=0.)
+        self.dataset_mgr.results_writer = self.writer
+
+    def tearDown(self):
+        self.file.close()
+
+    def check_equivalent(self):
+        self.writer.finish()
+        with _h5_file("reference.h5") as reference:
+            self.dataset_mgr.write_hdf5(reference)
+            for group in "datasets", "archive":
+                self.assertEqual(set(self.file[group].keys()),
+                                 set(reference[group].keys()))
+                for k, v in reference[group].items():
+                    streamed = self.file[group][k]
+                    self.assertEqual(streamed.dtype, v.dtype)
+                    self.assertEqual(streamed.shape, v.shape)
+                    numpy.testing.assert_array_equal(streamed[()], v[()])
+
+    def test_append(self):
+        self.exp.set("ints", [])
+        self.exp.set("rows", [])
+        for i in range(100):
+            self.exp.append("ints", i)
+            self.exp.append("rows", [i, 2*i])
+        self.assertIsNotNone(self.file["datasets"]["ints"].chunks)
+        # An element of another type changes the type of the dataset.
+        self.exp.append("ints", 0.5)
+        self.check_equivalent()
+
+    def test_set_mutate_remove(self):
+        self.dataset_db.data["archived"] = (False, 42)
+        self.exp.set("scalar", 1)
+        self.exp.set("string", "abc")
+        self.exp.set("array", numpy.zeros(10))
+        self.exp.set("removed", [1, 2], broadcast=True)
+        self.dataset_mgr.mutate("array", (2, 4), [1., 2.])
+        self.exp.set("removed", [1, 2], broadcast=True, archive=False)
+        self.dataset_mgr.get("archived", archive=True)
+        self.check_equivalent()
+
+    def test_error_deferred(self):
+        self.exp.set("bad", object())
+        self.exp.set("good", 1)
+        with self.assertRaises(TypeError):
+            self.writer.finish()
+        self.exp.set("bad", 2)
+        self.check_equivalent()
@@ -0,0 +1,46 @@
+import unittest
+
+from artiq.master.worker_db import DeviceManager, DummyDevice
+
+
+class _DeviceDB:
+    def __init__(self, device_db):
+        self.device_db = device_db
+        self.requests = 0
+
+    def get_device_db(self):
+        self.requests += 1
+        return self.device_db
+
+
+class DeviceManagerCase(unittest.TestCase):
+    def setUp(self):
+        self.ddb = _DeviceDB({
+            "dummy": {"type": "dummy"},
+            "alias": "alias2",
+            "alias2": "dummy",
+            "other": {"type": "dummy", "arguments": {"x": [1, 2]}},
+            "controller": {"type": "controller", "host": "::1",
+                           "port": 1, "target_name": "x"},
+        })
+        self.device_mgr = DeviceManager(self.ddb)
+
+    def test_get(self):
+        dummy = self.device_mgr.get("dummy")
+        self.assertIsInstance(dummy, DummyDevice)
+        self.assertIs(self.device_mgr.get("alias"), dummy)
+        self.assertIsNot(self.device_mgr.get("other"), dummy)
+        self.assertEqual(len(self.device_mgr.active_devices), 2)
+        self.assertEqual(self.ddb.requests, 1)
+
+        self.device_mgr.close_devices()
+        self.assertIsNot(self.device_mgr.get("dummy"), dummy)
+        self.assertEqual(self.ddb.requests, 2)
+
+    def test_lazy_controller(self):
+        # No controller listens on the port: connecting fails only when
+        # the client is used.
+        controller = self.device_mgr.get("controller")
+        with self.assertRaises(OSError):
+            controller.ping()
+        self.device_mgr.close_devices()
@@ -0,0 +1,153 @@
+import unittest
+import asyncio
+import os
+import tempfile
+import shutil
+
+from artiq.master.experiments import (ExperimentDB, FilesystemBackend,
+                                      GitBackend)
+
+
+_experiment = """
+from artiq.experiment import *
+{imports}
+
+class {name}(EnvExperiment):
+    \"\"\"{title}\"\"\"
+    def build(self):
+        self.setattr_argument("x", NumberValue({default}))
+
+    def run(self):
+        pass
+"""
+
+
+class ScanCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.root = tempfile.mkdtemp()
+
+    def write(self, filename, content):
+        path = os.path.join(self.root, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+    def write_experiment(self, filename, name, title, imports=""):
+        self.write(filename, _experiment.format(
+            name=name, title=title, imports=imports,
+            default="helper.DEFAULT" if imports else "0"))
+
+    def scan(self, experiment_db):
+        self.loop.run_until_complete(experiment_db.scan_repository())
+        return (experiment_db.explist.raw_view,
+                experiment_db.status.raw_view["last_scan"])
+
+    def test_scan_cache(self):
+        self.write("helper.py", "DEFAULT = 1\n")
+        self.write_experiment("a.py", "A", "Experiment", "import helper")
+        self.write_experiment("b.py", "B", "Experiment")
+        self.write_experiment("sub/c.py", "C", "Experiment")
+        cache_file = os.path.join(self.root, ".scan_cache.pyon")
+        experiment_db = ExperimentDB(FilesystemBackend(self.root), dict(),
+                                     scan_cache=cache_file, scan_workers=2)
+        try:
+            explist, stats = self.scan(experiment_db)
+            self.assertEqual(set(explist.keys()),
+                             {"Experiment", "Experiment1", "sub/Experiment"})
+            self.assertEqual(explist["Experiment"]["file"], "a.py")
+            self.assertEqual(explist["Experiment1"]["file"], "b.py")
+            self.assertEqual(
+                explist["Experiment"]["arginfo"]["x"][0]["default"], 1)
+            self.assertEqual(stats["files"], 4)
+            self.assertEqual(stats["cache_hits"], 0)
+
+            explist, stats = self.scan(experiment_db)
+            self.assertEqual(stats["cache_hits"], 4)
+
+            # A change to an imported module invalidates the importer.
+            self.write("helper.py", "DEFAULT = 2\n")
+            explist, stats = self.scan(experiment_db)
+            self.assertEqual(stats["cache_hits"], 2)
+            self.assertEqual(
+                explist["Experiment"]["arginfo"]["x"][0]["default"], 2)
+        finally:
+            experiment_db.close()
+
+        # The cache persists across instances.
+        experiment_db = ExperimentDB(FilesystemBackend(self.root), dict(),
+                                     scan_cache=cache_file)
+        try:
+            explist, stats = self.scan(experiment_db)
+            self.assertEqual(stats["cache_hits"], 4)
+            self.assertEqual(len(explist), 3)
+        finally:
+            experiment_db.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        self.loop.close()
+
+
+class GitCase(unittest.TestCase):
+    def setUp(self):
+        try:
+            import pygit2
+        except ImportError:
+            self.skipTest("pygit2 is not installed")
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.root = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+
+        git = pygit2.init_repository(self.root)
+        signature = pygit2.Signature("test", "test@example.com")
+        self.revs = []
+        parents = []
+        for i in range(4):
+            tree = git.TreeBuilder()
+            tree.insert("experiment.py",
+                        git.create_blob("X = {}\n".format(i).encode()),
+                        pygit2.GIT_FILEMODE_BLOB)
+            rev = git.create_commit("HEAD", signature, signature,
+                                    "commit {}".format(i), tree.write(),
+                                    parents)
+            parents = [rev]
+            self.revs.append(str(rev))
+
+    def checkouts(self):
+        [directory] = os.listdir(self.cache_dir)
+        return [name for name in os.listdir(
+                    os.path.join(self.cache_dir, directory))
+                if name.startswith("checkout_")]
+
+    def test_release_uncached(self):
+        backend = GitBackend(self.root, self.cache_dir, cache_size=0)
+        try:
+            # Release the revisions before they are checked out.
+            requests = []
+            for rev in self.revs[:-1]:
+                requests.append(backend.request_rev_async(rev))
+                backend.release_rev(rev)
+            wd, message = backend.request_rev(self.revs[-1])
+            for request in requests:
+                self.loop.run_until_complete(request)
+            with open(os.path.join(wd, "experiment.py")) as f:
+                self.assertEqual(f.read(), "X = 3\n")
+            self.assertEqual(message, "commit 3")
+            self.assertEqual(self.checkouts(), [os.path.basename(wd)])
+
+            backend.release_rev(self.revs[-1])
+            backend.request_rev(self.revs[0])
+            backend.release_rev(self.revs[0])
+            backend._executor.submit(lambda: None).result()
+            self.assertEqual(self.checkouts(), [])
+            self.assertEqual(backend.size, 0)
+        finally:
+            backend.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.cache_dir)
+        self.loop.close()
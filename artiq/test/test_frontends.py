@@ -9,7 +9,7 @@ class TestFrontends(unittest.TestCase):
         """Test --help as a simple smoke test against catastrophic breakage."""
         commands = {
             "aqctl": [
-                "corelog"
+                "corelog", "coreanalyzer"
             ],
             "artiq": [
                 "client", "compile", "coreanalyzer", "coremgmt",
@@ -7,6 +7,7 @@ from time import time, sleep
 
 from artiq.experiment import *
 from artiq.master.scheduler import Scheduler
+from artiq.master.worker import WorkerPool
 
 
 class EmptyExperiment(EnvExperiment):
@@ -183,6 +184,14 @@ class SchedulerCase(unittest.TestCase):
         loop.run_until_complete(background_completed.wait())
         self.assertTrue(termination_ok)
 
+        stats = scheduler.stats.raw_view["pipelines"]["main"]
+        self.assertEqual(stats["queue_wait"]["count"], 2)
+        self.assertEqual(stats["prepare"]["count"], 2)
+        self.assertGreaterEqual(stats["paused"]["count"], 1)
+        # background -> empty, and back
+        self.assertGreaterEqual(stats["switch"]["count"], 2)
+        self.assertEqual(sum(stats["run"]["bins"]), stats["run"]["count"])
+
         loop.run_until_complete(scheduler.stop())
 
     def test_close_with_active_runs(self):
@@ -228,6 +237,38 @@ class SchedulerCase(unittest.TestCase):
         # sure we can stop the scheduler without hanging.
         loop.run_until_complete(scheduler.stop())
 
+    def test_delete_running(self):
+        """Check that the pipeline keeps running experiments after a
+        running one is deleted"""
+        loop = self.loop
+        scheduler = Scheduler(_RIDCounter(0), dict(), None)
+
+        expid_bg = _get_expid("BackgroundExperiment")
+        expid_bg["log_level"] = logging.CRITICAL
+        expid = _get_expid("EmptyExperiment")
+
+        background_running = asyncio.Event()
+        empty_deleted = asyncio.Event()
+        def notify(mod):
+            if mod == {"path": [0],
+                       "value": "running",
+                       "key": "status",
+                       "action": "setitem"}:
+                background_running.set()
+            if mod == {"path": [],
+                       "key": 1,
+                       "action": "delitem"}:
+                empty_deleted.set()
+        scheduler.notifier.publish = notify
+
+        scheduler.start()
+        scheduler.submit("main", expid_bg, 0, None, False)
+        loop.run_until_complete(background_running.wait())
+        scheduler.delete(0)
+        scheduler.submit("main", expid, 0, None, False)
+        loop.run_until_complete(asyncio.wait_for(empty_deleted.wait(), 30))
+        loop.run_until_complete(scheduler.stop())
+
     def test_flush(self):
         loop = self.loop
         scheduler = Scheduler(_RIDCounter(0), dict(), None)
@@ -262,5 +303,71 @@ class SchedulerCase(unittest.TestCase):
         loop.run_until_complete(done.wait())
         loop.run_until_complete(scheduler.stop())
 
+    def test_many_runs(self):
+        """Check that run selection does not degrade with the queue length"""
+        loop = self.loop
+        scheduler = Scheduler(_RIDCounter(0), dict(), None)
+        expid = _get_expid("EmptyExperiment")
+        n = 10000
+
+        scheduler.start()
+        # Timed runs far in the future stay pending, so that no worker is
+        # spawned and only the scheduling overhead is measured.
+        late = time() + 100000
+        t0 = time()
+        for i in range(n):
+            scheduler.submit("main", expid, i % 10, late + i, False)
+        loop.run_until_complete(asyncio.sleep(0.1))
+        t1 = time()
+        print(n/(t1 - t0), "submissions/s")
+
+        pipeline = scheduler._pipelines["main"]
+        t0 = time()
+        for i in range(n):
+            delay = pipeline._prepare._get_run()
+            self.assertGreater(delay, 0.0)
+        t1 = time()
+        print((t1 - t0)/n, "s per prepare stage wakeup")
+        self.assertLess((t1 - t0)/n, 1e-3)
+
+        t0 = time()
+        loop.run_until_complete(scheduler.stop())
+        t1 = time()
+        print(n/(t1 - t0), "deletions/s")
+        self.assertFalse(scheduler._pipelines)
+
+    def test_worker_pool(self):
+        loop = self.loop
+        worker_pool = WorkerPool(dict(), size=1, max_runs=2)
+        scheduler = Scheduler(_RIDCounter(0), dict(), None, worker_pool)
+        expid = _get_expid("EmptyExperiment")
+
+        deleted = set()
+        run_deleted = asyncio.Event()
+        def notify(mod):
+            if mod["action"] == "delitem" and mod["path"] == []:
+                deleted.add(mod["key"])
+                run_deleted.set()
+        scheduler.notifier.publish = notify
+
+        async def pool_filled():
+            while not worker_pool.stats.raw_view["idle"]:
+                await asyncio.sleep(0.1)
+
+        scheduler.start()
+        for rid in range(2):
+            loop.run_until_complete(pool_filled())
+            run_deleted.clear()
+            scheduler.submit("main", expid, 0, None, False)
+            while rid not in deleted:
+                loop.run_until_complete(run_deleted.wait())
+                run_deleted.clear()
+        stats = worker_pool.stats.raw_view
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 0)
+        self.assertEqual(stats["hit_rate"], 1.0)
+        self.assertGreaterEqual(stats["spawned"], 1)
+        loop.run_until_complete(scheduler.stop())
+
     def tearDown(self):
         self.loop.close()
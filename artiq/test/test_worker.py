@@ -3,8 +3,11 @@ import logging
 import asyncio
 import sys
 import os
+import time
 from time import sleep
 
+import numpy
+
 from artiq.experiment import *
 from artiq.master.worker import *
 
@@ -53,6 +56,34 @@ class WatchdogTimeoutInBuild(EnvExperiment):
         pass
 
 
+class DatasetTransfer(EnvExperiment):
+    size = 10**6
+
+    def build(self):
+        pass
+
+    def run(self):
+        data = numpy.random.rand(self.size)
+        n = 10
+        t0 = time.monotonic()
+        for i in range(n):
+            self.set_dataset("data", data, broadcast=True, archive=False)
+        t1 = time.monotonic()
+        self.set_dataset("array_time", (t1 - t0)/n, broadcast=True)
+
+        n = 1000
+        t0 = time.monotonic()
+        for i in range(n):
+            self.set_dataset("scalar", i, broadcast=True, archive=False)
+        t1 = time.monotonic()
+        self.set_dataset("scalar_time", (t1 - t0)/n, broadcast=True)
+
+
+class DatasetTransferPYON(DatasetTransfer):
+    # PYON lines are limited to a few MiB by the pipe reader of the master.
+    size = 10**5
+
+
 async def _call_worker(worker, expid):
     try:
         await worker.build(0, "main", None, expid, 0)
@@ -63,7 +94,7 @@ async def _call_worker(worker, expid):
         await worker.close()
 
 
-def _run_experiment(class_name):
+def _run_experiment(class_name, handlers=dict(), binary_ipc=True):
     expid = {
         "log_level": logging.WARNING,
         "file": sys.modules[__name__].__file__,
@@ -71,7 +102,7 @@ def _run_experiment(class_name):
         "arguments": dict()
     }
     loop = asyncio.get_event_loop()
-    worker = Worker({})
+    worker = Worker(handlers, binary_ipc=binary_ipc)
     loop.run_until_complete(_call_worker(worker, expid))
 
 
@@ -105,5 +136,22 @@ class WorkerCase(unittest.TestCase):
         with self.assertRaises(WorkerWatchdogTimeout):
             _run_experiment("WatchdogTimeoutInBuild")
 
+    def test_dataset_transfer(self):
+        for binary_ipc, class_name in ((False, "DatasetTransferPYON"),
+                                       (True, "DatasetTransfer")):
+            datasets = dict()
+            def update_dataset(mod):
+                datasets[mod["key"]] = mod["value"][1]
+            _run_experiment(class_name,
+                            {"update_dataset": update_dataset}, binary_ipc)
+            data = datasets["data"]
+            self.assertEqual(data.shape, (globals()[class_name].size,))
+            self.assertEqual(data.dtype, numpy.float64)
+            self.assertEqual(datasets["scalar"], 999)
+            protocol = "binary" if binary_ipc else "PYON"
+            print(protocol, "array:", datasets["array_time"], "s/message,",
+                  data.nbytes/datasets["array_time"]/1e6, "MB/s")
+            print(protocol, "scalar:", datasets["scalar_time"], "s/message")
+
     def tearDown(self):
         self.loop.close()